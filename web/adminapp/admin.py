@@ -1,3 +1,7 @@
 from django.contrib import admin
+from .models import EmailOutboxModel
 
 # Register your models here.
+
+
+admin.site.register(EmailOutboxModel)
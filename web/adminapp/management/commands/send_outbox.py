@@ -0,0 +1,61 @@
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from adminapp.outbox import SMTPSession, SMTPUnavailable, drain, has_credentials, sender
+
+
+class Command(BaseCommand):
+    help = ("Delivers queued emails in batches over one SMTP connection that is kept open between "
+            "batches and reopened when the server drops it. Runs until stopped unless --once is given.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Messages claimed per batch (default EMAIL_OUTBOX_BATCH_SIZE).")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds to wait when the outbox is empty.")
+        parser.add_argument('--idle-disconnect', type=float, default=60.0,
+                            help="Close the SMTP connection after this many idle seconds.")
+        parser.add_argument('--once', action='store_true', help="Drain what is due now, then exit.")
+
+    def handle(self, *args, **options):
+        if not sender():
+            raise CommandError("Set DEFAULT_FROM_EMAIL (or EMAIL_HOST_USER) in the environment.")
+        if not has_credentials():
+            if settings.EMAIL_HOST_USER or settings.EMAIL_HOST_PASSWORD:
+                self.stderr.write("⚠️ Only one of EMAIL_HOST_USER and EMAIL_HOST_PASSWORD is set; "
+                                  "sending without logging in.")
+            else:
+                self.stdout.write(f"No SMTP credentials; sending through {settings.EMAIL_HOST} unauthenticated.")
+
+        session = SMTPSession()
+        failures = 0
+        idle_since = time.monotonic()
+        try:
+            while True:
+                try:
+                    sent, failed = drain(session, options['batch_size'])
+                    failures = 0
+                except (SMTPUnavailable, smtplib.SMTPException, OSError) as e:
+                    # Server unreachable: back off before trying the outbox again.
+                    failures += 1
+                    delay = min(getattr(settings, 'EMAIL_OUTBOX_BACKOFF_SECONDS', 30) * 2 ** (failures - 1),
+                                getattr(settings, 'EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', 3600))
+                    self.stderr.write(f"SMTP unavailable: {e}")
+                    if options['once']:
+                        return
+                    time.sleep(delay)
+                    continue
+
+                if sent or failed:
+                    idle_since = time.monotonic()
+                    self.stdout.write(f"Sent {sent}, failed {failed}")
+                    continue
+                if options['once']:
+                    return
+                if session.server is not None and time.monotonic() - idle_since > options['idle_disconnect']:
+                    session.close()
+                time.sleep(options['poll'])
+        finally:
+            session.close()
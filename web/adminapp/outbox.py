@@ -0,0 +1,163 @@
+import smtplib
+from datetime import timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import EmailOutboxModel
+
+
+# Requests only write a row to the outbox; `manage.py send_outbox` delivers
+# it over one long-lived SMTP connection, retrying with backoff.
+
+def enqueue(subject, body, receiver):
+    return EmailOutboxModel.objects.create(receiver=receiver, subject=subject, body=body)
+
+
+async def aenqueue(subject, body, receiver):
+    return await EmailOutboxModel.objects.acreate(receiver=receiver, subject=subject, body=body)
+
+
+def sender():
+    return settings.DEFAULT_FROM_EMAIL
+
+
+def has_credentials():
+    return bool(getattr(settings, 'EMAIL_HOST_USER', '') and getattr(settings, 'EMAIL_HOST_PASSWORD', ''))
+
+
+def build_message(email):
+    msg = MIMEMultipart()
+    msg['From'] = sender()
+    msg['To'] = email.receiver
+    msg['Subject'] = email.subject
+    msg.attach(MIMEText(email.body, 'plain'))
+    return msg.as_string()
+
+
+class SMTPUnavailable(Exception):
+    """The SMTP server couldn't be reached or refused our login."""
+
+
+class SMTPSession:
+    """One SMTP connection, opened on first use and reopened when the server
+    drops it, so a batch of messages pays for STARTTLS and login once."""
+
+    def __init__(self):
+        self.server = None
+
+    def connect(self):
+        self.close()
+        try:
+            server = smtplib.SMTP(getattr(settings, 'EMAIL_HOST', 'localhost'), getattr(settings, 'EMAIL_PORT', 25),
+                                  timeout=getattr(settings, 'EMAIL_TIMEOUT', None) or 30)
+        except (smtplib.SMTPException, OSError) as e:
+            raise SMTPUnavailable(e) from e
+        try:
+            if getattr(settings, 'EMAIL_USE_TLS', False):
+                server.starttls()
+            # Without credentials, send through the relay unauthenticated.
+            if has_credentials():
+                server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
+        except (smtplib.SMTPException, OSError) as e:
+            server.close()
+            raise SMTPUnavailable(e) from e
+        self.server = server
+
+    def send(self, receiver, message):
+        if self.server is None:
+            self.connect()
+        try:
+            self.server.sendmail(sender(), receiver, message)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            # The server closed an idle connection; one fresh try.
+            self.connect()
+            self.server.sendmail(sender(), receiver, message)
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+            self.server = None
+
+
+def backoff(attempts):
+    base = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_SECONDS', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), getattr(settings, 'EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', 3600)))
+
+
+def claim_batch(size):
+    """Claims up to ``size`` due messages for this worker. Each row is claimed
+    with a conditional update, so two workers never send the same message; a
+    claim lapses after EMAIL_OUTBOX_LEASE_SECONDS in case the worker died."""
+    now = timezone.now()
+    lease = now + timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LEASE_SECONDS', 300))
+    due = Q(status__in=[EmailOutboxModel.PENDING, EmailOutboxModel.SENDING], next_attempt__lte=now)
+    ids = EmailOutboxModel.objects.filter(due).order_by('next_attempt', 'id').values_list('id', flat=True)[:size]
+    claimed = [
+        id for id in ids
+        if EmailOutboxModel.objects.filter(due, id=id).update(status=EmailOutboxModel.SENDING, next_attempt=lease)
+    ]
+    return list(EmailOutboxModel.objects.filter(id__in=claimed).order_by('id'))
+
+
+def mark_sent(email):
+    EmailOutboxModel.objects.filter(id=email.id).update(
+        status=EmailOutboxModel.SENT, attempts=F('attempts') + 1, sent_at=timezone.now(), last_error='')
+
+
+def mark_failed(email, error, permanent=False):
+    """Schedules another try with exponential backoff, or gives up after
+    EMAIL_OUTBOX_MAX_ATTEMPTS or on a permanent (5xx) rejection."""
+    attempts = email.attempts + 1
+    if permanent or attempts >= getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 5):
+        status, next_attempt = EmailOutboxModel.FAILED, timezone.now()
+    else:
+        status, next_attempt = EmailOutboxModel.PENDING, timezone.now() + backoff(attempts)
+    EmailOutboxModel.objects.filter(id=email.id).update(
+        status=status, attempts=attempts, next_attempt=next_attempt, last_error=str(error)[:1000])
+
+
+def release(emails):
+    """Hands claimed but untried messages straight back to the queue."""
+    EmailOutboxModel.objects.filter(id__in=[email.id for email in emails], status=EmailOutboxModel.SENDING).update(
+        status=EmailOutboxModel.PENDING, next_attempt=timezone.now())
+
+
+def drain(session, batch_size=None):
+    """Sends one batch of due messages over ``session``. Returns (sent, failed).
+    If the server can't be reached at all, the untried messages are released
+    without using up an attempt, since the server never saw them, and the
+    error is raised."""
+    batch = claim_batch(batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50))
+    sent = failed = 0
+    for n, email in enumerate(batch):
+        try:
+            session.send(email.receiver, build_message(email))
+        except SMTPUnavailable:
+            release(batch[n:])
+            raise
+        except smtplib.SMTPRecipientsRefused as e:
+            codes = [code for code, _ in e.recipients.values()]
+            mark_failed(email, e, permanent=all(code >= 500 for code in codes))
+            failed += 1
+        except smtplib.SMTPResponseException as e:
+            mark_failed(email, e, permanent=e.smtp_code >= 500)
+            failed += 1
+            if e.smtp_code == 421:
+                # The server is closing the connection on us.
+                session.close()
+        except (smtplib.SMTPException, OSError) as e:
+            mark_failed(email, e)
+            release(batch[n + 1:])
+            session.close()
+            raise
+        else:
+            mark_sent(email)
+            sent += 1
+    return sent, failed
@@ -1,3 +1,188 @@
-from django.test import TestCase
+import io
+import socketserver
+import threading
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import outbox
+from .models import EmailOutboxModel
+from .views import send_email
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts any AUTH PLAIN login, records
+    each delivered message, answers RCPT for addresses in ``server.refuse``
+    with their code, and hangs up after ``server.drop_after`` messages on a
+    connection."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        delivered = 0
+        rcpt = None
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN")
+            elif command == 'HELO':
+                self.reply("250 localhost")
+            elif command == 'AUTH':
+                server.logins += 1
+                self.reply("235 authenticated")
+            elif command == 'MAIL':
+                self.reply("250 OK")
+            elif command == 'RCPT':
+                rcpt = line.split(':', 1)[1].strip().strip('<>')
+                code = server.refuse.get(rcpt)
+                self.reply(f"{code} refused" if code else "250 OK")
+            elif command == 'DATA':
+                self.reply("354 go ahead")
+                while self.rfile.readline() != b".\r\n":
+                    pass
+                server.messages.append(rcpt)
+                delivered += 1
+                self.reply("250 queued")
+                if delivered == server.drop_after:
+                    return
+            elif command in ('RSET', 'NOOP'):
+                self.reply("250 OK")
+            elif command == 'QUIT':
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.logins = 0
+        self.messages = []
+        self.refuse = {}
+        self.drop_after = None
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.smtp = SMTPStandIn()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.addCleanup(self.smtp.server_close)
+        self.addCleanup(self.smtp.shutdown)
+        settings = override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.smtp.server_address[1],
+                                     EMAIL_USE_TLS=False, EMAIL_HOST_USER='', DEFAULT_FROM_EMAIL='bank@example.com',
+                                     EMAIL_TIMEOUT=5)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.session = outbox.SMTPSession()
+        self.addCleanup(self.session.close)
+
+    def queue(self, count):
+        for n in range(count):
+            send_email("OTP Verification code", f"otp : {n}", f"user{n}@example.com")
+
+    def statuses(self):
+        return list(EmailOutboxModel.objects.order_by('id').values_list('status', flat=True))
+
+    def test_send_email_only_queues(self):
+        self.queue(1)
+        self.assertEqual(self.statuses(), ['Pending'])
+        self.assertEqual(self.smtp.connections, 0)
+
+    def test_batch_shares_one_connection(self):
+        self.queue(5)
+        self.assertEqual(outbox.drain(self.session), (5, 0))
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(self.smtp.messages, [f"user{n}@example.com" for n in range(5)])
+        self.assertEqual(self.statuses(), ['Sent'] * 5)
+
+    def test_reconnects_when_server_hangs_up(self):
+        self.smtp.drop_after = 2
+        self.queue(5)
+        self.assertEqual(outbox.drain(self.session), (5, 0))
+        self.assertEqual(self.smtp.connections, 3)
+        self.assertEqual(len(self.smtp.messages), 5)
+
+    def test_temporary_failure_backs_off(self):
+        self.smtp.refuse['user0@example.com'] = 451
+        self.queue(2)
+        self.assertEqual(outbox.drain(self.session), (1, 1))
+        email = EmailOutboxModel.objects.get(receiver='user0@example.com')
+        self.assertEqual((email.status, email.attempts), ('Pending', 1))
+        self.assertGreater(email.next_attempt, timezone.now() + timedelta(seconds=20))
+        self.assertEqual(outbox.drain(self.session), (0, 0))
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_gives_up_after_max_attempts(self):
+        self.smtp.refuse['user0@example.com'] = 451
+        self.queue(1)
+        for _ in range(2):
+            outbox.drain(self.session)
+            EmailOutboxModel.objects.update(next_attempt=timezone.now())
+        email = EmailOutboxModel.objects.get()
+        self.assertEqual((email.status, email.attempts), ('Failed', 2))
+
+    def test_permanent_rejection_fails_at_once(self):
+        self.smtp.refuse['user0@example.com'] = 550
+        self.queue(1)
+        outbox.drain(self.session)
+        self.assertEqual(self.statuses(), ['Failed'])
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+    def test_outage_does_not_use_up_attempts(self):
+        self.queue(3)
+        with override_settings(EMAIL_PORT=1):
+            for _ in range(3):
+                with self.assertRaises(outbox.SMTPUnavailable):
+                    outbox.drain(self.session)
+        self.assertEqual(self.statuses(), ['Pending'] * 3)
+        self.assertFalse(EmailOutboxModel.objects.filter(attempts__gt=0).exists())
+        self.assertEqual(outbox.drain(self.session), (3, 0))
+
+    def test_claimed_messages_are_not_sent_twice(self):
+        self.queue(3)
+        self.assertEqual(len(outbox.claim_batch(10)), 3)
+        self.assertEqual(outbox.claim_batch(10), [])
+
+    def test_worker_sends_unauthenticated_without_credentials(self):
+        self.queue(2)
+        call_command('send_outbox', once=True, stdout=io.StringIO())
+        self.assertEqual(self.statuses(), ['Sent'] * 2)
+        self.assertEqual((self.smtp.connections, self.smtp.logins), (1, 0))
+
+    @override_settings(EMAIL_HOST_USER='bank@example.com', EMAIL_HOST_PASSWORD='')
+    def test_worker_does_not_log_in_without_a_password(self):
+        self.queue(1)
+        stderr = io.StringIO()
+        call_command('send_outbox', once=True, stdout=io.StringIO(), stderr=stderr)
+        self.assertEqual(self.statuses(), ['Sent'])
+        self.assertEqual(self.smtp.logins, 0)
+        self.assertIn('EMAIL_HOST_PASSWORD', stderr.getvalue())
+
+    @override_settings(DEFAULT_FROM_EMAIL='')
+    def test_worker_requires_a_sender(self):
+        self.queue(1)
+        with self.assertRaisesMessage(CommandError, 'DEFAULT_FROM_EMAIL'):
+            call_command('send_outbox', once=True)
+        self.assertEqual(self.statuses(), ['Pending'])
+
+    @override_settings(EMAIL_HOST_USER='bank@example.com', EMAIL_HOST_PASSWORD='secret')
+    def test_worker_logs_in_once_per_connection(self):
+        self.queue(3)
+        call_command('send_outbox', once=True, stdout=io.StringIO())
+        self.assertEqual(self.statuses(), ['Sent'] * 3)
+        self.assertEqual((self.smtp.connections, self.smtp.logins), (1, 1))
@@ -3,42 +3,19 @@ from django.contrib import auth, messages
 from branchapp.models import BranchModel, ComplaintModel
 from branchapp.forms import ComplaintForm
 from userapp.models import UserModel, UserComplaintModel
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 from userapp.forms import UserComplaintForm
 from django.views.decorators.csrf import csrf_exempt
+from . import outbox
 
 
-# Email credentials
-SMTP_SERVER = "smtp.gmail.com"  # Change for Outlook/Yahoo
-SMTP_PORT = 587
-# EMAIL_SENDER = "jaganbaiju257@gmail.com"
-EMAIL_SENDER = "blessyop89@gmail.com"
-EMAIL_PASSWORD = "eshn ysii lqvj qzcr"
-# EMAIL_RECEIVER = "jboffcl2001@gmail.com"
+def send_email(sub, mssg, EMAIL_RECEIVER):
+    """Queues an email; `manage.py send_outbox` delivers it (SMTP settings
+    are EMAIL_* in project/settings.py)."""
+    outbox.enqueue(sub, mssg, EMAIL_RECEIVER)
 
 
-def send_email(sub, mssg, EMAIL_RECEIVER):
-    try:
-        # Create the email message
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_SENDER
-        msg['To'] = EMAIL_RECEIVER
-        msg['Subject'] = sub
-        body = mssg
-        msg.attach(MIMEText(body, 'plain'))
-
-        # Connect to SMTP server and send email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()  # Secure the connection
-        server.login(EMAIL_SENDER, EMAIL_PASSWORD)
-        server.sendmail(EMAIL_SENDER, EMAIL_RECEIVER, msg.as_string())
-        server.quit()
-
-        print("✅ Email sent successfully!")
-    except Exception as e:
-        print(f"❌ Error: {e}")
+async def asend_email(sub, mssg, EMAIL_RECEIVER):
+    await outbox.aenqueue(sub, mssg, EMAIL_RECEIVER)
 
 
 def admin_login(request):
@@ -16,5 +16,6 @@ urlpatterns = [
     path('allLoan', views.all_loan_list, name='allLoan'),
     path('approveLoan/<int:id>/', views.approve_loan, name='approveLoan'),
     path('view_transaction', views.transaction_history, name='view_transaction'),
+    path('view_transaction/export', views.transaction_export, name='transaction_export'),
     path('secondaryUserByBranch', views.secondary_user_by_branch, name='secondaryUserByBranch'),
 ]
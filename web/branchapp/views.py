@@ -2,7 +2,10 @@ from django.shortcuts import render, redirect
 from .models import BranchModel, ComplaintModel
 from .forms import BranchForm, LoanForm
 from django.contrib import messages
+from django.http import JsonResponse
 from userapp . models import UserModel, AccountModel, LoanModel, TransactionModel, FamilyModel
+from userapp import transfers
+from userapp.history import transaction_history_page, transaction_history_context, InvalidCursor, export_response
 
 
 def branch_delete(request, id):
@@ -105,24 +108,41 @@ def approve_loan(request, id):
     loan = LoanModel.objects.get(id=id)
     forms = LoanForm(request.POST or None, instance=loan)
     if forms.is_valid():
-        forms.save()
-
-        if loan.status == "Approved":
-            amount = loan.loan_amount
-            account = AccountModel.objects.get(account_number=loan.account_number.account_number)
-            account.deposit(amount)
-
+        if forms.cleaned_data['status'] == "Approved":
+            # Approval and disbursement happen together, once.
+            try:
+                transfers.disburse_loan(loan.id)
+            except transfers.TransferError as e:
+                messages.error(request, str(e))
             return redirect('branch_app:branchPage')
 
+        forms.save()
+
     return render(request, 'approve_loan.html', {'forms': forms, 'loan': loan})
 
 
 def transaction_history(request):
     b_id = request.session.get('branch_id')
-    branch_data = BranchModel.objects.get(id=b_id)
-    transaction_history = TransactionModel.objects.all().filter(branch_name=branch_data)
+    transactions = TransactionModel.objects.filter(branch_name_id=b_id)
 
-    return render(request, 'view_transaction.html', {'transaction_history': transaction_history, 'branch': True})
+    if request.headers.get('accept') == 'application/json':
+        try:
+            return JsonResponse(transaction_history_page(request, transactions))
+        except InvalidCursor as e:
+            return JsonResponse({"message": str(e), "success": False}, status=400)
+
+    return render(request, 'view_transaction.html', {**transaction_history_context(request, transactions),
+                                                     'branch': True})
+
+
+def transaction_export(request):
+    b_id = request.session.get('branch_id')
+    if not b_id:
+        return redirect('branch_app:branchLogin')
+    try:
+        return export_response(request, TransactionModel.objects.filter(branch_name_id=b_id), 'branch_transactions')
+    except ValueError as e:
+        return JsonResponse({"message": str(e), "success": False}, status=400)
 
 
 def secondary_user_by_branch(request):
@@ -78,10 +78,14 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Tests run against a file rather than SQLite's default in-memory database,
+# which a single connection owns, so the concurrent-transfer test can give
+# each thread its own connection.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -127,11 +131,138 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'assets')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Retained enrollment photos (used to re-embed faces after a model upgrade).
+# Keep this outside MEDIA_ROOT and STATIC_ROOT so no URL route serves it.
+FACE_IMAGE_ROOT = os.path.join(BASE_DIR, 'face_images')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Load and warm the face model, and load the 1:N search index (IVF index or
+# exact gallery), in the background at startup. Off by default
+# so migrate/shell/tests don't import TensorFlow; set FACE_MODEL_WARMUP=1 in
+# the environment of the web server processes.
+FACE_MODEL_WARMUP = os.environ.get('FACE_MODEL_WARMUP', '') == '1'
+
+# Dotted path of the embedding engine. userapp.engines.HashStubEngine returns
+# deterministic vectors without TensorFlow, for load tests and CI.
+FACE_EMBEDDING_ENGINE = os.environ.get('FACE_EMBEDDING_ENGINE', 'userapp.engines.DeepFaceEngine')
+
+# Every stored embedding is tagged with the model that produced it, and logins
+# embed the probe with that same model. Engines for model names other than
+# the configured one are looked up here; unlisted names are DeepFace models,
+# tagged "model/detector" (e.g. "ArcFace/retinaface").
+# FACE_MODEL_THRESHOLDS overrides userapp.distance.MODEL_THRESHOLDS, by tag or
+# model name, e.g. {'ArcFace': {'cosine': 0.6}}. Move rows to a new model with
+# `reembed_faces`.
+FACE_EMBEDDING_ENGINES = {'HashStub512': 'userapp.engines.HashStubEngine'}
+FACE_MODEL_THRESHOLDS = {}
+
+# Thresholds chosen by `manage.py calibrate_face_threshold` on a labeled
+# dataset. They replace the defaults but not FACE_MODEL_THRESHOLDS; restart
+# the web workers after recalibrating.
+FACE_THRESHOLDS_FILE = os.path.join(BASE_DIR, 'face_thresholds.json')
+
+# Transaction history is paginated by a (date, id) cursor; clients may ask
+# for up to TRANSACTION_MAX_PAGE_SIZE rows with ?page_size=.
+TRANSACTION_PAGE_SIZE = 50
+TRANSACTION_MAX_PAGE_SIZE = 200
+
+# Transaction exports are read from the database and written out this many
+# rows at a time.
+EXPORT_CHUNK_SIZE = 2000
+
+# Outgoing email. send_email only queues a row in adminapp's outbox; run
+# `python manage.py send_outbox` to deliver it over one reused SMTP
+# connection. Failed sends are retried after EMAIL_OUTBOX_BACKOFF_SECONDS,
+# doubling each time, and given up after EMAIL_OUTBOX_MAX_ATTEMPTS.
+# Credentials come from the environment only. Without them send_outbox
+# sends unauthenticated, for a relay that trusts the host.
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 587))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL') or EMAIL_HOST_USER
+EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', '1') == '1'
+EMAIL_TIMEOUT = 30
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_BACKOFF_SECONDS = 30
+EMAIL_OUTBOX_MAX_BACKOFF_SECONDS = 3600
+
+# Face embedding micro-batching: concurrent requests that arrive within
+# FACE_BATCH_MAX_WAIT_MS of each other share one forward pass.
+FACE_BATCH_MAX_SIZE = 16
+FACE_BATCH_MAX_WAIT_MS = 10
+
+# Face uploads are checked from the header before decoding and downscaled to
+# FACE_DECODE_MAX_SIDE pixels on the long side while decoding.
+FACE_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+FACE_MAX_UPLOAD_PIXELS = 50_000_000
+FACE_DECODE_MAX_SIDE = 1024
+
+# Quality gate run before inference. Frames that are too dark, too bright,
+# flat, blurry, or without a large enough face are rejected with a reason code.
+FACE_QUALITY_CHECK = True
+FACE_DETECT_IN_QUALITY_CHECK = True
+FACE_MIN_BRIGHTNESS = 40
+FACE_MAX_BRIGHTNESS = 220
+FACE_MIN_CONTRAST = 15
+FACE_MIN_SHARPNESS = 30
+FACE_MIN_FACE_SIZE = 80
+
+# Most frames accepted by the multi-frame login/verification endpoints.
+FACE_MULTI_FRAME_MAX = 5
+
+# Embeddings of recently uploaded images, keyed by a hash of the file bytes,
+# so that an app retry with the same photo skips inference.
+FACE_EMBEDDING_CACHE_SIZE = 1024
+FACE_EMBEDDING_CACHE_TTL = 300
+
+# Run face inference in this many worker processes, each with its own model
+# (0 runs it in the web process). Beyond QUEUE_DEPTH full batches waiting,
+# requests are refused at once; callers wait up to FACE_INFERENCE_TIMEOUT
+# seconds in total, time spent queued included.
+FACE_INFERENCE_POOL_SIZE = 0
+FACE_INFERENCE_QUEUE_DEPTH = 8
+FACE_INFERENCE_TIMEOUT = 10.0
+
+# Path of the Unix socket served by `manage.py run_inference_server`. When
+# set, workers send images to that one process instead of loading their own
+# model, and fall back to in-process inference if it is unreachable.
+FACE_INFERENCE_SOCKET = None
+
+# Threads the async face views (login, family_login, face_verification)
+# use to decode uploads and wait for embeddings.
+FACE_ASYNC_WORKERS = 32
+
+# Metric used to compare face embeddings: 'cosine', 'euclidean' or
+# 'euclidean_l2'. Each has its own threshold in userapp/distance.py.
+FACE_DISTANCE_METRIC = 'cosine'
+
+# Every worker keeps the enrolled faces in memory for 1:N search. Faces
+# enrolled, re-enrolled or deleted through other workers are picked up before
+# a search once this many seconds have passed since the last check; 0 checks
+# before every search. The same applies to the IVF index. The duplicate check
+# at enrollment always checks first.
+FACE_GALLERY_SYNC_SECONDS = 5
+
+# Approximate 1:N search for large galleries. Build the index with
+# `manage.py build_face_ivf`; until it exists, identification scans every
+# enrolled face exactly. FACE_IVF_NPROBE is the number of lists searched.
+FACE_IVF_INDEX_DIR = os.path.join(BASE_DIR, 'face_index')
+FACE_IVF_NPROBE = 8
+
+# Enrollment searches the gallery for the same face under another identity.
+# 'flag' enrolls anyway and records the matches in IdentityMatchModel for
+# review; 'reject' refuses the enrollment. FACE_DUPLICATE_MIN_SIMILARITY is a
+# cosine similarity; None means the cosine login threshold.
+FACE_DUPLICATE_POLICY = 'flag'
+FACE_DUPLICATE_TOP_K = 5
+FACE_DUPLICATE_MIN_SIMILARITY = None
+
 CORS_ALLOW_ALL_ORIGINS = True  # For development only!
 # Or restrict:
 # CORS_ALLOWED_ORIGINS = ['http://localhost:19006', 'http://192.168.1.100:19006']
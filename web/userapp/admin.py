@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import UserModel, AccountModel, LoanModel, FamilyModel, TransactionModel, UserComplaintModel
+from .models import UserModel, AccountModel, LoanModel, FamilyModel, TransactionModel, UserComplaintModel, IdentityMatchModel, \
+    LedgerEntryModel, BalanceSnapshotModel
 # Register your models here.
 
 
@@ -10,3 +11,6 @@ admin.site.register(FamilyModel)
 admin.site.register(TransactionModel)
 admin.site.register(UserComplaintModel)
 
+admin.site.register(IdentityMatchModel)
+admin.site.register(LedgerEntryModel)
+admin.site.register(BalanceSnapshotModel)
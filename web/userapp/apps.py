@@ -1,6 +1,32 @@
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class UserappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'userapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        # The face stack loads lazily on first use. Web servers opt into an
+        # eager warm-up (FACE_MODEL_WARMUP) so the first login isn't slow; it
+        # runs in the background, and a face request that arrives first waits
+        # on the same load instead of starting another one.
+        if getattr(settings, 'FACE_MODEL_WARMUP', False):
+            threading.Thread(target=warm_up, name="face-model-warmup", daemon=True).start()
+
+
+def warm_up():
+    """Loads the model and the 1:N search index (IVF or exact gallery)."""
+    from django.db import connection
+
+    from . import embedding_service, face_index
+
+    try:
+        embedding_service.warm_up()
+        face_index.warm_up()
+    finally:
+        connection.close()
@@ -0,0 +1,104 @@
+import json
+import os
+
+import numpy as np
+from django.conf import settings
+
+
+# Facenet512 operating points, the same values DeepFace.verify uses.
+THRESHOLDS = {
+    'cosine': 0.30,
+    'euclidean': 23.56,
+    'euclidean_l2': 1.04,
+}
+
+# Operating points of the models embeddings may be stored with, keyed by the
+# model part of ``embedding_model`` ("Facenet512" for "Facenet512/opencv").
+# FACE_MODEL_THRESHOLDS overrides them.
+MODEL_THRESHOLDS = {
+    'Facenet512': THRESHOLDS,
+    'Facenet': {'cosine': 0.40, 'euclidean': 10, 'euclidean_l2': 0.80},
+    'ArcFace': {'cosine': 0.68, 'euclidean': 4.15, 'euclidean_l2': 1.13},
+}
+
+
+def as_vectors(embeddings):
+    """Returns a float32 view of one embedding (1-D) or a stack of them (2-D)."""
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def l2_normalize(embeddings):
+    embeddings = as_vectors(embeddings)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, np.finfo(np.float32).eps)
+
+
+def cosine_distance(a, b):
+    a, b = l2_normalize(a), l2_normalize(b)
+    return 1.0 - np.sum(a * b, axis=-1)
+
+
+def euclidean_distance(a, b):
+    return np.linalg.norm(as_vectors(a) - as_vectors(b), axis=-1)
+
+
+def euclidean_l2_distance(a, b):
+    return np.linalg.norm(l2_normalize(a) - l2_normalize(b), axis=-1)
+
+
+METRICS = {
+    'cosine': cosine_distance,
+    'euclidean': euclidean_distance,
+    'euclidean_l2': euclidean_l2_distance,
+}
+
+
+def default_metric():
+    return getattr(settings, 'FACE_DISTANCE_METRIC', 'cosine')
+
+
+_calibrated = None
+
+
+def calibrated_thresholds():
+    """Thresholds written to FACE_THRESHOLDS_FILE by ``calibrate_face_threshold``,
+    as {model: {metric: threshold}}. Read once per process."""
+    global _calibrated
+    if _calibrated is None:
+        path = getattr(settings, 'FACE_THRESHOLDS_FILE', None)
+        calibrated = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                calibrated = json.load(f)
+        _calibrated = calibrated
+    return _calibrated
+
+
+def get_threshold(metric=None, model=None):
+    """Distance threshold for ``metric`` and the model the embeddings came
+    from (default: the configured engine's). FACE_MODEL_THRESHOLDS wins over
+    calibrated thresholds, which win over the defaults above; models without
+    any use Facenet512's. Each source is keyed by the full tag
+    ("Facenet512/opencv") or, for any detector, by the model name alone."""
+    from .engines import get_engine
+
+    metric = metric or default_metric()
+    model = model or get_engine().name
+    names = (model, model.partition('/')[0])
+    for thresholds in (getattr(settings, 'FACE_MODEL_THRESHOLDS', {}), calibrated_thresholds()):
+        for name in names:
+            if metric in thresholds.get(name, {}):
+                return thresholds[name][metric]
+    return MODEL_THRESHOLDS.get(names[1], THRESHOLDS)[metric]
+
+
+def find_distance(a, b, metric=None):
+    """Distance between two embeddings, or row-wise between two stacks of them."""
+    return METRICS[metric or default_metric()](a, b)
+
+
+def verify(a, b, metric=None, model=None):
+    """Returns (verified, distance) for a pair of embeddings from ``model``."""
+    metric = metric or default_metric()
+    distance = float(find_distance(a, b, metric))
+    return distance <= get_threshold(metric, model), distance
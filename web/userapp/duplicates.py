@@ -0,0 +1,72 @@
+from django.conf import settings
+
+from . import distance
+from .face_index import identify, USER, FAMILY
+from .models import UserModel, FamilyModel, IdentityMatchModel
+
+
+FLAG = 'flag'
+REJECT = 'reject'
+
+
+def duplicate_policy():
+    """'flag' enrolls the face and records the matches for review; 'reject'
+    refuses the enrollment."""
+    return getattr(settings, 'FACE_DUPLICATE_POLICY', FLAG)
+
+
+def min_similarity():
+    similarity = getattr(settings, 'FACE_DUPLICATE_MIN_SIMILARITY', None)
+    if similarity is None:
+        # Default to the login threshold: anything that could log in as
+        # another enrolled identity is a duplicate.
+        similarity = 1 - distance.get_threshold('cosine')
+    return similarity
+
+
+def find_duplicates(face_embedding, exclude=None):
+    """Enrolled faces similar enough to be the same person, as (kind, pk,
+    similarity) tuples, best first. ``exclude`` is the (kind, pk) of the row
+    being re-enrolled so a face doesn't match its own previous embedding.
+
+    This is a top-k search of the in-memory gallery (or IVF index), synced
+    first so faces enrolled through other workers a moment ago are seen too.
+    """
+    top_k = getattr(settings, 'FACE_DUPLICATE_TOP_K', 5)
+    threshold = min_similarity()
+    matches = identify(face_embedding, k=top_k + 1, fresh=True)
+    return [
+        (kind, pk, similarity) for kind, pk, similarity in matches
+        if similarity >= threshold and (kind, pk) != exclude
+    ][:top_k]
+
+
+def usernames(keys):
+    """Maps (kind, pk) keys to usernames; rows deleted since the index was
+    loaded are left out."""
+    names = {}
+    for kind, model in ((USER, UserModel), (FAMILY, FamilyModel)):
+        ids = [pk for key_kind, pk in keys if key_kind == kind]
+        if ids:
+            for pk, username in model.objects.filter(id__in=ids).values_list('id', 'username'):
+                names[(kind, pk)] = username
+    return names
+
+
+def record_duplicates(kind, instance, duplicates, source='Enrollment'):
+    """Stores one IdentityMatchModel row per duplicate of a saved user or family member."""
+    names = usernames([(match_kind, pk) for match_kind, pk, _ in duplicates])
+    IdentityMatchModel.objects.bulk_create([
+        IdentityMatchModel(
+            kind=kind,
+            object_id=instance.pk,
+            username=instance.username,
+            match_kind=match_kind,
+            match_object_id=pk,
+            match_username=names[(match_kind, pk)],
+            similarity=similarity,
+            source=source,
+        )
+        for match_kind, pk, similarity in duplicates
+        if (match_kind, pk) in names
+    ])
@@ -0,0 +1,50 @@
+import struct
+
+import numpy as np
+
+
+# Stored layout: 8-byte header (magic, format version, dimension) followed by
+# the embedding as little-endian float32 values. A 512-d Facenet embedding
+# takes 2056 bytes.
+MAGIC = b"FEMB"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+DTYPE = np.dtype("<f4")
+
+
+class EmbeddingFormatError(ValueError):
+    pass
+
+
+def encode(embedding):
+    vector = np.asarray(embedding, dtype=DTYPE).reshape(-1)
+    return HEADER.pack(MAGIC, VERSION, vector.size) + vector.tobytes()
+
+
+def decode(blob):
+    """Returns a read-only float32 view over the stored bytes; nothing is copied."""
+    buffer = memoryview(blob)
+    if len(buffer) < HEADER.size:
+        raise EmbeddingFormatError("Embedding blob is too short.")
+
+    magic, version, dim = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise EmbeddingFormatError("Embedding blob has an unknown format.")
+    if version != VERSION:
+        raise EmbeddingFormatError(f"Unsupported embedding format version {version}.")
+    if len(buffer) != HEADER.size + dim * DTYPE.itemsize:
+        raise EmbeddingFormatError("Embedding blob length does not match its header.")
+
+    return np.frombuffer(buffer, dtype=DTYPE, count=dim, offset=HEADER.size)
+
+
+def is_encoded(blob):
+    return bytes(memoryview(blob)[:len(MAGIC)]) == MAGIC
+
+
+def dimension(blob):
+    """The embedding size recorded in a blob's header."""
+    buffer = memoryview(blob)
+    if len(buffer) < HEADER.size or bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise EmbeddingFormatError("Embedding blob has an unknown format.")
+    return HEADER.unpack_from(buffer)[2]
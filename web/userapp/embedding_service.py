@@ -0,0 +1,263 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from .engines import get_engine, engine_path
+from .inference_pool import PoolBusy
+
+
+class EmbeddingBatcher:
+    """Collects concurrent embedding requests into micro-batches.
+
+    The first request in an empty queue opens a window of ``max_wait`` seconds;
+    everything that arrives before it closes (up to ``max_batch_size`` images)
+    goes through the model in one forward pass. With ``workers`` > 1 several
+    batches can be in flight at once, which is what an inference pool needs.
+
+    At most ``max_queued`` images wait for a worker; beyond that submit raises
+    PoolBusy at once. Callers wait at most ``timeout`` seconds, queueing included.
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_wait=0.01, workers=1, max_queued=0, timeout=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._stats_lock = threading.Lock()
+        self._rejected = 0
+        self._batches = 0
+        self._images = 0
+        self._last_batch_size = 0
+        self._max_queue_wait = 0.0
+        self._total_queue_wait = 0.0
+        self._workers = [
+            threading.Thread(target=self._run, name=f"embedding-batcher-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, face_array, block=False):
+        """Queues an image and returns a Future of its embedding. Raises
+        PoolBusy when the queue is full, unless ``block`` waits for room."""
+        future = Future()
+        try:
+            self._queue.put((face_array, future, time.monotonic()), block=block)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise PoolBusy("Face inference queue is full.")
+        return future
+
+    def embed(self, face_array, timeout=None):
+        return self.embed_many([face_array], timeout)[0]
+
+    def embed_many(self, face_arrays, timeout=None, block=False):
+        """Embeds the frames of one request. They are queued back to back, so
+        they share a forward pass as long as they fit in one batch. ``block``
+        is for batch jobs, which should wait for room rather than fail."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None or block else time.monotonic() + timeout
+        futures = []
+        try:
+            for face_array in face_arrays:
+                futures.append(self.submit(face_array, block))
+        except PoolBusy:
+            # The request fails as a whole; don't spend the model on the frames already queued.
+            for future in futures:
+                future.cancel()
+            raise
+        return [future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                for future in futures]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Skips images whose request was abandoned while they were queued.
+            batch = [item for item in self._collect() if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.monotonic()
+            waits = [started - enqueued for _, _, enqueued in batch]
+            self._record(len(batch), waits)
+
+            try:
+                self._resolve(batch)
+            finally:
+                # Never leave a caller waiting on a future nobody will resolve.
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Embedding batch returned no result for this image."))
+
+    def _resolve(self, batch):
+        """Runs a batch and resolves its futures. A batch mixes requests from
+        different users, so if it fails each image is retried on its own and
+        only the one that actually fails gets the exception."""
+        try:
+            embeddings = self.run_batch([face_array for face_array, _, _ in batch])
+            if len(embeddings) != len(batch):
+                raise RuntimeError(f"Embedding batch returned {len(embeddings)} results for {len(batch)} images.")
+        except Exception as e:
+            # A timeout says nothing about any one image; retrying them one
+            # by one would only multiply the wait.
+            if len(batch) == 1 or isinstance(e, TimeoutError):
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            else:
+                for item in batch:
+                    self._resolve([item])
+            return
+
+        for (_, future, _), embedding in zip(batch, embeddings):
+            future.set_result(embedding)
+
+    def _record(self, batch_size, waits):
+        with self._stats_lock:
+            self._batches += 1
+            self._images += batch_size
+            self._last_batch_size = batch_size
+            self._total_queue_wait += sum(waits)
+            self._max_queue_wait = max(self._max_queue_wait, max(waits))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'batches': self._batches,
+                'images': self._images,
+                'last_batch_size': self._last_batch_size,
+                'avg_batch_size': self._images / self._batches if self._batches else 0.0,
+                'avg_queue_wait_ms': 1000 * self._total_queue_wait / self._images if self._images else 0.0,
+                'max_queue_wait_ms': 1000 * self._max_queue_wait,
+                'queued': self._queue.qsize(),
+                'max_queued': self._queue.maxsize,
+                'rejected': self._rejected,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': 1000 * self.max_wait,
+            }
+
+
+_service = None
+_pool = None
+_client = None
+_service_lock = threading.Lock()
+
+
+def get_client():
+    """Client for the inference sidecar, or None when FACE_INFERENCE_SOCKET is unset."""
+    global _client
+    path = getattr(settings, 'FACE_INFERENCE_SOCKET', None)
+    if _client is None and path:
+        from .inference_client import InferenceClient
+
+        _client = InferenceClient(path, timeout=getattr(settings, 'FACE_INFERENCE_TIMEOUT', 10.0))
+    return _client
+
+
+def get_pool():
+    """The process pool used for inference, or None when FACE_INFERENCE_POOL_SIZE is 0."""
+    global _pool
+    size = getattr(settings, 'FACE_INFERENCE_POOL_SIZE', 0)
+    if _pool is None and size:
+        from .inference_pool import InferencePool
+
+        with _service_lock:
+            if _pool is None:
+                _pool = InferencePool(
+                    engine_path(),
+                    size=size,
+                    queue_depth=getattr(settings, 'FACE_INFERENCE_QUEUE_DEPTH', 8),
+                    timeout=getattr(settings, 'FACE_INFERENCE_TIMEOUT', 10.0),
+                )
+    return _pool
+
+
+def get_service():
+    global _service
+    if _service is None:
+        pool = get_pool()
+        with _service_lock:
+            if _service is None:
+                max_batch_size = getattr(settings, 'FACE_BATCH_MAX_SIZE', 16)
+                _service = EmbeddingBatcher(
+                    pool.represent_batch if pool else get_engine().represent_batch,
+                    max_batch_size=max_batch_size,
+                    max_wait=getattr(settings, 'FACE_BATCH_MAX_WAIT_MS', 10) / 1000,
+                    workers=pool.size if pool else 1,
+                    # FACE_INFERENCE_QUEUE_DEPTH counts batches; the queue holds images.
+                    max_queued=getattr(settings, 'FACE_INFERENCE_QUEUE_DEPTH', 8) * max_batch_size,
+                    timeout=getattr(settings, 'FACE_INFERENCE_TIMEOUT', 10.0),
+                )
+    return _service
+
+
+def embed_many(face_arrays, model=None, block=False):
+    """Embeds RGB arrays through the sidecar when one is configured and
+    reachable, and through this process's batcher otherwise. Raises PoolBusy
+    when inference is saturated; batch jobs pass ``block`` to wait instead.
+
+    ``model`` asks for embeddings of another model than the configured one,
+    e.g. to compare with rows not yet re-embedded after an upgrade. Those run
+    in this process, without batching, since the pool and the sidecar only
+    hold the configured model."""
+    if model is not None and model != get_engine().name:
+        return get_engine(model).represent_batch(face_arrays)
+
+    client = get_client()
+    if client is not None:
+        from .inference_client import InferenceUnavailable
+
+        try:
+            return client.embed_many(face_arrays)
+        except InferenceUnavailable as e:
+            print(f"⚠️ {e}; falling back to in-process inference")
+    return get_service().embed_many(face_arrays, block=block)
+
+
+def embed(face_array, model=None):
+    return embed_many([face_array], model)[0]
+
+
+def warm_up(local=False):
+    """Loads the model where inference will run: nowhere in this process when a
+    sidecar answers, in the pool workers when a pool is configured, otherwise
+    in this process. ``local`` skips the sidecar check, for the sidecar itself."""
+    client = None if local else get_client()
+    if client is not None and client.ping():
+        return
+    pool = get_pool()
+    if pool:
+        pool.warm_up()
+    else:
+        get_engine().load()
+
+
+def is_ready():
+    client = get_client()
+    if client is not None and client.ping():
+        return True
+    pool = get_pool()
+    return pool.is_ready() if pool else get_engine().is_ready()
+
+
+def stats():
+    return {
+        'sidecar': getattr(settings, 'FACE_INFERENCE_SOCKET', None),
+        'batching': _service.stats() if _service else None,
+        'pool': _pool.stats() if _pool else None,
+    }
@@ -0,0 +1,117 @@
+import hashlib
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class EmbeddingEngine:
+    """Turns RGB face arrays into fixed-size embeddings.
+
+    Subclasses implement ``represent_batch``; ``load`` is called once before
+    the first request (or by warm-up) and may be slow. ``name`` is stored with
+    every embedding the engine produces, so it must change whenever the model
+    or its preprocessing does.
+    """
+
+    name = None
+    dim = 512
+
+    def load(self):
+        pass
+
+    def is_ready(self):
+        return True
+
+    def represent_batch(self, face_arrays):
+        """Returns an (n, dim) float32 array, one row per input image."""
+        raise NotImplementedError
+
+
+class DeepFaceEngine(EmbeddingEngine):
+    """A DeepFace model (Facenet512 by default); the production engine.
+
+    Its name is ``model/detector`` (e.g. "Facenet512/opencv"): the face
+    detector crops and aligns the input, so it changes the embeddings as much
+    as the model does. ``model_name`` may be either form; a bare model name
+    uses the default detector.
+    """
+
+    def __init__(self, model_name=None):
+        from . import face_model
+
+        self._face_model = face_model
+        model_name, _, detector_backend = (model_name or face_model.MODEL_NAME).partition('/')
+        self.model_name = model_name
+        self.detector_backend = detector_backend or face_model.DETECTOR_BACKEND
+        self.name = f'{self.model_name}/{self.detector_backend}'
+
+    def load(self):
+        self._face_model.load_model(self.model_name)
+
+    def is_ready(self):
+        return self._face_model.is_ready(self.model_name)
+
+    def represent_batch(self, face_arrays):
+        return self._face_model.represent_batch(face_arrays, self.model_name, self.detector_backend)
+
+
+class HashStubEngine(EmbeddingEngine):
+    """Deterministic stand-in for load tests and CI: a 64-byte hash of a pixel
+    subsample is projected onto a fixed random basis, so the same photo always
+    gets the same unit vector in microseconds and without TensorFlow.
+
+    Different photos of the same person do not match, so load tests should
+    log in with the photo they registered (and usually FACE_QUALITY_CHECK off).
+    """
+
+    name = 'HashStub512'
+
+    def __init__(self):
+        self._basis = np.random.default_rng(512).standard_normal((self.dim, 64)).astype(np.float32)
+
+    def represent_batch(self, face_arrays):
+        digests = np.empty((len(face_arrays), 64), dtype=np.float32)
+        for i, face_array in enumerate(face_arrays):
+            face_array = np.asarray(face_array)
+            digest = hashlib.blake2b(np.ascontiguousarray(face_array[::8, ::8]).tobytes(),
+                                     key=str(face_array.shape).encode()).digest()
+            digests[i] = np.frombuffer(digest, dtype=np.uint8)
+        embeddings = (digests - 127.5) @ self._basis.T
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def engine_path():
+    return getattr(settings, 'FACE_EMBEDDING_ENGINE', 'userapp.engines.DeepFaceEngine')
+
+
+def engine_paths():
+    """Engines for embeddings stored by other models, keyed by model name. A
+    name that isn't listed is loaded as a DeepFace model of that name."""
+    return getattr(settings, 'FACE_EMBEDDING_ENGINES', {})
+
+
+_engine = None
+_engines = {}
+_engine_lock = threading.Lock()
+
+
+def get_engine(name=None):
+    """The engine selected by FACE_EMBEDDING_ENGINE, created once per process.
+    With ``name``, the engine that produces embeddings tagged with that model
+    name, which is needed to log in against rows not yet re-embedded."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = import_string(engine_path())()
+    if name is None or name == _engine.name:
+        return _engine
+
+    if name not in _engines:
+        with _engine_lock:
+            if name not in _engines:
+                path = engine_paths().get(name)
+                _engines[name] = import_string(path)() if path else DeepFaceEngine(name)
+    return _engines[name]
@@ -0,0 +1,315 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import embedding_codec
+from .distance import l2_normalize
+from .ivf_index import IVFIndex
+
+
+USER = 'user'
+FAMILY = 'family'
+
+logger = logging.getLogger(__name__)
+
+
+class FaceGallery:
+    """In-memory matrix of every enrolled face, L2-normalized once on insert.
+
+    Scoring a probe against the whole gallery is a single matrix-vector
+    product, so 1:N identification stays in the millisecond range even with
+    100k+ rows. Rows are keyed by (kind, pk). The model signals in
+    ``userapp.signals`` apply this process's own changes at once; changes made
+    by other processes are picked up by ``sync``, which runs before a search
+    once FACE_GALLERY_SYNC_SECONDS have passed since the last one.
+    """
+
+    def __init__(self, dim=512, initial_capacity=1024):
+        self.dim = dim
+        self._matrix = np.empty((initial_capacity, dim), dtype=np.float32)
+        self._keys = []
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._max_ids = {}
+        self._synced_at = None
+        self._last_sync = 0.0
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def load(self):
+        from .engines import get_engine
+
+        model_name = get_engine().name
+        dim = stored_dimension(model_name)
+        with self._lock:
+            if dim != self.dim:
+                self.dim = dim
+                self._matrix = np.empty((len(self._matrix), dim), dtype=np.float32)
+            self._keys = []
+            self._rows = {}
+            self._max_ids = {}
+            # Taken before reading, so rows saved during the load are re-read by the next sync.
+            self._synced_at = timezone.now()
+            for kind, rows in face_rows(model_name):
+                for pk, blob in rows.values_list('id', 'embedding').iterator(chunk_size=2000):
+                    self._set_blob(kind, pk, blob)
+            self._last_sync = time.monotonic()
+            self._loaded = True
+
+    def sync(self):
+        """Applies faces enrolled, re-enrolled or deleted by any process since
+        the last load or sync. The lock is held throughout, so a signal of
+        this process can't be undone by a sync that read the rows before it."""
+        from .engines import get_engine
+
+        with self._lock:
+            synced_at = timezone.now()
+            changed, live = changes_since(get_engine().name, self._max_ids, self._synced_at)
+            for kind, pk, blob in changed:
+                self._set_blob(kind, pk, blob)
+            for key in [key for key in self._rows if key[1] not in live[key[0]]]:
+                self._remove(key)
+            self._synced_at = synced_at
+            self._last_sync = time.monotonic()
+
+    def ensure_loaded(self, fresh=False):
+        """Loads the gallery, or syncs it if FACE_GALLERY_SYNC_SECONDS have
+        passed since the last sync; ``fresh`` syncs regardless."""
+        if not self._loaded:
+            self.load()
+        elif fresh or time.monotonic() - self._last_sync >= sync_interval():
+            self.sync()
+
+    def upsert(self, kind, pk, embedding):
+        with self._lock:
+            self._set(kind, pk, embedding)
+
+    def remove(self, kind, pk):
+        with self._lock:
+            self._remove((kind, pk))
+
+    def _remove(self, key):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self._keys) - 1
+        if row != last:
+            # Move the last row into the hole so the matrix stays dense.
+            self._matrix[row] = self._matrix[last]
+            self._keys[row] = self._keys[last]
+            self._rows[self._keys[row]] = row
+        self._keys.pop()
+
+    def search(self, probe, k=5, fresh=False):
+        """Returns up to k (kind, pk, score) tuples, best first. The score is
+        the cosine similarity between the probe and the enrolled face."""
+        self.ensure_loaded(fresh)
+        probe = l2_normalize(probe)
+
+        with self._lock:
+            size = len(self._keys)
+            if size == 0:
+                return []
+            scores = self._matrix[:size] @ probe
+            k = min(k, size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(*self._keys[i], float(scores[i])) for i in top]
+
+    def _set_blob(self, kind, pk, blob):
+        self._max_ids[kind] = max(self._max_ids.get(kind, 0), pk)
+        try:
+            embedding = embedding_codec.decode(blob)
+        except embedding_codec.EmbeddingFormatError as e:
+            print(f"⚠️ Skipping {kind} {pk} in face gallery: {e}")
+            return
+        if embedding.size != self.dim:
+            print(f"⚠️ Skipping {kind} {pk} in face gallery: {embedding.size}-d embedding, expected {self.dim}-d")
+            return
+        self._set(kind, pk, embedding)
+
+    def _set(self, kind, pk, embedding):
+        key = (kind, pk)
+        row = self._rows.get(key)
+        if row is None:
+            row = len(self._keys)
+            if row == len(self._matrix):
+                grown = np.empty((2 * len(self._matrix), self.dim), dtype=np.float32)
+                grown[:row] = self._matrix
+                self._matrix = grown
+            self._keys.append(key)
+            self._rows[key] = row
+        self._matrix[row] = l2_normalize(embedding)
+
+
+def sync_interval():
+    return getattr(settings, 'FACE_GALLERY_SYNC_SECONDS', 5)
+
+
+def face_rows(model_name):
+    """(kind, queryset) of the users and family members enrolled with ``model_name``."""
+    from .models import UserModel, FamilyModel
+
+    return ((USER, UserModel.objects.filter(embedding_model=model_name)),
+            (FAMILY, FamilyModel.objects.filter(embedding_model=model_name)))
+
+
+def stored_dimension(model_name):
+    """Embedding size of the faces enrolled with ``model_name``, read from the
+    first stored row; the engine's ``dim`` when there are none yet."""
+    from .engines import get_engine
+
+    for _, rows in face_rows(model_name):
+        for blob in rows.values_list('embedding', flat=True)[:10]:
+            try:
+                return embedding_codec.dimension(blob)
+            except embedding_codec.EmbeddingFormatError:
+                continue
+    return get_engine(model_name).dim
+
+
+def changes_since(model_name, max_ids, since):
+    """What changed since a gallery or index was read: faces enrolled since
+    (pk above ``max_ids[kind]``) or re-enrolled since (``updated_at`` at or
+    after ``since``). Returns (changed, live): changed is a list of (kind, pk,
+    blob) and live maps each kind to the set of pks that still exist, so
+    deleted faces and faces moved to another model can be dropped."""
+    changed, live = [], {}
+    for kind, rows in face_rows(model_name):
+        recent = rows.filter(id__gt=max_ids.get(kind, 0))
+        if since:
+            recent = recent | rows.filter(updated_at__gte=since)
+        changed += [(kind, pk, blob) for pk, blob in recent.values_list('id', 'embedding').iterator(chunk_size=2000)]
+        live[kind] = set(rows.values_list('id', flat=True).iterator(chunk_size=10000))
+    return changed, live
+
+
+gallery = FaceGallery()
+
+
+def encode_key(kind, pk):
+    """Packs a (kind, pk) gallery key into the int64 id stored in the IVF index."""
+    return 2 * pk + (kind == FAMILY)
+
+
+def decode_key(id):
+    return (FAMILY if id % 2 else USER), id // 2
+
+
+_ivf_index = None
+_ivf_loaded = False
+_ivf_last_sync = 0.0
+_ivf_lock = threading.Lock()
+
+
+def load_ivf_index(path):
+    """Memory-maps the IVF index saved by ``build_face_ivf`` and brings it up
+    to date with ``sync_ivf_index``. Returns None if the index was built for
+    another model."""
+    from .engines import get_engine
+
+    model_name = get_engine().name
+    index = IVFIndex.load(path, nprobe=getattr(settings, 'FACE_IVF_NPROBE', 8))
+    if index.meta.get('model', model_name) != model_name:
+        logger.warning("Face IVF index was built for %s, not %s; searching the exact gallery until it is rebuilt",
+                       index.meta['model'], model_name)
+        return None
+    sync_ivf_index(index, model_name)
+    return index
+
+
+def sync_ivf_index(index, model_name):
+    """Adds faces enrolled or re-enrolled since the index was built or last
+    synced, and drops faces deleted or moved to another model since."""
+    synced_at = timezone.now()
+    since = index.meta.get('synced_at') or index.meta.get('built_at')
+    max_ids = {kind: index.meta.get(f'max_{kind}_id', 0) for kind in (USER, FAMILY)}
+    changed, live = changes_since(model_name, max_ids, since and datetime.fromisoformat(since))
+    for kind, pk, blob in changed:
+        index.add(encode_key(kind, pk), embedding_codec.decode(blob))
+        index.meta[f'max_{kind}_id'] = max(index.meta.get(f'max_{kind}_id', 0), pk)
+
+    live = np.fromiter((encode_key(kind, pk) for kind, pks in live.items() for pk in pks), dtype=np.int64)
+    indexed = np.concatenate([np.asarray(index.ids), np.fromiter(index.extra_ids(), dtype=np.int64)])
+    for id in indexed[~np.isin(indexed, live)]:
+        index.remove(int(id))
+    index.meta['synced_at'] = synced_at.isoformat()
+
+
+def get_ivf_index():
+    """The IVF index if FACE_IVF_INDEX_DIR holds one for the configured model,
+    loaded once per process. Returns None otherwise, in which case searches
+    use the exact gallery."""
+    global _ivf_index, _ivf_loaded, _ivf_last_sync
+    if _ivf_loaded:
+        return _ivf_index
+    path = getattr(settings, 'FACE_IVF_INDEX_DIR', None)
+    if not path or not IVFIndex.exists(path):
+        return None
+
+    with _ivf_lock:
+        if not _ivf_loaded:
+            _ivf_index = load_ivf_index(path)
+            _ivf_last_sync = time.monotonic()
+            _ivf_loaded = True
+    return _ivf_index
+
+
+def synced_ivf_index(fresh=False):
+    """get_ivf_index, synced with other workers' changes like the gallery:
+    every FACE_GALLERY_SYNC_SECONDS, or now with ``fresh``. The lock keeps
+    this process's own signals from being undone by a sync running alongside."""
+    from .engines import get_engine
+
+    global _ivf_last_sync
+    index = get_ivf_index()
+    if index is not None and (fresh or time.monotonic() - _ivf_last_sync >= sync_interval()):
+        with _ivf_lock:
+            sync_ivf_index(index, get_engine().name)
+            _ivf_last_sync = time.monotonic()
+    return index
+
+
+def warm_up():
+    """Loads the IVF index, or the exact gallery when there is none, so the
+    first identification doesn't pay for reading every enrolled face."""
+    if get_ivf_index() is None:
+        gallery.ensure_loaded()
+
+
+def identify(probe, k=5, fresh=False):
+    """Top-k (kind, pk, score) matches for a probe embedding, using the IVF
+    index when one is configured and the exact gallery otherwise. ``fresh``
+    first syncs them with changes made through other workers, for callers
+    that can't tolerate FACE_GALLERY_SYNC_SECONDS of lag."""
+    index = synced_ivf_index(fresh)
+    if index is None:
+        return gallery.search(probe, k, fresh)
+    return [(*decode_key(id), score) for id, score in index.search(probe, k)]
+
+
+def index_upsert(kind, pk, embedding):
+    if gallery.loaded:
+        gallery.upsert(kind, pk, embedding)
+    if _ivf_index is not None:
+        with _ivf_lock:
+            _ivf_index.add(encode_key(kind, pk), embedding)
+
+
+def index_remove(kind, pk):
+    if gallery.loaded:
+        gallery.remove(kind, pk)
+    if _ivf_index is not None:
+        with _ivf_lock:
+            _ivf_index.remove(encode_key(kind, pk))
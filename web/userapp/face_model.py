@@ -0,0 +1,78 @@
+import threading
+
+import numpy as np
+
+# DeepFace pulls in TensorFlow, which takes seconds and hundreds of MB to
+# import. It is only imported on the first face operation (or an explicit
+# warm-up), so management commands and non-face endpoints never pay for it.
+
+
+MODEL_NAME = "Facenet512"
+DETECTOR_BACKEND = "opencv"
+
+_models = {}
+_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def load_model(model_name=MODEL_NAME):
+    """Builds a DeepFace model once per process and warms it up with a dummy inference."""
+    model = _models.get(model_name)
+    if model is not None:
+        return model
+
+    with _lock:
+        if model_name not in _models:
+            from deepface import DeepFace
+
+            model = DeepFace.build_model(model_name)
+            height, width = model.input_shape[1], model.input_shape[0]
+            model.model(np.zeros((1, height, width, 3), dtype=np.float32), training=False)
+            _models[model_name] = model
+            if model_name == MODEL_NAME:
+                _ready.set()
+            print(f"✅ {model_name} model loaded and warmed up")
+    return _models[model_name]
+
+
+def is_ready(model_name=MODEL_NAME):
+    if model_name == MODEL_NAME:
+        return _ready.is_set()
+    return model_name in _models
+
+
+def preprocess(face_array, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND):
+    """Detects and aligns the face the same way DeepFace.represent does, so the
+    embeddings stay compatible with the ones already stored."""
+    from deepface.modules import detection, preprocessing
+
+    model = load_model(model_name)
+    face_objs = detection.extract_faces(
+        img_path=face_array,
+        detector_backend=detector_backend,
+        grayscale=False,
+        enforce_detection=False,
+        align=True,
+    )
+    face = face_objs[0]["face"][:, :, ::-1]
+    face = preprocessing.resize_image(img=face, target_size=(model.input_shape[1], model.input_shape[0]))
+    return preprocessing.normalize_input(img=face, normalization="base")
+
+
+def represent(face_array, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND):
+    """Returns the embedding of the first face in an RGB image array as a list of floats."""
+    return represent_batch([face_array], model_name, detector_backend)[0].tolist()
+
+
+def represent_batch(face_arrays, model_name=MODEL_NAME, detector_backend=DETECTOR_BACKEND):
+    """Embeds several images with a single forward pass. Returns an (n, dim) float32 array."""
+    model = load_model(model_name)
+    batch = np.concatenate([preprocess(face_array, model_name, detector_backend)
+                            for face_array in face_arrays], axis=0)
+    # The Keras model itself, not FacialRecognition.forward: some deepface
+    # releases return only the first row of forward's output.
+    embeddings = np.asarray(model.model(batch, training=False), dtype=np.float32)
+    if embeddings.shape != (len(face_arrays), model.output_shape):
+        raise RuntimeError(f"{model_name} returned embeddings of shape {embeddings.shape} "
+                           f"for {len(face_arrays)} images.")
+    return embeddings
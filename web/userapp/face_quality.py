@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .image_decode import ImageRejected
+
+
+ANALYSIS_SIDE = 480
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+_cascade = None
+_cascade_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _face_detector():
+    """OpenCV's Haar cascade: a few milliseconds per frame at analysis size,
+    which is enough to tell whether there is a usable face at all."""
+    global _cascade
+    if _cascade is None:
+        with _cascade_lock:
+            if _cascade is None:
+                import cv2
+                _cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return _cascade
+
+
+def to_gray(rgb):
+    """Downsampled float32 luma plane, at most ANALYSIS_SIDE pixels on the long side."""
+    step = max(1, -(-max(rgb.shape[:2]) // ANALYSIS_SIDE))
+    return rgb[::step, ::step, :3].astype(np.float32) @ LUMA, step
+
+
+def laplacian_variance(gray):
+    """Variance of the 4-neighbour Laplacian; low values mean a blurry frame."""
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                 - 4 * gray[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def largest_face(gray):
+    """Returns the (x, y, w, h) box of the largest face in a gray frame, or None."""
+    faces = _face_detector().detectMultiScale(gray.astype(np.uint8), scaleFactor=1.2, minNeighbors=4)
+    if len(faces) == 0:
+        return None
+    return max(faces, key=lambda box: box[2] * box[3])
+
+
+def check_face_quality(rgb):
+    """Rejects frames not worth a Facenet forward pass. Raises ImageRejected
+    with a reason code; returns the measured scores otherwise."""
+    gray, step = to_gray(rgb)
+
+    brightness = float(gray.mean())
+    if brightness < _setting('FACE_MIN_BRIGHTNESS', 40):
+        raise ImageRejected('too_dark', "Image is too dark. Move to a brighter place.")
+    if brightness > _setting('FACE_MAX_BRIGHTNESS', 220):
+        raise ImageRejected('too_bright', "Image is overexposed. Avoid direct light.")
+
+    contrast = float(gray.std())
+    if contrast < _setting('FACE_MIN_CONTRAST', 15):
+        raise ImageRejected('low_contrast', "Image has too little contrast.")
+
+    region = gray
+    face_size = None
+    if _setting('FACE_DETECT_IN_QUALITY_CHECK', True):
+        box = largest_face(gray)
+        if box is None:
+            raise ImageRejected('no_face', "No face found. Look straight at the camera.")
+        x, y, w, h = box
+        face_size = int(min(w, h) * step)
+        if face_size < _setting('FACE_MIN_FACE_SIZE', 80):
+            raise ImageRejected('face_too_small', "Face is too small. Move closer to the camera.")
+        region = gray[y:y + h, x:x + w]
+
+    sharpness = laplacian_variance(region)
+    if sharpness < _setting('FACE_MIN_SHARPNESS', 30):
+        raise ImageRejected('too_blurry', "Image is blurry. Hold the camera still.")
+
+    return {'brightness': brightness, 'contrast': contrast, 'sharpness': sharpness, 'face_size': face_size}
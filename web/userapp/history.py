@@ -0,0 +1,219 @@
+import base64
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, date, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+
+# Columns of the JSON transaction history; the related names are joined in
+# the same query, so a page costs one query however many rows it has.
+TRANSACTION_FIELDS = (
+    'id', 'account_number__account_number', 'username__username', 'receiver_account_number',
+    'receiver_name', 'branch_name__branch_name', 'amount', 'is_verified', 'date',
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(date, id):
+    return base64.urlsafe_b64encode(f"{date.isoformat()}|{id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        date, id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(date), int(id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("Invalid cursor.")
+
+
+def page_size(request):
+    default = getattr(settings, 'TRANSACTION_PAGE_SIZE', 50)
+    try:
+        size = int(request.GET.get('page_size', default))
+    except ValueError:
+        size = default
+    return max(1, min(size, getattr(settings, 'TRANSACTION_MAX_PAGE_SIZE', 200)))
+
+
+def keyset_page(queryset, cursor=None, size=50):
+    """One page of ``queryset``, newest first, after ``cursor``. Returns
+    (rows, next_cursor); next_cursor is None on the last page. Rows can be
+    model instances or values() dicts, as long as they include date and id."""
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        date, id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=id))
+
+    rows = list(queryset[:size + 1])
+    next_cursor = None
+    if len(rows) > size:
+        rows = rows[:size]
+        last = rows[-1]
+        if isinstance(last, dict):
+            next_cursor = encode_cursor(last['date'], last['id'])
+        else:
+            next_cursor = encode_cursor(last.date, last.id)
+    return rows, next_cursor
+
+
+def serialize_transaction(row):
+    return {
+        'id': row['id'],
+        'sender_account': row['account_number__account_number'],
+        'username': row['username__username'],
+        'receiver_account_number': row['receiver_account_number'],
+        'receiver_name': row['receiver_name'],
+        'branch_name': row['branch_name__branch_name'],
+        'amount': float(row['amount']),
+        'is_verified': row['is_verified'],
+        'date': row['date'].strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def transaction_history_page(request, queryset):
+    """JSON body for one page of transaction history: the rows plus the
+    cursor to pass back as ?cursor= for the next page."""
+    rows, next_cursor = keyset_page(queryset.values(*TRANSACTION_FIELDS),
+                                    request.GET.get('cursor'), page_size(request))
+    return {
+        'transaction_history': [serialize_transaction(row) for row in rows],
+        'next_cursor': next_cursor,
+    }
+
+
+def transaction_history_context(request, queryset):
+    """Template context for one page of the transaction history table. A
+    cursor that doesn't parse (a mangled link) shows the newest page instead."""
+    queryset = queryset.select_related('account_number', 'username', 'branch_name')
+    size = page_size(request)
+    try:
+        rows, next_cursor = keyset_page(queryset, request.GET.get('cursor'), size)
+    except InvalidCursor:
+        messages.error(request, "That page link is invalid; showing the newest transactions.")
+        rows, next_cursor = keyset_page(queryset, None, size)
+    return {'transaction_history': rows, 'next_cursor': next_cursor, 'page_size': size}
+
+
+# Exports stream the rows a keyset page of EXPORT_CHUNK_SIZE at a time, so
+# memory stays flat however long the history is. Under ASGI the body is an
+# async generator that runs each page query in a worker thread: Django would
+# read a synchronous one to the end before sending anything.
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+EXPORT_COLUMNS = (
+    'id', 'sender_account', 'username', 'receiver_account_number', 'receiver_name',
+    'branch_name', 'amount', 'is_verified', 'date',
+)
+
+
+def filter_dates(queryset, start=None, end=None):
+    """Limits ``queryset`` to transactions from ``start`` to ``end``, both
+    YYYY-MM-DD and inclusive. Raises ValueError on a malformed date."""
+    if start:
+        start = timezone.make_aware(datetime.combine(date.fromisoformat(start), time.min))
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        end = timezone.make_aware(datetime.combine(date.fromisoformat(end) + timedelta(days=1), time.min))
+        queryset = queryset.filter(date__lt=end)
+    return queryset
+
+
+def export_page(queryset, after=None, size=2000):
+    """Up to ``size`` transactions of ``queryset``, oldest first, after the
+    (date, id) ``after``, as values() dicts."""
+    queryset = queryset.order_by('date', 'id').values(*TRANSACTION_FIELDS)
+    if after:
+        date, id = after
+        queryset = queryset.filter(Q(date__gt=date) | Q(date=date, id__gt=id))
+    return list(queryset[:size])
+
+
+def format_rows(rows, fmt='csv', header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header and fmt == 'csv':
+        writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        row = serialize_transaction(row)
+        if fmt == 'csv':
+            writer.writerow([row[column] for column in EXPORT_COLUMNS])
+        else:
+            buffer.write(json.dumps(row) + '\n')
+    return buffer.getvalue()
+
+
+def export_lines(queryset, fmt='csv'):
+    """Yields the transactions in ``queryset``, oldest first, as CSV or NDJSON
+    text, a page of rows per string."""
+    size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    rows = export_page(queryset, None, size)
+    yield format_rows(rows, fmt, header=True)
+    while len(rows) == size:
+        rows = export_page(queryset, (rows[-1]['date'], rows[-1]['id']), size)
+        yield format_rows(rows, fmt)
+
+
+async def aexport_lines(queryset, fmt='csv'):
+    """export_lines for ASGI, with each page query run in a worker thread."""
+    size = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    rows = await sync_to_async(export_page)(queryset, None, size)
+    yield format_rows(rows, fmt, header=True)
+    while len(rows) == size:
+        rows = await sync_to_async(export_page)(queryset, (rows[-1]['date'], rows[-1]['id']), size)
+        yield format_rows(rows, fmt)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def agzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(request, queryset, filename):
+    """Streams ``queryset`` as a download. Query parameters: format (csv or
+    ndjson), start and end (YYYY-MM-DD) and gzip=1."""
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    queryset = filter_dates(queryset, request.GET.get('start'), request.GET.get('end'))
+
+    asgi = isinstance(request, ASGIRequest)
+    chunks = aexport_lines(queryset, fmt) if asgi else export_lines(queryset, fmt)
+    content_type = EXPORT_FORMATS[fmt]
+    filename = f"{filename}.{fmt}"
+    if request.GET.get('gzip') == '1':
+        chunks = agzip_chunks(chunks) if asgi else gzip_chunks(chunks)
+        content_type = 'application/gzip'
+        filename += '.gz'
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,61 @@
+import io
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP'}
+
+
+class ImageRejected(ValueError):
+    """Raised for uploads that should not reach the face model. ``reason`` is a
+    short code the mobile app can switch on."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+def max_upload_bytes():
+    return getattr(settings, 'FACE_MAX_UPLOAD_BYTES', 10 * 1024 * 1024)
+
+
+def decode_face_image(data, max_side=None, max_pixels=None):
+    """Decodes an uploaded image into an RGB uint8 array no larger than max_side.
+
+    The header is checked before any pixel data is decoded. JPEGs are decoded
+    in draft mode, letting libjpeg scale by 1/2, 1/4 or 1/8 during the decode,
+    so a 12 MP phone photo never exists in memory at full resolution.
+    """
+    max_side = max_side or getattr(settings, 'FACE_DECODE_MAX_SIDE', 1024)
+    max_pixels = max_pixels or getattr(settings, 'FACE_MAX_UPLOAD_PIXELS', 50_000_000)
+
+    if len(data) > max_upload_bytes():
+        raise ImageRejected('file_too_large', "Image file is too large.")
+
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError:
+        raise ImageRejected('image_too_large', "Image dimensions are too large.")
+    except (UnidentifiedImageError, OSError):
+        raise ImageRejected('not_an_image', "Uploaded file is not an image.")
+
+    if image.format not in ALLOWED_FORMATS:
+        raise ImageRejected('unsupported_format', f"Unsupported image format: {image.format}.")
+    width, height = image.size
+    if width * height > max_pixels:
+        raise ImageRejected('image_too_large', "Image dimensions are too large.")
+
+    try:
+        if image.format == 'JPEG':
+            image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.BILINEAR)
+        image = image.convert('RGB')
+    except (OSError, SyntaxError, ValueError):
+        raise ImageRejected('corrupt_image', "Image could not be decoded.")
+
+    return np.asarray(image)
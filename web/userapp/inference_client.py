@@ -0,0 +1,78 @@
+import socket
+import threading
+import time
+
+from . import inference_protocol as protocol
+
+
+class InferenceUnavailable(RuntimeError):
+    pass
+
+
+class InferenceClient:
+    """Thin client for the ``run_inference_server`` sidecar.
+
+    Each thread keeps its own connection open between requests. After a
+    failed connection the sidecar is skipped for ``retry_after`` seconds so
+    callers fall back to in-process inference without paying for a connect
+    attempt on every request.
+    """
+
+    def __init__(self, path, timeout=10.0, retry_after=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def _roundtrip(self, payload):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = self._local.sock = self._connect()
+        protocol.write_message(sock, payload)
+        return protocol.read_message(sock)
+
+    def embed_many(self, face_arrays):
+        """Returns an (n, dim) float32 array of embeddings for the given RGB arrays."""
+        if time.monotonic() < self._down_until:
+            raise InferenceUnavailable("Inference sidecar marked down.")
+
+        payload = protocol.encode_request(face_arrays)
+        try:
+            try:
+                response = self._roundtrip(payload)
+            except (BrokenPipeError, ConnectionError):
+                # The sidecar may have restarted since this connection was opened.
+                self._close()
+                response = self._roundtrip(payload)
+        except (OSError, protocol.ProtocolError) as e:
+            self._close()
+            self._down_until = time.monotonic() + self.retry_after
+            raise InferenceUnavailable(f"Inference sidecar unreachable: {e}")
+
+        status, result = protocol.decode_response(response)
+        if status == protocol.BUSY:
+            from .inference_pool import PoolBusy
+            raise PoolBusy(result)
+        if status != protocol.OK:
+            raise RuntimeError(f"Inference sidecar error: {result}")
+        return result
+
+    def ping(self):
+        try:
+            self.embed_many([])
+            return True
+        except InferenceUnavailable:
+            return False
@@ -0,0 +1,148 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from django.utils.module_loading import import_string
+
+
+class PoolBusy(RuntimeError):
+    pass
+
+
+# Each worker process builds its own engine from the dotted path it is given,
+# since spawned workers don't have Django settings configured.
+_engine = None
+
+
+def _init_worker(engine_path):
+    global _engine
+    _engine = import_string(engine_path)()
+    _engine.load()
+
+
+def _ping():
+    return _engine.is_ready()
+
+
+def _run_batch(face_arrays):
+    return _engine.represent_batch(face_arrays)
+
+
+def embed_files(engine, paths):
+    """Decodes and embeds image files with ``engine``. Returns (embedded,
+    embeddings, errors): the indexes of the paths that were embedded, their
+    embeddings in that order, and {index: message} for the ones that could
+    not be decoded."""
+    from .image_decode import decode_face_image, ImageRejected
+
+    embedded, face_arrays, errors = [], [], {}
+    for i, path in enumerate(paths):
+        try:
+            with open(path, 'rb') as f:
+                face_arrays.append(decode_face_image(f.read()))
+            embedded.append(i)
+        except (OSError, ImageRejected) as e:
+            errors[i] = str(e)
+    embeddings = engine.represent_batch(face_arrays) if face_arrays else []
+    return embedded, embeddings, errors
+
+
+def _embed_files(paths):
+    return embed_files(_engine, paths)
+
+
+class InferencePool:
+    """Runs face inference in worker processes that each hold their own engine,
+    so a web worker waiting on a 300 ms forward pass doesn't hold the GIL and
+    can still serve cheap endpoints.
+
+    The embedding batcher feeds it from ``size`` threads, so at most ``size``
+    batches run at once; the batcher's bounded queue (``queue_depth`` batches)
+    is what turns excess load into PoolBusy.
+    """
+
+    def __init__(self, engine_path, size=2, queue_depth=8, timeout=10.0):
+        self.size = size
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        # TensorFlow does not survive fork() once initialised, so workers are spawned.
+        self._executor = ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(engine_path,),
+        )
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._total_latency = 0.0
+        self._max_latency = 0.0
+        self._ready = threading.Event()
+
+    def warm_up(self):
+        """Starts every worker and waits until each has loaded the model."""
+        futures = [self._executor.submit(_ping) for _ in range(self.size)]
+        for future in futures:
+            future.result()
+        self._ready.set()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def represent_batch(self, face_arrays):
+        started = time.monotonic()
+        with self._stats_lock:
+            self._in_flight += 1
+        future = self._executor.submit(_run_batch, face_arrays)
+        # Counted until the worker finishes, even if the caller has given up
+        # waiting, so in_flight reflects real work.
+        future.add_done_callback(self._finished)
+
+        try:
+            embeddings = future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._stats_lock:
+                self._timeouts += 1
+            raise
+        except Exception:
+            with self._stats_lock:
+                self._failed += 1
+            raise
+
+        latency = time.monotonic() - started
+        with self._stats_lock:
+            self._completed += 1
+            self._total_latency += latency
+            self._max_latency = max(self._max_latency, latency)
+        return embeddings
+
+    def submit_files(self, paths):
+        """Decodes and embeds image files in a worker, for batch jobs such as
+        imports. Decoding happens in the worker too, so it runs in parallel.
+        This bypasses the queue limit; returns a Future of ``embed_files``'s result."""
+        return self._executor.submit(_embed_files, paths)
+
+    def _finished(self, future):
+        with self._stats_lock:
+            self._in_flight -= 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'size': self.size,
+                'queue_depth': self.queue_depth,
+                'timeout_seconds': self.timeout,
+                'in_flight': self._in_flight,
+                'completed': self._completed,
+                'failed': self._failed,
+                'timeouts': self._timeouts,
+                'avg_latency_ms': 1000 * self._total_latency / self._completed if self._completed else 0.0,
+                'max_latency_ms': 1000 * self._max_latency,
+                'ready': self._ready.is_set(),
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,99 @@
+"""Binary protocol spoken between Django workers and the inference sidecar.
+
+Every message is a uint32 length followed by that many bytes of payload, all
+little-endian, so one connection can carry any number of requests.
+
+Request:  magic, image count, then per image (height, width, channels) and
+          the raw uint8 pixels in row-major order.
+Response: magic, status, embedding count, dimension, then count * dimension
+          float32 values. For a non-OK status the rest is a UTF-8 message.
+"""
+import struct
+
+import numpy as np
+
+
+MAGIC = b"FIR1"
+OK = 0
+BUSY = 1
+ERROR = 2
+
+LENGTH = struct.Struct("<I")
+REQUEST_HEADER = struct.Struct("<4sH")
+IMAGE_HEADER = struct.Struct("<HHB")
+RESPONSE_HEADER = struct.Struct("<4sBHH")
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_message(sock):
+    (size,) = LENGTH.unpack(_recv_exact(sock, LENGTH.size))
+    return _recv_exact(sock, size)
+
+
+def write_message(sock, payload):
+    sock.sendall(LENGTH.pack(len(payload)) + payload)
+
+
+def encode_request(face_arrays):
+    parts = [REQUEST_HEADER.pack(MAGIC, len(face_arrays))]
+    for face_array in face_arrays:
+        face_array = np.ascontiguousarray(face_array, dtype=np.uint8)
+        height, width = face_array.shape[:2]
+        channels = face_array.shape[2] if face_array.ndim == 3 else 1
+        parts.append(IMAGE_HEADER.pack(height, width, channels))
+        parts.append(face_array.tobytes())
+    return b"".join(parts)
+
+
+def decode_request(payload):
+    magic, count = REQUEST_HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ProtocolError("Bad request magic.")
+
+    face_arrays = []
+    offset = REQUEST_HEADER.size
+    for _ in range(count):
+        height, width, channels = IMAGE_HEADER.unpack_from(payload, offset)
+        offset += IMAGE_HEADER.size
+        size = height * width * channels
+        if offset + size > len(payload):
+            raise ProtocolError("Truncated image data.")
+        pixels = np.frombuffer(payload, dtype=np.uint8, count=size, offset=offset)
+        face_arrays.append(pixels.reshape((height, width, channels) if channels > 1 else (height, width)))
+        offset += size
+    return face_arrays
+
+
+def encode_response(embeddings):
+    embeddings = np.ascontiguousarray(embeddings, dtype="<f4")
+    count, dim = embeddings.shape
+    return RESPONSE_HEADER.pack(MAGIC, OK, count, dim) + embeddings.tobytes()
+
+
+def encode_error(status, message):
+    return RESPONSE_HEADER.pack(MAGIC, status, 0, 0) + message.encode()
+
+
+def decode_response(payload):
+    """Returns (status, embeddings or error message)."""
+    magic, status, count, dim = RESPONSE_HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ProtocolError("Bad response magic.")
+    if status != OK:
+        return status, payload[RESPONSE_HEADER.size:].decode(errors="replace")
+    embeddings = np.frombuffer(payload, dtype="<f4", count=count * dim, offset=RESPONSE_HEADER.size)
+    return status, embeddings.reshape(count, dim)
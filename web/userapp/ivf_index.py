@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from .distance import l2_normalize
+
+
+class IVFIndex:
+    """Inverted-file index over L2-normalized embeddings.
+
+    Vectors are partitioned by their nearest k-means centroid and stored
+    contiguously per list, so a search only scores the ``nprobe`` lists whose
+    centroids are closest to the probe. The trained lists are saved as .npy
+    files and memory-mapped on load; vectors added afterwards are kept in a
+    small exact-search buffer until the next rebuild.
+    """
+
+    FILES = ('centroids', 'vectors', 'ids', 'offsets')
+
+    def __init__(self, centroids, vectors, ids, offsets, nprobe=8, meta=None):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.nprobe = nprobe
+        self.meta = meta or {}
+        # Vectors added since the build, in a buffer that doubles when full
+        # like FaceGallery's matrix; _extra_rows maps id -> row.
+        self._extra_rows = {}
+        self._extra_ids = np.empty(64, dtype=np.int64)
+        self._extra_vectors = np.empty((64, centroids.shape[1]), dtype=np.float32)
+        # Trained rows that were removed or replaced since. A fixed-size mask
+        # rather than a set of ids, so the cost of a search doesn't grow with
+        # the number of changes; ids are mapped to rows by binary search.
+        self._dead = np.zeros(len(ids), dtype=bool)
+        self._sorted = None
+        self._lock = threading.Lock()
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, embeddings, ids, nlist, iterations=20, sample_size=None, nprobe=8, seed=0):
+        embeddings = l2_normalize(embeddings)
+        ids = np.asarray(ids, dtype=np.int64)
+        rng = np.random.default_rng(seed)
+        nlist = min(nlist, len(embeddings))
+
+        sample_size = min(sample_size or 64 * nlist, len(embeddings))
+        sample = embeddings[rng.choice(len(embeddings), sample_size, replace=False)]
+        centroids = kmeans(sample, nlist, iterations, rng)
+
+        assignments = assign(embeddings, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=nlist)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(centroids, embeddings[order], ids[order], offsets, nprobe=nprobe)
+
+    def add(self, id, embedding):
+        vector = l2_normalize(embedding).reshape(1, -1)
+        with self._lock:
+            self._kill(id)
+            row = self._extra_rows.get(id)
+            if row is None:
+                row = len(self._extra_rows)
+                if row == len(self._extra_ids):
+                    self._extra_ids = np.concatenate([self._extra_ids, np.empty_like(self._extra_ids)])
+                    self._extra_vectors = np.concatenate([self._extra_vectors, np.empty_like(self._extra_vectors)])
+                self._extra_rows[id] = row
+                self._extra_ids[row] = id
+            self._extra_vectors[row] = vector
+
+    def remove(self, id):
+        with self._lock:
+            self._kill(id)
+            row = self._extra_rows.pop(id, None)
+            if row is None:
+                return
+            last = len(self._extra_rows)
+            if row != last:
+                # Move the last row into the hole so the buffer stays dense.
+                self._extra_ids[row] = self._extra_ids[last]
+                self._extra_vectors[row] = self._extra_vectors[last]
+                self._extra_rows[int(self._extra_ids[row])] = row
+
+    def _kill(self, id):
+        """Hides the trained row of ``id``, if it has one."""
+        if self._sorted is None:
+            order = np.argsort(self.ids, kind='stable')
+            self._sorted = (order, np.asarray(self.ids)[order])
+        order, sorted_ids = self._sorted
+        i = np.searchsorted(sorted_ids, id)
+        if i < len(sorted_ids) and sorted_ids[i] == id:
+            self._dead[order[i]] = True
+
+    def extra_ids(self):
+        """Ids added since the build."""
+        with self._lock:
+            return list(self._extra_rows)
+
+    def search(self, probe, k=5, nprobe=None):
+        """Returns up to k (id, score) pairs, best first, scored by cosine similarity."""
+        probe = l2_normalize(probe)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+
+        lists = np.argpartition(-(self.centroids @ probe), nprobe - 1)[:nprobe]
+        spans = [(self.offsets[l], self.offsets[l + 1]) for l in lists]
+        candidate_ids = np.concatenate([self.ids[start:end] for start, end in spans])
+        scores = np.concatenate([self.vectors[start:end] @ probe for start, end in spans])
+
+        with self._lock:
+            keep = ~np.concatenate([self._dead[start:end] for start, end in spans])
+            if not keep.all():
+                candidate_ids, scores = candidate_ids[keep], scores[keep]
+            size = len(self._extra_rows)
+            if size:
+                candidate_ids = np.concatenate([candidate_ids, self._extra_ids[:size]])
+                scores = np.concatenate([scores, self._extra_vectors[:size] @ probe])
+
+        if len(scores) == 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(candidate_ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in self.FILES:
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    @classmethod
+    def load(cls, path, nprobe=8):
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in cls.FILES}
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        # The list layout and centroids are small and read on every search.
+        arrays['centroids'] = np.array(arrays['centroids'])
+        arrays['offsets'] = np.array(arrays['offsets'])
+        return cls(nprobe=nprobe, meta=meta, **arrays)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+def assign(embeddings, centroids, chunk_size=65536):
+    """Index of the closest centroid for every row, computed in chunks."""
+    assignments = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), chunk_size):
+        chunk = embeddings[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def kmeans(embeddings, k, iterations, rng):
+    """Spherical k-means: centroids stay on the unit sphere like the embeddings."""
+    centroids = embeddings[rng.choice(len(embeddings), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign(embeddings, centroids)
+        order = np.argsort(assignments, kind='stable')
+        counts = np.bincount(assignments, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(embeddings[order], starts[filled], axis=0)
+        # Re-seed empty lists with random points so every list stays in use.
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            sums[empty] = embeddings[rng.choice(len(embeddings), len(empty), replace=False)]
+        centroids = l2_normalize(sums)
+    return centroids
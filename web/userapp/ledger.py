@@ -0,0 +1,67 @@
+from django.db.models import Case, F, Sum, When
+from django.utils import timezone
+
+from .models import AccountModel, LedgerEntryModel, BalanceSnapshotModel
+
+
+# Credits add to the balance and debits subtract from it.
+SIGNED_AMOUNT = Case(When(entry_type=LedgerEntryModel.DEBIT, then=-F('amount')), default=F('amount'))
+
+
+def debit_entry(account_id, amount, source, **refs):
+    return LedgerEntryModel(account_number_id=account_id, entry_type=LedgerEntryModel.DEBIT,
+                            amount=amount, source=source, **refs)
+
+
+def credit_entry(account_id, amount, source, **refs):
+    return LedgerEntryModel(account_number_id=account_id, entry_type=LedgerEntryModel.CREDIT,
+                            amount=amount, source=source, **refs)
+
+
+def balance_as_of(account_id, when=None):
+    """An account's balance at ``when`` (default: now): the nearest snapshot
+    at or before it plus the entries since, so the cost depends on how
+    recently snapshots were taken rather than on the account's history."""
+    when = when or timezone.now()
+    entries = LedgerEntryModel.objects.filter(account_number_id=account_id, date__lte=when)
+    snapshot = (BalanceSnapshotModel.objects.filter(account_number_id=account_id, date__lte=when)
+                .order_by('-date').values_list('date', 'balance').first())
+    balance = 0
+    if snapshot:
+        entries = entries.filter(date__gt=snapshot[0])
+        balance = snapshot[1]
+    return balance + (entries.aggregate(delta=Sum(SIGNED_AMOUNT))['delta'] or 0)
+
+
+def take_snapshots(cutoff):
+    """Snapshots every account's balance as of ``cutoff`` from the previous
+    snapshot run plus the entries since, in two aggregate queries. Returns
+    the number of snapshots written."""
+    previous = BalanceSnapshotModel.objects.filter(date__lt=cutoff).order_by('-date').values_list('date', flat=True).first()
+    balances = {}
+    entries = LedgerEntryModel.objects.filter(date__lte=cutoff)
+    if previous:
+        balances = dict(BalanceSnapshotModel.objects.filter(date=previous).values_list('account_number_id', 'balance'))
+        entries = entries.filter(date__gt=previous)
+    for account_id, delta in entries.values('account_number_id').annotate(delta=Sum(SIGNED_AMOUNT)).values_list(
+            'account_number_id', 'delta'):
+        balances[account_id] = balances.get(account_id, 0) + delta
+
+    existing = set(AccountModel.objects.filter(id__in=balances).values_list('id', flat=True))
+    BalanceSnapshotModel.objects.bulk_create([
+        BalanceSnapshotModel(account_number_id=account_id, balance=balance, date=cutoff)
+        for account_id, balance in balances.items() if account_id in existing
+    ], batch_size=1000)
+    return len(existing)
+
+
+def reconcile():
+    """Accounts whose stored balance differs from their ledger, as
+    (account id, balance, ledger balance) tuples."""
+    ledger = dict(LedgerEntryModel.objects.values('account_number_id').annotate(delta=Sum(SIGNED_AMOUNT))
+                  .values_list('account_number_id', 'delta'))
+    return [
+        (account_id, balance, ledger.get(account_id, 0))
+        for account_id, balance in AccountModel.objects.values_list('id', 'balance').iterator(chunk_size=2000)
+        if balance != ledger.get(account_id, 0)
+    ]
@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from userapp.distance import l2_normalize
+from userapp.ivf_index import IVFIndex
+from userapp.management.commands.build_face_ivf import load_embeddings
+
+
+def synthetic_gallery(size, rng, dim=512, spread=0.35):
+    """Embeddings grouped around random identities, with noisy probes of enrolled faces."""
+    identities = l2_normalize(rng.standard_normal((max(1, size // 4), dim)))
+    owners = rng.integers(0, len(identities), size)
+    return l2_normalize(identities[owners] + spread * l2_normalize(rng.standard_normal((size, dim))))
+
+
+class Command(BaseCommand):
+    help = "Measures recall@k and latency of the IVF index against exact search."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--nlist', type=int, default=1024)
+        parser.add_argument('--nprobe', default='1,4,8,16,32')
+        parser.add_argument('--k', type=int, default=1)
+        parser.add_argument('--from-db', action='store_true', help="Use the stored embeddings instead of synthetic ones.")
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        if options['from_db']:
+            gallery, _, _ = load_embeddings()
+            gallery = l2_normalize(gallery)
+        else:
+            gallery = synthetic_gallery(options['size'], rng)
+        ids = np.arange(len(gallery), dtype=np.int64)
+        k = options['k']
+
+        probes = l2_normalize(gallery[rng.choice(len(gallery), options['queries'])]
+                              + 0.2 * l2_normalize(rng.standard_normal((options['queries'], gallery.shape[1]))))
+
+        started = time.perf_counter()
+        index = IVFIndex.train(gallery, ids, options['nlist'])
+        self.stdout.write(f"{len(gallery)} faces, {index.nlist} lists, trained in {time.perf_counter() - started:.1f}s")
+
+        exact, latencies = [], []
+        for probe in probes:
+            started = time.perf_counter()
+            scores = gallery @ probe
+            top = np.argpartition(-scores, k - 1)[:k]
+            latencies.append(time.perf_counter() - started)
+            exact.append(set(top.tolist()))
+        self._report("exact", 1.0, latencies)
+
+        for nprobe in (int(n) for n in options['nprobe'].split(',')):
+            hits, latencies = 0, []
+            for probe, truth in zip(probes, exact):
+                started = time.perf_counter()
+                found = index.search(probe, k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - started)
+                hits += len(truth & {id for id, _ in found})
+            self._report(f"nprobe={nprobe}", hits / (k * len(probes)), latencies)
+
+    def _report(self, label, recall, latencies):
+        latencies = 1000 * np.asarray(latencies)
+        self.stdout.write(f"{label:<12} recall@k={recall:.3f}  "
+                          f"mean={latencies.mean():.2f}ms  p95={np.percentile(latencies, 95):.2f}ms")
@@ -0,0 +1,41 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from userapp import distance, face_model
+
+
+class Command(BaseCommand):
+    help = "Compares DeepFace.verify with the NumPy distance module on precomputed embeddings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000)
+        parser.add_argument('--skip-deepface', action='store_true',
+                            help="Only time the NumPy path.")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        rng = np.random.default_rng(0)
+        pairs = rng.standard_normal((iterations, 2, 512)).astype(np.float32)
+        stored = [pair[0].tolist() for pair in pairs]
+        probes = [pair[1].tolist() for pair in pairs]
+
+        for metric in distance.METRICS:
+            started = time.perf_counter()
+            for a, b in zip(stored, probes):
+                distance.verify(a, b, metric)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"numpy {metric:<13} {1e6 * elapsed / iterations:10.2f} us/verify")
+
+        if options['skip_deepface']:
+            return
+
+        from deepface import DeepFace
+
+        for metric in distance.METRICS:
+            started = time.perf_counter()
+            for a, b in zip(stored, probes):
+                DeepFace.verify(a, b, model_name=face_model.MODEL_NAME, distance_metric=metric)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"deepface {metric:<10} {1e6 * elapsed / iterations:10.2f} us/verify")
@@ -0,0 +1,57 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# Runs in a fresh interpreter: boots Django, resolves the URLconf (which
+# imports every view module), then optionally touches the face stack.
+PROBE = """
+import json, os, resource, sys, time
+started = time.perf_counter()
+import django
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+booted = time.perf_counter()
+result = {'boot_ms': 1000 * (booted - started)}
+if sys.argv[1] == 'face':
+    from userapp.engines import get_engine
+    get_engine().load()
+    result['face_load_ms'] = 1000 * (time.perf_counter() - booted)
+result['tensorflow_imported'] = 'tensorflow' in sys.modules
+result['max_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps(result))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measures cold-start time of a Django process with and without loading the face stack."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--with-face', action='store_true',
+                            help="Also time a process that loads the embedding engine after boot.")
+
+    def handle(self, *args, **options):
+        modes = ['plain'] + (['face'] if options['with_face'] else [])
+        env = {**os.environ, 'FACE_MODEL_WARMUP': ''}
+
+        for mode in modes:
+            runs = []
+            for _ in range(options['runs']):
+                output = subprocess.run([sys.executable, '-c', PROBE, mode], cwd=settings.BASE_DIR, env=env,
+                                        capture_output=True, text=True, check=True).stdout
+                runs.append(json.loads(output.strip().splitlines()[-1]))
+
+            line = (f"{mode:<6} boot median={statistics.median(r['boot_ms'] for r in runs):8.1f}ms  "
+                    f"max_rss={max(r['max_rss_mb'] for r in runs):7.1f}MB  "
+                    f"tensorflow_imported={runs[0]['tensorflow_imported']}")
+            if mode == 'face':
+                line += f"  face_load median={statistics.median(r['face_load_ms'] for r in runs):8.1f}ms"
+            self.stdout.write(line)
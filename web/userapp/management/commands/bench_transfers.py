@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.db.models import Sum
+
+from branchapp.models import BranchModel
+from userapp import transfers
+from userapp.ledger import credit_entry
+from userapp.models import UserModel, AccountModel, LedgerEntryModel
+
+
+BENCH_USERNAME = 'bench_transfers'
+FIRST_ACCOUNT = 990_000_000
+
+
+def legacy_transfer(sender_id, receiver_id, amount):
+    """What verify_transaction used to do: read both rows, change the balances
+    in Python and save() every column, outside any transaction."""
+    sender = AccountModel.objects.get(id=sender_id)
+    receiver = AccountModel.objects.get(id=receiver_id)
+    if sender.balance < amount:
+        raise transfers.InsufficientFunds("Insufficient balance.")
+    sender.balance -= amount
+    sender.save()
+    receiver.balance += amount
+    receiver.save()
+
+
+MODES = {
+    'legacy': legacy_transfer,
+    'atomic': transfers.transfer,
+}
+
+
+class Command(BaseCommand):
+    help = ("Runs random concurrent transfers between throwaway accounts with the old read-modify-save "
+            "code and with userapp.transfers, and reports transfers per second and balance drift.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--accounts', type=int, default=20)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--transfers', type=int, default=250, help="Transfers per thread.")
+        parser.add_argument('--balance', type=int, default=1000, help="Opening balance of each account.")
+        parser.add_argument('--modes', default='legacy,atomic')
+
+    def handle(self, *args, **options):
+        for mode in options['modes'].split(','):
+            ids = self.set_up(options['accounts'], options['balance'])
+            try:
+                self.run(mode, ids, options)
+            finally:
+                self.tear_down()
+
+    def set_up(self, count, balance):
+        self.tear_down()
+        branch, _ = BranchModel.objects.get_or_create(
+            branch_name=BENCH_USERNAME,
+            defaults={'username': BENCH_USERNAME, 'bank_name': 'Bench', 'ifsc_code': 'BENCH0000', 'address': '-',
+                      'city': '-', 'state': '-', 'country': '-', 'postal_code': 0, 'contact_number': '0',
+                      'email': 'bench@example.com'})
+        user = UserModel.objects.create(username=BENCH_USERNAME, first_name='Bench', last_name='Bench',
+                                        address='-', email='bench@example.com', phone=0, city='-', state='-',
+                                        country='-', embedding=b'')
+        accounts = AccountModel.objects.bulk_create([
+            AccountModel(account_number=FIRST_ACCOUNT + i, branch_name=branch, username=user,
+                         ifsc_code=branch.ifsc_code, balance=balance)
+            for i in range(count)
+        ])
+        LedgerEntryModel.objects.bulk_create([credit_entry(account.id, balance, 'Opening') for account in accounts])
+        return [account.id for account in accounts]
+
+    def tear_down(self):
+        UserModel.objects.filter(username=BENCH_USERNAME).delete()
+        BranchModel.objects.filter(branch_name=BENCH_USERNAME).delete()
+
+    def run(self, mode, ids, options):
+        move = MODES[mode]
+        expected = options['balance'] * len(ids)
+        counts = {'done': 0, 'declined': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            local = {'done': 0, 'declined': 0, 'errors': 0}
+            try:
+                for _ in range(options['transfers']):
+                    sender, receiver = rng.sample(ids, 2)
+                    try:
+                        move(sender, receiver, rng.randint(1, options['balance'] // 10 or 1))
+                        local['done'] += 1
+                    except transfers.InsufficientFunds:
+                        local['declined'] += 1
+                    except OperationalError:
+                        # SQLite gives up on a locked database after its timeout.
+                        local['errors'] += 1
+            finally:
+                connection.close()
+                with lock:
+                    for key, value in local.items():
+                        counts[key] += value
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        accounts = AccountModel.objects.filter(id__in=ids)
+        total = accounts.aggregate(total=Sum('balance'))['total']
+        negative = accounts.filter(balance__lt=0).count()
+        style = self.style.SUCCESS if total == expected and not negative else self.style.ERROR
+        self.stdout.write(style(
+            f"{mode:>6}: {counts['done'] / elapsed:8.1f} transfers/s, {counts['done']} done, "
+            f"{counts['declined']} declined, {counts['errors']} errors; "
+            f"total {total} (drift {total - expected:+d}), {negative} negative balances"))
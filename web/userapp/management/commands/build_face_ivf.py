@@ -0,0 +1,73 @@
+import math
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from userapp import embedding_codec
+from userapp.engines import get_engine
+from userapp.face_index import USER, FAMILY, encode_key, stored_dimension
+from userapp.ivf_index import IVFIndex
+from userapp.models import UserModel, FamilyModel
+
+
+def load_embeddings(chunk_size=2000):
+    """Reads every embedding of the configured model into one preallocated float32 matrix."""
+    model_name = get_engine().name
+    models = ((USER, UserModel.objects.filter(embedding_model=model_name)),
+              (FAMILY, FamilyModel.objects.filter(embedding_model=model_name)))
+    total = sum(rows.count() for _, rows in models)
+    embeddings = np.empty((total, stored_dimension(model_name)), dtype=np.float32)
+    ids = np.empty(total, dtype=np.int64)
+    max_ids = {}
+
+    row = 0
+    for kind, rows in models:
+        max_ids[f'max_{kind}_id'] = 0
+        for pk, blob in rows.values_list('id', 'embedding').iterator(chunk_size=chunk_size):
+            if row == total:
+                break
+            embedding = embedding_codec.decode(blob)
+            if embedding.size != embeddings.shape[1]:
+                print(f"⚠️ Skipping {kind} {pk}: {embedding.size}-d embedding, expected {embeddings.shape[1]}-d")
+                continue
+            embeddings[row] = embedding
+            ids[row] = encode_key(kind, pk)
+            max_ids[f'max_{kind}_id'] = max(max_ids[f'max_{kind}_id'], pk)
+            row += 1
+    return embeddings[:row], ids[:row], max_ids
+
+
+class Command(BaseCommand):
+    help = ("Clusters the stored face embeddings into an IVF index and saves it to "
+            "FACE_IVF_INDEX_DIR. Rerun periodically to fold recent enrollments into the lists.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nlist', type=int, help="Number of lists (default: 4 * sqrt(N)).")
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', default=getattr(settings, 'FACE_IVF_INDEX_DIR', None))
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError("Set FACE_IVF_INDEX_DIR or pass --output.")
+
+        started = time.perf_counter()
+        # Taken before reading, so rows changed while the build runs are
+        # re-synced when the index is loaded.
+        built_at = timezone.now()
+        embeddings, ids, max_ids = load_embeddings()
+        if len(embeddings) == 0:
+            raise CommandError("No enrolled faces to index.")
+        self.stdout.write(f"Loaded {len(embeddings)} embeddings in {time.perf_counter() - started:.1f}s")
+
+        nlist = options['nlist'] or max(1, int(4 * math.sqrt(len(embeddings))))
+        started = time.perf_counter()
+        index = IVFIndex.train(embeddings, ids, nlist, iterations=options['iterations'])
+        index.meta = {'model': get_engine().name, 'count': len(embeddings), 'nlist': index.nlist,
+                      'built_at': built_at.isoformat(), **max_ids}
+        index.save(options['output'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {index.nlist} lists in {time.perf_counter() - started:.1f}s, saved to {options['output']}"))
@@ -0,0 +1,198 @@
+import csv
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from userapp.distance import METRICS, get_threshold
+from userapp.engines import get_engine, engine_path
+from userapp.inference_pool import InferencePool, embed_files
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def load_dataset(path):
+    """Lists (image path, identity index) for a folder with one subfolder per identity."""
+    identities = sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+    paths, labels = [], []
+    for label, identity in enumerate(identities):
+        folder = os.path.join(path, identity)
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(folder, name))
+                labels.append(label)
+    return paths, np.array(labels, dtype=np.int32), identities
+
+
+def tile_distances(a, b, norms_a, norms_b):
+    """Every metric's distances between two blocks of embeddings, from one matrix product."""
+    dots = a @ b.T
+    cosine = 1 - dots / np.outer(norms_a, norms_b)
+    squared = norms_a[:, None] ** 2 + norms_b[None, :] ** 2 - 2 * dots
+    return {
+        'cosine': cosine,
+        'euclidean': np.sqrt(np.maximum(squared, 0)),
+        'euclidean_l2': np.sqrt(np.maximum(2 * cosine, 0)),
+    }
+
+
+def pair_histograms(embeddings, labels, metrics, ranges, bins, block_size):
+    """Histograms of genuine (same identity) and impostor distances over all
+    N * (N - 1) / 2 pairs, accumulated tile by tile so memory stays at a few
+    block_size^2 arrays however large N is."""
+    norms = np.maximum(np.linalg.norm(embeddings, axis=1), np.finfo(np.float32).eps)
+    genuine = {metric: np.zeros(bins, dtype=np.int64) for metric in metrics}
+    impostor = {metric: np.zeros(bins, dtype=np.int64) for metric in metrics}
+
+    count = len(embeddings)
+    for start in range(0, count, block_size):
+        stop = min(start + block_size, count)
+        for col in range(start, count, block_size):
+            end = min(col + block_size, count)
+            distances = tile_distances(embeddings[start:stop], embeddings[col:end], norms[start:stop], norms[col:end])
+            same = labels[start:stop, None] == labels[None, col:end]
+            keep = np.ones(same.shape, dtype=bool)
+            if col == start:
+                keep = np.triu(keep, k=1)
+            for metric in metrics:
+                low, high = ranges[metric]
+                index = ((distances[metric] - low) * (bins / (high - low))).astype(np.int64)
+                np.clip(index, 0, bins - 1, out=index)
+                genuine[metric] += np.bincount(index[keep & same], minlength=bins)
+                impostor[metric] += np.bincount(index[keep & ~same], minlength=bins)
+    return genuine, impostor
+
+
+def error_curves(genuine, impostor):
+    """FAR and FRR when accepting distances up to the upper edge of each bin."""
+    far = np.cumsum(impostor) / max(impostor.sum(), 1)
+    frr = 1 - np.cumsum(genuine) / max(genuine.sum(), 1)
+    return far, frr
+
+
+class Command(BaseCommand):
+    help = ("Embeds a labeled dataset (one subfolder of photos per person), measures the genuine and "
+            "impostor distance distributions over every pair for each metric, and reports FAR, FRR and "
+            "EER. The threshold meeting --target-far is written to FACE_THRESHOLDS_FILE for the "
+            "configured model, where verification picks it up.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset')
+        parser.add_argument('--metrics', default=','.join(METRICS))
+        parser.add_argument('--target-far', type=float, default=0.001,
+                            help="Highest acceptable false accept rate (default 0.1%%).")
+        parser.add_argument('--batch-size', type=int, default=32, help="Images per forward pass.")
+        parser.add_argument('--workers', type=int, default=0,
+                            help="Worker processes for decoding and embedding (default: this process).")
+        parser.add_argument('--block-size', type=int, default=1024, help="Rows per distance tile.")
+        parser.add_argument('--bins', type=int, default=4000)
+        parser.add_argument('--curves', help="Write FAR/FRR per threshold to this CSV.")
+        parser.add_argument('--output', default=getattr(settings, 'FACE_THRESHOLDS_FILE', None),
+                            help="Thresholds file to update (default: FACE_THRESHOLDS_FILE).")
+        parser.add_argument('--dry-run', action='store_true', help="Report without writing thresholds.")
+
+    def handle(self, *args, **options):
+        metrics = [metric for metric in options['metrics'].split(',') if metric]
+        unknown = [metric for metric in metrics if metric not in METRICS]
+        if unknown:
+            raise CommandError(f"Unknown metrics: {', '.join(unknown)}")
+
+        paths, labels, identities = load_dataset(options['dataset'])
+        if len(identities) < 2:
+            raise CommandError("The dataset needs at least two identity folders.")
+        self.stdout.write(f"{len(paths)} images of {len(identities)} identities")
+
+        started = time.perf_counter()
+        embeddings, embedded = self.embed(paths, options['batch_size'], options['workers'])
+        labels = labels[embedded]
+        self.stdout.write(f"Embedded {len(embedded)} images in {time.perf_counter() - started:.1f}s "
+                          f"({len(paths) - len(embedded)} skipped)")
+
+        max_norm = float(np.linalg.norm(embeddings, axis=1).max())
+        ranges = {'cosine': (0.0, 2.0), 'euclidean': (0.0, 2 * max_norm), 'euclidean_l2': (0.0, 2.0)}
+        started = time.perf_counter()
+        genuine, impostor = pair_histograms(embeddings, labels, metrics, ranges, options['bins'], options['block_size'])
+        metric = metrics[0]
+        self.stdout.write(f"Scored {genuine[metric].sum()} genuine and {impostor[metric].sum()} impostor pairs "
+                          f"in {time.perf_counter() - started:.1f}s")
+        if not genuine[metric].sum():
+            raise CommandError("No genuine pairs: every identity needs at least two photos.")
+
+        model_name = get_engine().name
+        recommended, curves, unreachable = {}, [], []
+        for metric in metrics:
+            low, high = ranges[metric]
+            thresholds = low + (high - low) * np.arange(1, options['bins'] + 1) / options['bins']
+            far, frr = error_curves(genuine[metric], impostor[metric])
+            eer_at = int(np.argmin(np.abs(far - frr)))
+            current = get_threshold(metric, model_name)
+            current_at = min(int(np.searchsorted(thresholds, current)), len(thresholds) - 1)
+            summary = (f"{metric}: EER {100 * (far[eer_at] + frr[eer_at]) / 2:.2f}% at {thresholds[eer_at]:.4f}; "
+                       f"current {current}: FAR {100 * far[current_at]:.3f}%, FRR {100 * frr[current_at]:.2f}%")
+
+            # The loosest threshold that still meets the FAR target.
+            allowed = np.nonzero(far <= options['target_far'])[0]
+            if not len(allowed):
+                unreachable.append(metric)
+                self.stdout.write(self.style.ERROR(
+                    f"{summary}; no threshold reaches FAR {100 * options['target_far']:.3f}% "
+                    f"(lowest is {100 * far[0]:.3f}% at {thresholds[0]:.4f})"))
+            else:
+                at = int(allowed[-1])
+                recommended[metric] = round(float(thresholds[at]), 4)
+                self.stdout.write(f"{summary}; threshold {recommended[metric]} gives "
+                                  f"FAR {100 * far[at]:.3f}%, FRR {100 * frr[at]:.2f}%")
+            curves += [(metric, float(t), float(a), float(r)) for t, a, r in zip(thresholds, far, frr)]
+
+        if options['curves']:
+            with open(options['curves'], 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['metric', 'threshold', 'far', 'frr'])
+                writer.writerows(curves)
+            self.stdout.write(f"Wrote FAR/FRR curves to {options['curves']}")
+
+        if unreachable:
+            # Writing the tightest bin instead would reject every genuine user.
+            raise CommandError(f"--target-far {options['target_far']} is unreachable with this data for "
+                               f"{', '.join(unreachable)}; no thresholds were written. Use a larger dataset "
+                               f"or a higher target.")
+        if options['dry_run'] or not options['output']:
+            return
+        calibrated = {}
+        if os.path.exists(options['output']):
+            with open(options['output']) as f:
+                calibrated = json.load(f)
+        calibrated.setdefault(model_name, {}).update(recommended)
+        with open(options['output'], 'w') as f:
+            json.dump(calibrated, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {model_name} thresholds to {options['output']}; restart the web workers to use them"))
+
+    def embed(self, paths, batch_size, workers):
+        """Returns the embeddings of the images that decoded and their indexes in ``paths``."""
+        batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        embeddings, embedded = [], []
+
+        if workers:
+            pool = InferencePool(engine_path(), size=workers)
+            results = [pool.submit_files(batch) for batch in batches]
+            results = (future.result() for future in results)
+        else:
+            engine = get_engine()
+            results = (embed_files(engine, batch) for batch in batches)
+
+        for n, (indexes, batch_embeddings, errors) in enumerate(results):
+            for i, message in errors.items():
+                self.stderr.write(f"Skipping {batches[n][i]}: {message}")
+            embeddings.extend(batch_embeddings)
+            embedded.extend(n * batch_size + i for i in indexes)
+            if (n + 1) % 50 == 0:
+                self.stdout.write(f"  {min((n + 1) * batch_size, len(paths))}/{len(paths)} images")
+
+        if workers:
+            pool.shutdown()
+        return np.asarray(embeddings, dtype=np.float32), np.array(embedded, dtype=np.int64)
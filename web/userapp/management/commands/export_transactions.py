@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from userapp.history import EXPORT_FORMATS, filter_dates, export_lines, gzip_chunks
+from userapp.models import TransactionModel
+
+
+class Command(BaseCommand):
+    help = ("Streams transactions, oldest first, as CSV or NDJSON to a file or stdout, optionally gzipped. "
+            "Rows are read in chunks, so memory stays flat however many there are.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--branch', help="Only this branch (branch_name).")
+        parser.add_argument('--user', help="Only this customer (username).")
+        parser.add_argument('--start', help="First day, YYYY-MM-DD.")
+        parser.add_argument('--end', help="Last day, YYYY-MM-DD.")
+        parser.add_argument('--format', default='csv', choices=sorted(EXPORT_FORMATS))
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', help="File to write; defaults to stdout.")
+
+    def handle(self, *args, **options):
+        transactions = TransactionModel.objects.all()
+        if options['branch']:
+            transactions = transactions.filter(branch_name__branch_name=options['branch'])
+        if options['user']:
+            transactions = transactions.filter(username__username=options['user'])
+        try:
+            transactions = filter_dates(transactions, options['start'], options['end'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        chunks = export_lines(transactions, options['format'])
+        if options['gzip']:
+            chunks = gzip_chunks(chunks)
+        else:
+            chunks = (chunk.encode() for chunk in chunks)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
@@ -0,0 +1,227 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from userapp import embedding_codec
+from userapp.distance import l2_normalize
+from userapp.duplicates import min_similarity, usernames
+from userapp.engines import get_engine
+from userapp.face_index import USER, FAMILY, encode_key, decode_key, stored_dimension
+from userapp.models import UserModel, FamilyModel, IdentityMatchModel
+
+
+def stream_embeddings(path, chunk_size=2000):
+    """Writes every embedding of the configured model, L2-normalized, into a
+    memory-mapped float32 matrix at ``path``/embeddings.npy, one DB chunk at a
+    time, so the process never holds more than one chunk of blobs. Returns
+    (matrix, ids)."""
+    model_name = get_engine().name
+    models = ((USER, UserModel.objects.filter(embedding_model=model_name)),
+              (FAMILY, FamilyModel.objects.filter(embedding_model=model_name)))
+    total = sum(rows.count() for _, rows in models)
+    dim = stored_dimension(model_name)
+    matrix = np.lib.format.open_memmap(os.path.join(path, 'embeddings.npy'), mode='w+',
+                                       dtype=np.float32, shape=(max(total, 1), dim))
+    ids = np.empty(total, dtype=np.int64)
+
+    row = 0
+    for kind, rows in models:
+        for pk, blob in rows.values_list('id', 'embedding').iterator(chunk_size=chunk_size):
+            if row == total:
+                break
+            try:
+                embedding = embedding_codec.decode(blob)
+            except embedding_codec.EmbeddingFormatError as e:
+                print(f"⚠️ Skipping {kind} {pk}: {e}")
+                continue
+            if embedding.size != dim:
+                print(f"⚠️ Skipping {kind} {pk}: {embedding.size}-d embedding, expected {dim}-d")
+                continue
+            matrix[row] = l2_normalize(embedding)
+            ids[row] = encode_key(kind, pk)
+            row += 1
+    matrix.flush()
+    np.save(os.path.join(path, 'ids.npy'), ids[:row])
+    return matrix, ids[:row]
+
+
+def block_pairs(matrix, start, stop, block_size, threshold):
+    """All pairs (i, j), i < j, with i in [start, stop) whose cosine similarity
+    is at least ``threshold``. Similarity is computed one
+    (stop - start) x block_size tile at a time."""
+    count = len(matrix)
+    rows = np.asarray(matrix[start:stop])
+    found_i, found_j, found_score = [], [], []
+    for col in range(start, count, block_size):
+        tile = rows @ np.asarray(matrix[col:col + block_size]).T
+        if col == start:
+            # Diagonal tile: keep only the upper triangle so each pair is seen once.
+            tile[np.tril_indices(len(rows), m=tile.shape[1])] = -1
+        i, j = np.nonzero(tile >= threshold)
+        found_i.append(i + start)
+        found_j.append(j + col)
+        found_score.append(tile[i, j])
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_score)
+
+
+def connected_clusters(pairs_i, pairs_j):
+    """Union-find over the matched pairs. Returns {root: [row, ...]} for every
+    cluster of two or more rows."""
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in zip(pairs_i.tolist(), pairs_j.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = {}
+    for row in parent:
+        clusters.setdefault(find(row), []).append(row)
+    return clusters
+
+
+class Command(BaseCommand):
+    help = ("Finds every pair of enrolled faces (users and family members) that look like the same "
+            "person and writes the pairs and their connected clusters to CSV. Resumable: rerunning "
+            "an interrupted job skips the row blocks it already finished.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, help="Minimum cosine similarity (default: FACE_DUPLICATE_MIN_SIMILARITY).")
+        parser.add_argument('--block-size', type=int, default=2048, help="Rows per tile; memory is about 4 * block_size^2 bytes per worker.")
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+        parser.add_argument('--work-dir', default=os.path.join(settings.BASE_DIR, 'face_duplicates'),
+                            help="Holds the embedding matrix and per-block results between runs.")
+        parser.add_argument('--output', default='face_duplicates.csv', help="CSV of matched pairs.")
+        parser.add_argument('--clusters', default='face_duplicate_clusters.csv', help="CSV of connected clusters.")
+        parser.add_argument('--save', action='store_true', help="Also record new pairs in IdentityMatchModel for review.")
+        parser.add_argument('--fresh', action='store_true', help="Discard an unfinished previous run.")
+
+    def handle(self, *args, **options):
+        threshold = options['threshold'] if options['threshold'] is not None else min_similarity()
+        block_size = options['block_size']
+        work_dir = options['work_dir']
+        os.makedirs(work_dir, exist_ok=True)
+
+        job = {'threshold': threshold, 'block_size': block_size, 'complete': False}
+        meta_path = os.path.join(work_dir, 'meta.json')
+        previous = None
+        if os.path.exists(meta_path) and not options['fresh']:
+            with open(meta_path) as f:
+                previous = json.load(f)
+
+        started = time.perf_counter()
+        if previous and not previous['complete'] and all(previous[key] == job[key] for key in ('threshold', 'block_size')):
+            matrix = np.load(os.path.join(work_dir, 'embeddings.npy'), mmap_mode='r')
+            ids = np.load(os.path.join(work_dir, 'ids.npy'))
+            matrix = matrix[:len(ids)]
+            self.stdout.write(f"Resuming run over {len(ids)} embeddings")
+        else:
+            for name in os.listdir(work_dir):
+                if name.startswith('block_'):
+                    os.remove(os.path.join(work_dir, name))
+            matrix, ids = stream_embeddings(work_dir)
+            matrix = matrix[:len(ids)]
+            with open(meta_path, 'w') as f:
+                json.dump(dict(job, count=len(ids)), f)
+            self.stdout.write(f"Loaded {len(ids)} embeddings in {time.perf_counter() - started:.1f}s")
+
+        starts = list(range(0, len(ids), block_size))
+        todo = [start for start in starts if not os.path.exists(self.block_path(work_dir, start))]
+        self.stdout.write(f"{len(starts) - len(todo)} of {len(starts)} row blocks already done")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {
+                executor.submit(block_pairs, matrix, start, min(start + block_size, len(ids)), block_size, threshold): start
+                for start in todo
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                start = futures[future]
+                pairs_i, pairs_j, scores = future.result()
+                # Write then rename, so a crash never leaves a half-written block behind.
+                path = self.block_path(work_dir, start)
+                np.savez(path + '.tmp.npz', i=pairs_i, j=pairs_j, score=scores)
+                os.replace(path + '.tmp.npz', path)
+                self.stdout.write(f"  block {done}/{len(todo)} ({len(scores)} pairs), "
+                                  f"{time.perf_counter() - started:.1f}s")
+
+        pairs_i, pairs_j, scores = [], [], []
+        for start in starts:
+            with np.load(self.block_path(work_dir, start)) as block:
+                pairs_i.append(block['i'])
+                pairs_j.append(block['j'])
+                scores.append(block['score'])
+        pairs_i = np.concatenate(pairs_i) if pairs_i else np.empty(0, dtype=np.int64)
+        pairs_j = np.concatenate(pairs_j) if pairs_j else np.empty(0, dtype=np.int64)
+        scores = np.concatenate(scores) if scores else np.empty(0, dtype=np.float32)
+
+        self.write_report(options, ids, pairs_i, pairs_j, scores)
+
+        with open(meta_path, 'w') as f:
+            json.dump(dict(job, count=len(ids), complete=True, pairs=len(scores)), f)
+        self.stdout.write(self.style.SUCCESS(
+            f"Found {len(scores)} pairs above {threshold:.2f} in {time.perf_counter() - started:.1f}s"))
+
+    @staticmethod
+    def block_path(work_dir, start):
+        return os.path.join(work_dir, f'block_{start:09d}.npz')
+
+    def write_report(self, options, ids, pairs_i, pairs_j, scores):
+        keys = [decode_key(int(id)) for id in ids]
+        clusters = connected_clusters(pairs_i, pairs_j)
+        cluster_of = {row: n for n, members in enumerate(clusters.values(), 1) for row in members}
+        matched = sorted(set(pairs_i.tolist()) | set(pairs_j.tolist()))
+        names = usernames([keys[row] for row in matched])
+
+        order = np.argsort(-scores)
+        with open(options['output'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['cluster', 'kind', 'id', 'username', 'match_kind', 'match_id', 'match_username', 'similarity'])
+            for n in order:
+                i, j = int(pairs_i[n]), int(pairs_j[n])
+                writer.writerow([cluster_of[i], *keys[i], names.get(keys[i], ''),
+                                 *keys[j], names.get(keys[j], ''), f'{scores[n]:.4f}'])
+
+        with open(options['clusters'], 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['cluster', 'size', 'members'])
+            for n, members in enumerate(clusters.values(), 1):
+                writer.writerow([n, len(members), ' '.join(
+                    f'{keys[row][0]}:{names.get(keys[row], keys[row][1])}' for row in sorted(members))])
+        self.stdout.write(f"Wrote {len(scores)} pairs to {options['output']} and "
+                          f"{len(clusters)} clusters to {options['clusters']}")
+
+        if options['save']:
+            self.save_matches(keys, names, pairs_i, pairs_j, scores)
+
+    def save_matches(self, keys, names, pairs_i, pairs_j, scores):
+        seen = set()
+        for row in IdentityMatchModel.objects.values_list('kind', 'object_id', 'match_kind', 'match_object_id'):
+            seen.add((row[0], row[1], row[2], row[3]))
+            seen.add((row[2], row[3], row[0], row[1]))
+
+        new = []
+        for i, j, score in zip(pairs_i.tolist(), pairs_j.tolist(), scores.tolist()):
+            (kind, pk), (match_kind, match_pk) = keys[i], keys[j]
+            if (kind, pk, match_kind, match_pk) in seen or keys[i] not in names or keys[j] not in names:
+                continue
+            new.append(IdentityMatchModel(
+                kind=kind, object_id=pk, username=names[keys[i]],
+                match_kind=match_kind, match_object_id=match_pk, match_username=names[keys[j]],
+                similarity=score, source='Batch',
+            ))
+        IdentityMatchModel.objects.bulk_create(new, batch_size=1000)
+        self.stdout.write(f"Recorded {len(new)} new pairs for review")
@@ -0,0 +1,246 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from branchapp.models import BranchModel
+from userapp import embedding_codec
+from userapp.ledger import credit_entry
+from userapp.engines import get_engine, engine_path
+from userapp.inference_pool import InferencePool
+from userapp.models import UserModel, AccountModel, FamilyModel, LedgerEntryModel, face_image_storage, face_image_path
+
+
+REQUIRED = ('username', 'first_name', 'last_name', 'email', 'phone', 'image')
+USER_FIELDS = ('first_name', 'last_name', 'gender', 'address', 'email', 'city', 'state', 'country')
+FAMILY_FIELDS = ('family_username', 'family_name', 'family_email', 'family_phone', 'relationship', 'family_image')
+
+
+class RowError(ValueError):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Onboards customers from a CSV and a folder of face photos. Columns: username, first_name, "
+            "last_name, email, phone and image are required; gender, address, city, state, country, "
+            "account_number, account_type, balance and branch (branch name) add an account, and "
+            "family_username, family_name, family_email, family_phone, relationship and family_image "
+            "add a family member. Photos are decoded and embedded in worker processes and rows are "
+            "written with bulk_create, one transaction per chunk. An interrupted import resumes after "
+            "the last committed chunk.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path')
+        parser.add_argument('--images', help="Folder the image columns are relative to (default: the CSV's folder).")
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                            help="Worker processes; each loads its own copy of the model.")
+        parser.add_argument('--batch-size', type=int, default=16, help="Images per forward pass.")
+        parser.add_argument('--chunk-size', type=int, default=500, help="CSV rows per transaction.")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the top.")
+
+    def handle(self, *args, **options):
+        csv_path = options['csv_path']
+        if not os.path.exists(csv_path):
+            raise CommandError(f"{csv_path} does not exist.")
+        self.images = options['images'] or os.path.dirname(os.path.abspath(csv_path))
+        self.batch_size = options['batch_size']
+        self.model_name = get_engine().name
+        self.branches = {branch.branch_name: branch for branch in BranchModel.objects.all()}
+        self.taken = set()
+
+        checkpoint_path = csv_path + '.checkpoint.json'
+        errors_path = csv_path + '.errors.csv'
+        resume_after = 0
+        if os.path.exists(checkpoint_path) and not options['restart']:
+            with open(checkpoint_path) as f:
+                resume_after = json.load(f)['line']
+            self.stdout.write(f"Resuming after line {resume_after}")
+
+        self.pool = InferencePool(engine_path(), size=options['workers'])
+        self.stdout.write(f"Starting {options['workers']} embedding workers...")
+        self.pool.warm_up()
+
+        started = time.perf_counter()
+        self.imported = self.failed = 0
+        with open(csv_path, newline='') as f, open(errors_path, 'a' if resume_after else 'w', newline='') as errors_file:
+            self.errors = csv.writer(errors_file)
+            if not resume_after:
+                self.errors.writerow(['line', 'username', 'error'])
+
+            # Line numbers count the header as line 1, as spreadsheets do.
+            rows = ((line, row) for line, row in enumerate(csv.DictReader(f), 2) if line > resume_after)
+            # The next chunk is embedding in the workers while the current one is written.
+            pending = None
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                prepared = self.submit(chunk) if chunk else None
+                if pending:
+                    self.write(*pending)
+                    with open(checkpoint_path, 'w') as checkpoint:
+                        json.dump({'line': pending[0][-1][0]}, checkpoint)
+                    errors_file.flush()
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"  line {pending[0][-1][0]}: {self.imported} imported, {self.failed} failed, "
+                                      f"{self.imported / elapsed:.1f} customers/s")
+                if not chunk:
+                    break
+                pending = (chunk, prepared)
+
+        self.pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.imported} customers in {time.perf_counter() - started:.1f}s; "
+            f"{self.failed} rows failed, see {errors_path}"))
+        self.stdout.write("bulk_create skips model signals: restart the web workers and rerun "
+                          "build_face_ivf so identification and duplicate checks see the new faces.")
+
+    def submit(self, chunk):
+        """Validates a chunk and sends its photos to the workers. Returns
+        {line: (row, user image index, family image index)} and the futures."""
+        self.check_unique(chunk)
+        valid, paths = {}, []
+        for line, row in chunk:
+            try:
+                self.validate(row)
+            except RowError as e:
+                self.fail(line, row, e)
+                continue
+            user_image = len(paths)
+            paths.append(os.path.join(self.images, row['image']))
+            family_image = None
+            if row.get('family_username'):
+                family_image = len(paths)
+                paths.append(os.path.join(self.images, row['family_image']))
+            valid[line] = (row, user_image, family_image)
+
+        futures = [self.pool.submit_files(paths[i:i + self.batch_size])
+                   for i in range(0, len(paths), self.batch_size)]
+        return valid, paths, futures
+
+    def check_unique(self, chunk):
+        """Adds the usernames and account numbers of a chunk that are already
+        in the DB to ``taken``, with one query per column."""
+        usernames = [row.get('username') for _, row in chunk]
+        family = [row.get('family_username') for _, row in chunk if row.get('family_username')]
+        accounts = [row.get('account_number') for _, row in chunk if row.get('account_number')]
+        self.taken |= set(UserModel.objects.filter(username__in=usernames).values_list('username', flat=True))
+        self.taken |= {f'family:{name}' for name in
+                       FamilyModel.objects.filter(username__in=family).values_list('username', flat=True)}
+        self.taken |= {f'account:{number}' for number in
+                       AccountModel.objects.filter(account_number__in=[n for n in accounts if n.isdigit()])
+                       .values_list('account_number', flat=True)}
+
+    def validate(self, row):
+        missing = [column for column in REQUIRED if not row.get(column)]
+        if missing:
+            raise RowError(f"Missing {', '.join(missing)}")
+        if row['username'] in self.taken:
+            raise RowError("Username already exists")
+        if not row['phone'].isdigit():
+            raise RowError("Phone must be a number")
+
+        if row.get('account_number'):
+            if not row['account_number'].isdigit():
+                raise RowError("Account number must be a number")
+            if f"account:{row['account_number']}" in self.taken:
+                raise RowError("Account number already registered")
+            if row.get('branch') not in self.branches:
+                raise RowError(f"Unknown branch {row.get('branch')!r}")
+            if not (row.get('balance') or '0').isdigit():
+                raise RowError("Balance must be a whole number")
+
+        if row.get('family_username'):
+            missing = [column for column in FAMILY_FIELDS if not row.get(column)]
+            if missing:
+                raise RowError(f"Missing {', '.join(missing)}")
+            if f"family:{row['family_username']}" in self.taken:
+                raise RowError("Family username already exists")
+            if not row['family_phone'].isdigit():
+                raise RowError("Family phone must be a number")
+
+        # Later rows of the file can't reuse them either.
+        self.taken.add(row['username'])
+        if row.get('account_number'):
+            self.taken.add(f"account:{row['account_number']}")
+        if row.get('family_username'):
+            self.taken.add(f"family:{row['family_username']}")
+
+    def fail(self, line, row, error):
+        self.failed += 1
+        self.errors.writerow([line, row.get('username', ''), str(error)])
+
+    def write(self, chunk, prepared):
+        valid, paths, futures = prepared
+        embeddings, image_errors = {}, {}
+        for n, future in enumerate(futures):
+            offset = n * self.batch_size
+            try:
+                embedded, batch, errors = future.result()
+            except Exception as e:
+                errors = {i: f"Embedding failed: {e}" for i in range(min(self.batch_size, len(paths) - offset))}
+                embedded, batch = [], []
+            for i, embedding in zip(embedded, batch):
+                embeddings[offset + i] = embedding
+            for i, message in errors.items():
+                image_errors[offset + i] = message
+
+        users, accounts, families = [], [], []
+        for line, (row, user_image, family_image) in valid.items():
+            failed = [image for image in (user_image, family_image) if image is not None and image not in embeddings]
+            if failed:
+                self.fail(line, row, image_errors.get(failed[0], "Embedding failed"))
+                continue
+
+            user = UserModel(
+                username=row['username'],
+                phone=int(row['phone']),
+                embedding=embedding_codec.encode(embeddings[user_image]),
+                embedding_model=self.model_name,
+                **{field: row.get(field) or '' for field in USER_FIELDS},
+            )
+            user.gender = user.gender or 'Male'
+            user.face_image = self.store_image(paths[user_image])
+            users.append(user)
+
+            if row.get('account_number'):
+                branch = self.branches[row['branch']]
+                accounts.append((user, AccountModel(
+                    account_number=int(row['account_number']),
+                    branch_name=branch,
+                    account_type=row.get('account_type') or 'Savings',
+                    ifsc_code=branch.ifsc_code,
+                    balance=int(row.get('balance') or 0),
+                )))
+
+            if family_image is not None:
+                families.append((user, FamilyModel(
+                    username=row['family_username'],
+                    name=row['family_name'],
+                    email=row['family_email'],
+                    phone=int(row['family_phone']),
+                    relationship=row['relationship'],
+                    embedding=embedding_codec.encode(embeddings[family_image]),
+                    embedding_model=self.model_name,
+                    face_image=self.store_image(paths[family_image]),
+                )))
+
+        with transaction.atomic():
+            UserModel.objects.bulk_create(users)
+            for user, account in accounts:
+                account.username = user
+            AccountModel.objects.bulk_create([account for _, account in accounts])
+            LedgerEntryModel.objects.bulk_create([credit_entry(account.id, account.balance, 'Opening')
+                                                  for _, account in accounts])
+            for user, family_member in families:
+                family_member.account_username = user
+            FamilyModel.objects.bulk_create([family_member for _, family_member in families])
+        self.imported += len(users)
+
+    def store_image(self, path):
+        """Copies a photo into face image storage as the retained enrollment image."""
+        with open(path, 'rb') as f:
+            return face_image_storage.save(face_image_path(None, path), File(f))
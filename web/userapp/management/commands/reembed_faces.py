@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from userapp import embedding_codec, embedding_service
+from userapp.engines import get_engine
+from userapp.face_index import USER, FAMILY
+from userapp.image_decode import decode_face_image, ImageRejected
+from userapp.models import UserModel, FamilyModel
+
+
+def reembed_batch(model, pks, target):
+    """Re-embeds one batch of rows from their enrollment images. Returns
+    (updated, failed). A row that was re-enrolled while the batch ran keeps
+    its new embedding."""
+    rows, face_arrays, failed = [], [], 0
+    try:
+        for row in model.objects.filter(id__in=pks).only('id', 'username', 'face_image'):
+            try:
+                with row.face_image.open('rb') as f:
+                    face_arrays.append(decode_face_image(f.read()))
+                rows.append(row)
+            except (OSError, ImageRejected) as e:
+                print(f"⚠️ Cannot re-embed {row.username}: {e}")
+                failed += 1
+        if not rows:
+            return 0, failed
+
+        embeddings = embedding_service.embed_many(face_arrays, target, block=True)
+        updated = 0
+        with transaction.atomic():
+            for row, embedding in zip(rows, embeddings):
+                updated += model.objects.filter(id=row.id, face_image=row.face_image.name).exclude(
+                    embedding_model=target).update(embedding=embedding_codec.encode(embedding), embedding_model=target,
+                                                   updated_at=timezone.now())
+        return updated, failed
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ("Re-embeds stored faces with another model from their retained enrollment images and "
+            "tags them with it. Resumable: only rows still on another model are processed and every "
+            "batch is committed on its own, so an interrupted run just picks up the rest. Run it "
+            "before switching FACE_EMBEDDING_ENGINE; logins compare each row with its own model meanwhile.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', help="Model to re-embed with (default: the configured engine's).")
+        parser.add_argument('--batch-size', type=int, default=32)
+        parser.add_argument('--workers', type=int, default=2, help="Batches in flight at once.")
+
+    def handle(self, *args, **options):
+        target = get_engine(options['model']).name
+        batch_size = options['batch_size']
+        get_engine(target).load()
+
+        started = time.perf_counter()
+        totals = {'updated': 0, 'failed': 0, 'no_image': 0}
+        for kind, model in ((USER, UserModel), (FAMILY, FamilyModel)):
+            pending = model.objects.exclude(embedding_model=target)
+            no_image = Q(face_image='') | Q(face_image__isnull=True)
+            totals['no_image'] += pending.filter(no_image).count()
+            pks = list(pending.exclude(no_image).order_by('id').values_list('id', flat=True))
+            batches = [pks[i:i + batch_size] for i in range(0, len(pks), batch_size)]
+            self.stdout.write(f"{len(pks)} {kind} rows to re-embed with {target}")
+
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                done = 0
+                for updated, failed in executor.map(lambda batch: reembed_batch(model, batch, target), batches):
+                    totals['updated'] += updated
+                    totals['failed'] += failed
+                    done += updated + failed
+                    self.stdout.write(f"  {kind}: {done}/{len(pks)}, "
+                                      f"{done / (time.perf_counter() - started):.1f} faces/s")
+
+        if totals['no_image']:
+            self.stdout.write(self.style.WARNING(
+                f"{totals['no_image']} rows have no enrollment image and must re-enroll"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-embedded {totals['updated']} faces with {target} ({totals['failed']} failed) "
+            f"in {time.perf_counter() - started:.1f}s"))
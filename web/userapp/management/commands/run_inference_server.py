@@ -0,0 +1,65 @@
+import os
+import socketserver
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from userapp import embedding_service, inference_protocol as protocol
+from userapp.inference_pool import PoolBusy
+
+
+class InferenceRequestHandler(socketserver.BaseRequestHandler):
+    """Serves embedding requests on one client connection until it closes."""
+
+    def handle(self):
+        while True:
+            try:
+                payload = protocol.read_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            protocol.write_message(self.request, self.respond(payload))
+
+    def respond(self, payload):
+        try:
+            face_arrays = protocol.decode_request(payload)
+            if not face_arrays:
+                return protocol.encode_response(np.empty((0, 0), dtype=np.float32))
+            # Requests from every connected worker meet in the same batcher.
+            embeddings = embedding_service.get_service().embed_many(face_arrays)
+            return protocol.encode_response(np.stack(embeddings))
+        except PoolBusy as e:
+            return protocol.encode_error(protocol.BUSY, str(e))
+        except Exception as e:
+            return protocol.encode_error(protocol.ERROR, str(e))
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Command(BaseCommand):
+    help = ("Runs the face inference sidecar: one process that holds the model and serves "
+            "embedding requests from every Django worker on the host over a Unix socket.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=getattr(settings, 'FACE_INFERENCE_SOCKET', None))
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if not path:
+            raise CommandError("Set FACE_INFERENCE_SOCKET or pass --socket.")
+        if os.path.exists(path):
+            os.unlink(path)
+
+        embedding_service.warm_up(local=True)
+
+        with InferenceServer(path, InferenceRequestHandler) as server:
+            os.chmod(path, 0o660)
+            self.stdout.write(self.style.SUCCESS(f"Inference server listening on {path}"))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(path)
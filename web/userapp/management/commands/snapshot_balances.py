@@ -0,0 +1,34 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from userapp.ledger import take_snapshots, reconcile
+
+
+class Command(BaseCommand):
+    help = ("Checkpoints every account's ledger balance so balance_as_of only has to add up the entries "
+            "since the last snapshot. Run it nightly; --reconcile also compares AccountModel.balance "
+            "with the ledger.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lag-minutes', type=int, default=5,
+                            help="Snapshot as of this long ago, so transfers still committing are not missed.")
+        parser.add_argument('--reconcile', action='store_true')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['lag_minutes'])
+        started = time.perf_counter()
+        count = take_snapshots(cutoff)
+        self.stdout.write(self.style.SUCCESS(
+            f"Snapshotted {count} balances as of {cutoff:%Y-%m-%d %H:%M:%S} in {time.perf_counter() - started:.1f}s"))
+
+        if options['reconcile']:
+            mismatches = reconcile()
+            for account_id, balance, ledger_balance in mismatches:
+                self.stdout.write(self.style.ERROR(
+                    f"Account id {account_id}: balance {balance}, ledger {ledger_balance} "
+                    f"({balance - ledger_balance:+d})"))
+            if not mismatches:
+                self.stdout.write(self.style.SUCCESS("Every balance matches its ledger"))
@@ -0,0 +1,47 @@
+import pickle
+
+from django.db import migrations
+
+from userapp import embedding_codec
+
+
+BATCH_SIZE = 500
+
+
+def convert(apps, schema_editor, to_codec):
+    for model_name in ('UserModel', 'FamilyModel'):
+        model = apps.get_model('userapp', model_name)
+        rows = []
+        for row in model.objects.only('id', 'embedding').iterator(chunk_size=BATCH_SIZE):
+            if not row.embedding or embedding_codec.is_encoded(row.embedding) == to_codec:
+                continue
+            if to_codec:
+                # One-time read of the legacy pickled rows written by this app.
+                row.embedding = embedding_codec.encode(pickle.loads(row.embedding))
+            else:
+                row.embedding = pickle.dumps(embedding_codec.decode(row.embedding).astype(float).tolist())
+            rows.append(row)
+            if len(rows) >= BATCH_SIZE:
+                model.objects.bulk_update(rows, ['embedding'])
+                rows = []
+        if rows:
+            model.objects.bulk_update(rows, ['embedding'])
+
+
+def forwards(apps, schema_editor):
+    convert(apps, schema_editor, to_codec=True)
+
+
+def backwards(apps, schema_editor):
+    convert(apps, schema_editor, to_codec=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userapp', '0006_usercomplaintmodel'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userapp', '0007_float32_embeddings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdentityMatchModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'User'), ('family', 'Family')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('username', models.CharField(max_length=30)),
+                ('match_kind', models.CharField(choices=[('user', 'User'), ('family', 'Family')], max_length=10)),
+                ('match_object_id', models.IntegerField()),
+                ('match_username', models.CharField(max_length=30)),
+                ('similarity', models.FloatField()),
+                ('source', models.CharField(choices=[('Enrollment', 'Enrollment'), ('Batch', 'Batch')], default='Enrollment', max_length=10)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Confirmed', 'Confirmed'), ('Dismissed', 'Dismissed')], default='Pending', max_length=10)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userapp', '0008_identitymatchmodel'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='familymodel',
+            name='embedding_model',
+            field=models.CharField(default='Facenet512', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='familymodel',
+            name='face_image',
+            field=models.ImageField(blank=True, null=True, upload_to='faces/'),
+        ),
+        migrations.AddField(
+            model_name='usermodel',
+            name='embedding_model',
+            field=models.CharField(default='Facenet512', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='usermodel',
+            name='face_image',
+            field=models.ImageField(blank=True, null=True, upload_to='faces/'),
+        ),
+    ]
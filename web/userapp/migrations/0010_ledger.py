@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def opening_entries(apps, schema_editor):
+    """Starts every existing account's ledger with its current balance."""
+    AccountModel = apps.get_model('userapp', 'AccountModel')
+    LedgerEntryModel = apps.get_model('userapp', 'LedgerEntryModel')
+    entries = [
+        LedgerEntryModel(account_number_id=account_id, entry_type='Credit', amount=balance, source='Opening')
+        for account_id, balance in AccountModel.objects.values_list('id', 'balance').iterator(chunk_size=2000)
+    ]
+    LedgerEntryModel.objects.bulk_create(entries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userapp', '0009_embedding_model'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshotModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField()),
+                ('date', models.DateTimeField()),
+                ('account_number', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='userapp.accountmodel')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account_number', 'date'], name='userapp_bal_account_3f53f0_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntryModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('Debit', 'Debit'), ('Credit', 'Credit')], max_length=6)),
+                ('amount', models.IntegerField()),
+                ('source', models.CharField(choices=[('Opening', 'Opening'), ('Transfer', 'Transfer'), ('Loan', 'Loan'), ('Deposit', 'Deposit'), ('Withdrawal', 'Withdrawal')], max_length=10)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('account_number', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='userapp.accountmodel')),
+                ('loan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='userapp.loanmodel')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='userapp.transactionmodel')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account_number', 'date'], name='userapp_led_account_dcde9a_idx')],
+            },
+        ),
+        migrations.RunPython(opening_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('branchapp', '0002_complaintmodel'),
+        ('userapp', '0010_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transactionmodel',
+            index=models.Index(fields=['username', 'date', 'id'], name='userapp_tra_usernam_60d3fb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionmodel',
+            index=models.Index(fields=['branch_name', 'date', 'id'], name='userapp_tra_branch__d02e0c_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:19
+
+import userapp.models
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def move_face_images(apps, schema_editor):
+    """Moves photos already retained under MEDIA_ROOT into FACE_IMAGE_ROOT,
+    renaming them opaquely, so the media route stops serving them."""
+    for name in ('UserModel', 'FamilyModel'):
+        model = apps.get_model('userapp', name)
+        for row in model.objects.exclude(face_image='').exclude(face_image__isnull=True).only('id', 'face_image'):
+            old = row.face_image.name
+            if not default_storage.exists(old):
+                continue
+            with default_storage.open(old, 'rb') as f:
+                new = userapp.models.face_image_storage.save(userapp.models.face_image_path(row, old), f)
+            model.objects.filter(id=row.id).update(face_image=new)
+            default_storage.delete(old)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userapp', '0012_face_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='familymodel',
+            name='face_image',
+            field=models.ImageField(blank=True, null=True, storage=userapp.models.FaceImageStorage(), upload_to=userapp.models.face_image_path),
+        ),
+        migrations.AlterField(
+            model_name='usermodel',
+            name='face_image',
+            field=models.ImageField(blank=True, null=True, storage=userapp.models.FaceImageStorage(), upload_to=userapp.models.face_image_path),
+        ),
+        migrations.RunPython(move_face_images, migrations.RunPython.noop),
+    ]
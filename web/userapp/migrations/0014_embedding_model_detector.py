@@ -0,0 +1,45 @@
+from django.db import migrations, models
+
+
+# Embeddings stored before the tag named the face detector were all produced
+# with DeepFace's default, opencv.
+DEEPFACE_MODELS = ('VGG-Face', 'Facenet', 'Facenet512', 'OpenFace', 'DeepFace', 'DeepID',
+                   'ArcFace', 'Dlib', 'SFace', 'GhostFaceNet')
+LEGACY_DETECTOR = 'opencv'
+
+
+def add_detector(apps, schema_editor):
+    for name in ('UserModel', 'FamilyModel'):
+        model = apps.get_model('userapp', name)
+        for model_name in DEEPFACE_MODELS:
+            model.objects.filter(embedding_model=model_name).update(
+                embedding_model=f'{model_name}/{LEGACY_DETECTOR}')
+
+
+def remove_detector(apps, schema_editor):
+    for name in ('UserModel', 'FamilyModel'):
+        model = apps.get_model('userapp', name)
+        for model_name in DEEPFACE_MODELS:
+            model.objects.filter(embedding_model=f'{model_name}/{LEGACY_DETECTOR}').update(
+                embedding_model=model_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('userapp', '0013_face_image_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='familymodel',
+            name='embedding_model',
+            field=models.CharField(default='Facenet512/opencv', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='usermodel',
+            name='embedding_model',
+            field=models.CharField(default='Facenet512/opencv', max_length=50),
+        ),
+        migrations.RunPython(add_detector, remove_detector),
+    ]
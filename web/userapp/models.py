@@ -1,7 +1,37 @@
-from django.db import models
+import os
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import models, transaction
+from django.db.models import F
 from branchapp . models import BranchModel
 
 
+class FaceImageStorage(FileSystemStorage):
+    """Retained enrollment photos are biometric data, so they live under
+    FACE_IMAGE_ROOT, outside MEDIA_ROOT, where the media route never serves them."""
+
+    def __init__(self):
+        super().__init__(base_url=None)
+
+    @property
+    def base_location(self):
+        return getattr(settings, 'FACE_IMAGE_ROOT', os.path.join(settings.BASE_DIR, 'face_images'))
+
+    @property
+    def location(self):
+        return os.path.abspath(self.base_location)
+
+
+face_image_storage = FaceImageStorage()
+
+
+def face_image_path(instance, filename):
+    # Opaque names; nothing of the client's filename is kept.
+    return f'faces/{uuid.uuid4().hex}'
+
+
 class UserModel(models.Model):
     GENDER_CHOICES = [
         ('Male', 'Male'),
@@ -24,6 +54,10 @@ class UserModel(models.Model):
     country = models.CharField(max_length=50)
     date = models.DateField(auto_now_add=True)
     embedding = models.BinaryField()
+    embedding_model = models.CharField(max_length=50, default='Facenet512/opencv')
+    face_image = models.ImageField(upload_to=face_image_path, storage=face_image_storage, null=True, blank=True)
+    # Lets an IVF index loaded from disk catch up with rows changed since it was built.
+    updated_at = models.DateTimeField(auto_now=True, null=True, db_index=True)
 
     def __str__(self):
         return self.username
@@ -46,21 +80,31 @@ class AccountModel(models.Model):
     balance = models.IntegerField()
     date = models.DateField(auto_now_add=True)
 
+    # Both update only the balance column, in one conditional UPDATE, so
+    # concurrent calls can't lose each other's changes, and record the change
+    # in the ledger. Use userapp.transfers to move money between accounts.
     def deposit(self, amount):
         if amount > 0:
-            self.balance += amount
-            self.save()
+            with transaction.atomic():
+                AccountModel.objects.filter(id=self.id).update(balance=F('balance') + amount)
+                LedgerEntryModel.objects.create(account_number_id=self.id, entry_type=LedgerEntryModel.CREDIT,
+                                                amount=amount, source='Deposit')
+            self.refresh_from_db(fields=['balance'])
             return True
 
         return False
 
     def withdraw(self, amount):
-        if amount > 0 and self.balance >= amount:
-            self.balance -= amount
-            self.save()
-            return True
-
-        return False
+        if amount <= 0:
+            return False
+        with transaction.atomic():
+            if not AccountModel.objects.filter(id=self.id, balance__gte=amount).update(
+                    balance=F('balance') - amount):
+                return False
+            LedgerEntryModel.objects.create(account_number_id=self.id, entry_type=LedgerEntryModel.DEBIT,
+                                            amount=amount, source='Withdrawal')
+        self.refresh_from_db(fields=['balance'])
+        return True
 
     def __str__(self):
         return f"{self.account_number}"
@@ -92,6 +136,10 @@ class FamilyModel(models.Model):
     relationship = models.CharField(max_length=100)
     date = models.DateField(auto_now_add=True)
     embedding = models.BinaryField()
+    embedding_model = models.CharField(max_length=50, default='Facenet512/opencv')
+    face_image = models.ImageField(upload_to=face_image_path, storage=face_image_storage, null=True, blank=True)
+    # Lets an IVF index loaded from disk catch up with rows changed since it was built.
+    updated_at = models.DateTimeField(auto_now=True, null=True, db_index=True)
 
     def __str__(self):
         return self.username
@@ -108,6 +156,13 @@ class TransactionModel(models.Model):
     is_verified = models.BooleanField(default=False)
     date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Transaction history pages are read newest first by (date, id).
+        indexes = [
+            models.Index(fields=['username', 'date', 'id']),
+            models.Index(fields=['branch_name', 'date', 'id']),
+        ]
+
     def __str__(self):
         return f"Transaction to {self.receiver_name} - {self.amount}"
 
@@ -121,3 +176,77 @@ class UserComplaintModel(models.Model):
     def __str__(self):
         return self.complaint
 
+
+
+class IdentityMatchModel(models.Model):
+    """Two enrolled faces that look like the same person, kept for review."""
+    KIND_CHOICES = [
+        ('user', 'User'),
+        ('family', 'Family'),
+    ]
+    SOURCE_CHOICES = [
+        ('Enrollment', 'Enrollment'),
+        ('Batch', 'Batch'),
+    ]
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Confirmed', 'Confirmed'),
+        ('Dismissed', 'Dismissed'),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    username = models.CharField(max_length=30)
+    match_kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    match_object_id = models.IntegerField()
+    match_username = models.CharField(max_length=30)
+    similarity = models.FloatField()
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='Enrollment')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
+    date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.username} ~ {self.match_username} ({self.similarity:.2f})"
+
+
+class LedgerEntryModel(models.Model):
+    """One side of a balance change. Entries are only ever inserted: an
+    account's balance is the sum of its credits minus its debits."""
+    DEBIT = 'Debit'
+    CREDIT = 'Credit'
+    ENTRY_TYPE_CHOICES = [
+        (DEBIT, 'Debit'),
+        (CREDIT, 'Credit'),
+    ]
+    SOURCE_CHOICES = [
+        ('Opening', 'Opening'),
+        ('Transfer', 'Transfer'),
+        ('Loan', 'Loan'),
+        ('Deposit', 'Deposit'),
+        ('Withdrawal', 'Withdrawal'),
+    ]
+    account_number = models.ForeignKey(AccountModel, on_delete=models.CASCADE)
+    entry_type = models.CharField(max_length=6, choices=ENTRY_TYPE_CHOICES)
+    amount = models.IntegerField()
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    transaction = models.ForeignKey(TransactionModel, on_delete=models.SET_NULL, null=True, blank=True)
+    loan = models.ForeignKey(LoanModel, on_delete=models.SET_NULL, null=True, blank=True)
+    date = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['account_number', 'date'])]
+
+    def __str__(self):
+        return f"{self.entry_type} {self.amount} on {self.account_number}"
+
+
+class BalanceSnapshotModel(models.Model):
+    """An account's balance as of ``date``, written by `snapshot_balances`."""
+    account_number = models.ForeignKey(AccountModel, on_delete=models.CASCADE)
+    balance = models.IntegerField()
+    date = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['account_number', 'date'])]
+
+    def __str__(self):
+        return f"{self.account_number}: {self.balance} at {self.date}"
@@ -0,0 +1,54 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import embedding_codec, face_index
+from .engines import get_engine
+from .face_index import USER, FAMILY
+from .models import UserModel, FamilyModel
+
+
+# These apply changes to the gallery and IVF index of the current process at
+# once. Other workers pick them up within FACE_GALLERY_SYNC_SECONDS (the
+# duplicate check at enrollment doesn't wait): before a search, the gallery or
+# IVF index re-reads rows added or changed (updated_at) since its last sync
+# and drops deleted ones. Only embeddings of the configured model are searchable; rows still
+# on another model are left out until they are re-embedded.
+
+def _upsert(kind, instance):
+    if not instance.embedding:
+        return
+    if instance.embedding_model != get_engine().name:
+        _remove(kind, instance)
+        return
+    try:
+        embedding = embedding_codec.decode(instance.embedding)
+    except embedding_codec.EmbeddingFormatError as e:
+        print(f"⚠️ Not indexing {kind} {instance.pk}: {e}")
+        return
+    transaction.on_commit(lambda: face_index.index_upsert(kind, instance.pk, embedding))
+
+
+def _remove(kind, instance):
+    pk = instance.pk
+    transaction.on_commit(lambda: face_index.index_remove(kind, pk))
+
+
+@receiver(post_save, sender=UserModel)
+def user_saved(sender, instance, **kwargs):
+    _upsert(USER, instance)
+
+
+@receiver(post_delete, sender=UserModel)
+def user_deleted(sender, instance, **kwargs):
+    _remove(USER, instance)
+
+
+@receiver(post_save, sender=FamilyModel)
+def family_saved(sender, instance, **kwargs):
+    _upsert(FAMILY, instance)
+
+
+@receiver(post_delete, sender=FamilyModel)
+def family_deleted(sender, instance, **kwargs):
+    _remove(FAMILY, instance)
@@ -1,3 +1,1309 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import importlib
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from PIL import Image
+from django.apps import apps as django_apps
+from django.conf import settings as django_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from branchapp.models import BranchModel
+from . import distance, embedding_codec, embedding_service, engines, face_index, face_model, face_quality, \
+    inference_protocol, ledger, transfers, views
+from .embedding_cache import EmbeddingCache, cache as embedding_cache
+from .embedding_service import EmbeddingBatcher
+from .image_decode import ImageRejected, decode_face_image
+from .inference_client import InferenceClient, InferenceUnavailable
+from .inference_pool import InferencePool, PoolBusy
+from .ivf_index import IVFIndex
+from .distance import l2_normalize
+from .management.commands import find_duplicate_faces
+from .management.commands.run_inference_server import InferenceServer, InferenceRequestHandler
+from .models import UserModel, AccountModel, LoanModel, TransactionModel, LedgerEntryModel, BalanceSnapshotModel, \
+    IdentityMatchModel, face_image_storage
+
+
+def create_accounts(*balances):
+    branch = BranchModel.objects.create(username='branch', bank_name='Bank', branch_name='Main', ifsc_code='IFSC0001',
+                                        address='-', city='-', state='-', country='-', postal_code=0,
+                                        contact_number='0', email='branch@example.com')
+    user = UserModel.objects.create(username='alice', first_name='Alice', last_name='A', address='-',
+                                    email='alice@example.com', phone=0, city='-', state='-', country='-',
+                                    embedding=b'')
+    accounts = [
+        AccountModel.objects.create(account_number=1000 + i, branch_name=branch, username=user,
+                                    ifsc_code=branch.ifsc_code, balance=balance)
+        for i, balance in enumerate(balances)
+    ]
+    LedgerEntryModel.objects.bulk_create([ledger.credit_entry(account.id, account.balance, 'Opening')
+                                          for account in accounts])
+    return accounts
+
+
+def create_face_user(username, embedding, **fields):
+    return UserModel.objects.create(username=username, first_name=username, last_name='-', address='-',
+                                    email=f'{username}@example.com', phone=0, city='-', state='-', country='-',
+                                    embedding=embedding_codec.encode(embedding), **fields)
+
+
+def face_jpeg(seed, name='face.jpg'):
+    pixels = np.random.default_rng(seed).integers(0, 256, (160, 160, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class StubEngineMixin:
+    """Runs the face pipeline on HashStubEngine with a fresh batcher, gallery
+    and cache, so the same photo always gets the same embedding."""
+
+    def setUp(self):
+        super().setUp()
+        self.face_images = tempfile.TemporaryDirectory()
+        self.addCleanup(self.face_images.cleanup)
+        settings = override_settings(FACE_QUALITY_CHECK=False, FACE_IVF_INDEX_DIR=None,
+                                     FACE_INFERENCE_SOCKET=None, FACE_INFERENCE_POOL_SIZE=0,
+                                     FACE_IMAGE_ROOT=self.face_images.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        for target, name, value in ((engines, '_engine', engines.HashStubEngine()),
+                                    (embedding_service, '_service', None),
+                                    (face_index, 'gallery', face_index.FaceGallery())):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        embedding_cache.clear()
+        self.addCleanup(embedding_cache.clear)
+
+    def register(self, username, image, **fields):
+        data = {'username': username, 'first_name': username, 'last_name': '-', 'gender': 'Other', 'address': '-',
+                'email': f'{username}@example.com', 'phone': '0', 'city': '-', 'state': '-', 'country': '-',
+                'image': image, **fields}
+        # The gallery is loaded by the duplicate check and then kept current by on_commit hooks.
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('userapp:register'), data).json()
+
+
+def balances(*accounts):
+    return [AccountModel.objects.get(id=account.id).balance for account in accounts]
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        self.sender, self.receiver = create_accounts(100, 50)
+
+    def test_transfer_moves_money(self):
+        transfers.transfer(self.sender.id, self.receiver.id, 30)
+        self.assertEqual(balances(self.sender, self.receiver), [70, 80])
+
+    def test_transfer_in_either_id_order(self):
+        transfers.transfer(self.receiver.id, self.sender.id, 50)
+        self.assertEqual(balances(self.sender, self.receiver), [150, 0])
+
+    def test_insufficient_funds_changes_nothing(self):
+        with self.assertRaises(transfers.InsufficientFunds):
+            transfers.transfer(self.sender.id, self.receiver.id, 101)
+        self.assertEqual(balances(self.sender, self.receiver), [100, 50])
+
+    def test_unknown_receiver_rolls_back_debit(self):
+        with self.assertRaises(transfers.AccountNotFound):
+            transfers.transfer(self.sender.id, self.receiver.id + 1000, 10)
+        self.assertEqual(balances(self.sender), [100])
+
+    def test_rejects_non_positive_amounts(self):
+        with self.assertRaises(transfers.TransferError):
+            transfers.transfer(self.sender.id, self.receiver.id, 0)
+
+    def test_stale_instances_do_not_lose_updates(self):
+        first = AccountModel.objects.get(id=self.sender.id)
+        second = AccountModel.objects.get(id=self.sender.id)
+        self.assertTrue(first.withdraw(30))
+        self.assertTrue(second.deposit(10))
+        self.assertEqual(second.balance, 80)
+        self.assertFalse(first.withdraw(1000))
+
+    def test_transaction_is_paid_once(self):
+        pending = TransactionModel.objects.create(
+            receiver_account_number=self.receiver.account_number, receiver_name='Bob',
+            account_number=self.sender, username=self.sender.username, branch_name=self.sender.branch_name,
+            amount=Decimal('25.00'), otp=1234)
+
+        transfers.execute_transaction(pending.id)
+        with self.assertRaises(transfers.AlreadyProcessed):
+            transfers.execute_transaction(pending.id)
+
+        self.assertEqual(balances(self.sender, self.receiver), [75, 75])
+        self.assertTrue(TransactionModel.objects.get(id=pending.id).is_verified)
+
+    def test_failed_transaction_stays_unverified(self):
+        pending = TransactionModel.objects.create(
+            receiver_account_number=self.receiver.account_number, receiver_name='Bob',
+            account_number=self.sender, username=self.sender.username, branch_name=self.sender.branch_name,
+            amount=Decimal('500.00'), otp=1234)
+
+        with self.assertRaises(transfers.InsufficientFunds):
+            transfers.execute_transaction(pending.id)
+        self.assertFalse(TransactionModel.objects.get(id=pending.id).is_verified)
+        self.assertEqual(balances(self.sender, self.receiver), [100, 50])
+
+    def test_verify_transaction_view_pays_once(self):
+        pending = TransactionModel.objects.create(
+            receiver_account_number=self.receiver.account_number, receiver_name='Bob',
+            account_number=self.sender, username=self.sender.username, branch_name=self.sender.branch_name,
+            amount=Decimal('40.00'), otp=4321)
+
+        for _ in range(2):
+            session = self.client.session
+            session['transaction_id'] = pending.id
+            session.save()
+            self.client.post('/verify_transaction/', {'otp': '4321'}, HTTP_ACCEPT='application/json')
+
+        self.assertEqual(balances(self.sender, self.receiver), [60, 90])
+
+    def test_loan_is_disbursed_once(self):
+        loan = LoanModel.objects.create(account_number=self.receiver, loan_amount=500,
+                                        branch_name=self.receiver.branch_name, username=self.receiver.username)
+
+        transfers.disburse_loan(loan.id)
+        with self.assertRaises(transfers.AlreadyProcessed):
+            transfers.disburse_loan(loan.id)
+
+        self.assertEqual(balances(self.receiver), [550])
+        self.assertEqual(LoanModel.objects.get(id=loan.id).status, 'Approved')
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.sender, self.receiver = create_accounts(100, 50)
+
+    def test_transfer_writes_both_sides(self):
+        transfers.transfer(self.sender.id, self.receiver.id, 30)
+        entries = LedgerEntryModel.objects.filter(source='Transfer').order_by('entry_type')
+        self.assertEqual([(e.account_number_id, e.entry_type, e.amount) for e in entries],
+                         [(self.receiver.id, 'Credit', 30), (self.sender.id, 'Debit', 30)])
+        self.assertEqual(ledger.reconcile(), [])
+
+    def test_failed_transfer_writes_nothing(self):
+        with self.assertRaises(transfers.InsufficientFunds):
+            transfers.transfer(self.sender.id, self.receiver.id, 500)
+        self.assertFalse(LedgerEntryModel.objects.filter(source='Transfer').exists())
+
+    def test_balance_as_of_uses_snapshot_and_tail(self):
+        transfers.transfer(self.sender.id, self.receiver.id, 30)
+        cutoff = timezone.now()
+        self.assertEqual(ledger.take_snapshots(cutoff), 2)
+        transfers.transfer(self.sender.id, self.receiver.id, 20)
+        self.sender.deposit(5)
+
+        self.assertEqual(BalanceSnapshotModel.objects.get(account_number=self.sender).balance, 70)
+        self.assertEqual(ledger.balance_as_of(self.sender.id, cutoff), 70)
+        self.assertEqual(ledger.balance_as_of(self.sender.id), 55)
+        self.assertEqual(ledger.balance_as_of(self.receiver.id), 100)
+        self.assertEqual(ledger.reconcile(), [])
+
+    def test_snapshots_carry_forward(self):
+        ledger.take_snapshots(timezone.now())
+        transfers.transfer(self.receiver.id, self.sender.id, 10)
+        ledger.take_snapshots(timezone.now())
+        latest = BalanceSnapshotModel.objects.order_by('-date').first().date
+        self.assertEqual(dict(BalanceSnapshotModel.objects.filter(date=latest).values_list('account_number_id', 'balance')),
+                         {self.sender.id: 110, self.receiver.id: 40})
+
+    def test_loan_is_recorded(self):
+        loan = LoanModel.objects.create(account_number=self.receiver, loan_amount=500,
+                                        branch_name=self.receiver.branch_name, username=self.receiver.username)
+        transfers.disburse_loan(loan.id)
+        self.assertEqual(LedgerEntryModel.objects.get(source='Loan').loan_id, loan.id)
+        self.assertEqual(ledger.reconcile(), [])
+
+
+class TransactionHistoryTests(TestCase):
+    def setUp(self):
+        self.sender, self.receiver = create_accounts(100, 50)
+        TransactionModel.objects.bulk_create([
+            TransactionModel(receiver_account_number=self.receiver.account_number, receiver_name='Bob',
+                             account_number=self.sender, username=self.sender.username,
+                             branch_name=self.sender.branch_name, amount=Decimal(n), otp=1234)
+            for n in range(1, 8)
+        ])
+        # Several rows share a timestamp so the id has to break ties.
+        start = timezone.now()
+        for n, t in enumerate(TransactionModel.objects.order_by('id')):
+            TransactionModel.objects.filter(id=t.id).update(date=start + timedelta(seconds=n // 3))
+        session = self.client.session
+        session['user_id'] = self.sender.username_id
+        session['branch_id'] = self.sender.branch_name_id
+        session.save()
+
+    def pages(self, url):
+        ids, cursor = [], None
+        while True:
+            params = {'page_size': 3, **({'cursor': cursor} if cursor else {})}
+            with self.assertNumQueries(2):  # the session and the page
+                body = self.client.get(url, params, HTTP_ACCEPT='application/json').json()
+            ids.extend(t['id'] for t in body['transaction_history'])
+            cursor = body['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_pages_cover_history_newest_first(self):
+        expected = list(TransactionModel.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(self.pages(reverse('userapp:user_transaction')), expected)
+        self.assertEqual(self.pages(reverse('branch_app:view_transaction')), expected)
+
+    def test_json_rows_carry_related_names(self):
+        body = self.client.get(reverse('userapp:user_transaction'), {'page_size': 1},
+                               HTTP_ACCEPT='application/json').json()
+        row = body['transaction_history'][0]
+        self.assertEqual((row['sender_account'], row['username'], row['branch_name'], row['amount']),
+                         (1000, 'alice', 'Main', 7.0))
+
+    def test_html_page_links_to_older(self):
+        response = self.client.get(reverse('branch_app:view_transaction'), {'page_size': 5})
+        self.assertEqual(len(response.context['transaction_history']), 5)
+        self.assertContains(response, 'Older transactions')
+
+    def test_html_links_keep_page_size(self):
+        response = self.client.get(reverse('userapp:user_transaction'), {'page_size': 2})
+        self.assertIsNotNone(response.context['next_cursor'])
+        self.assertContains(response, "&amp;page_size=2\" class=\"btn btn-outline-primary\">Older transactions")
+
+    def test_invalid_cursor_on_html_page_shows_newest(self):
+        response = self.client.get(reverse('branch_app:view_transaction'), {'cursor': 'nope', 'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([t.id for t in response.context['transaction_history']],
+                         list(TransactionModel.objects.order_by('-date', '-id').values_list('id', flat=True)[:3]))
+        self.assertContains(response, 'That page link is invalid')
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('userapp:user_transaction'), {'cursor': 'nope'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv_export_oldest_first(self):
+        rows = list(csv.DictReader(self.export(reverse('branch_app:transaction_export')).decode().splitlines()))
+        self.assertEqual([row['id'] for row in rows],
+                         [str(i) for i in TransactionModel.objects.order_by('date', 'id').values_list('id', flat=True)])
+        self.assertEqual(rows[0]['username'], 'alice')
+
+    def test_gzipped_ndjson_export(self):
+        body = gzip.decompress(self.export(reverse('userapp:user_transaction_export'), format='ndjson', gzip='1'))
+        self.assertEqual(len([json.loads(line) for line in body.splitlines()]), 7)
+
+    def test_export_date_range(self):
+        today = timezone.localdate()
+        before = str(today - timedelta(days=1))
+        self.assertEqual(len(self.export(reverse('userapp:user_transaction_export'), format='ndjson',
+                                         start=str(today)).splitlines()), 7)
+        self.assertEqual(self.export(reverse('userapp:user_transaction_export'), format='ndjson', end=before), b'')
+        response = self.client.get(reverse('userapp:user_transaction_export'), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_export_pages_through_tied_dates(self):
+        with self.assertNumQueries(5):  # the session and four pages
+            body = self.export(reverse('userapp:user_transaction_export'), format='ndjson')
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()],
+                         list(TransactionModel.objects.order_by('date', 'id').values_list('id', flat=True)))
+
+    @override_settings(EXPORT_CHUNK_SIZE=3)
+    async def test_asgi_export_streams_asynchronously(self):
+        self.async_client.cookies = self.client.cookies
+        response = await self.async_client.get(reverse('branch_app:transaction_export'), {'gzip': '1'})
+        self.assertTrue(response.is_async)
+        body = gzip.decompress(b''.join([chunk async for chunk in response.streaming_content]))
+        rows = list(csv.DictReader(body.decode().splitlines()))
+        self.assertEqual([int(row['id']) for row in rows], [id async for id in TransactionModel.objects.order_by(
+            'date', 'id').values_list('id', flat=True)])
+
+class ConcurrentTransferTests(TransactionTestCase):
+    def test_no_drift_under_concurrent_transfers(self):
+        accounts = create_accounts(*[100] * 4)
+        ids = [account.id for account in accounts]
+
+        done, refused = [], []
+
+        def worker(offset):
+            try:
+                for n in range(50):
+                    sender, receiver = ids[(n + offset) % 4], ids[(n + offset + 1) % 4]
+                    try:
+                        transfers.transfer(sender, receiver, 7)
+                        done.append(sender)
+                    except transfers.InsufficientFunds:
+                        refused.append(sender)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # No thread died on a database error, and some transfers went through.
+        self.assertEqual(len(done) + len(refused), 400)
+        self.assertTrue(done)
+        self.assertEqual(AccountModel.objects.filter(id__in=ids).aggregate(total=Sum('balance'))['total'], 400)
+        self.assertFalse(AccountModel.objects.filter(id__in=ids, balance__lt=0).exists())
+        # Every balance change that went through is in the ledger, and none other.
+        self.assertEqual(LedgerEntryModel.objects.filter(source='Transfer').count(), 2 * len(done))
+        for account in AccountModel.objects.filter(id__in=ids):
+            self.assertEqual(account.balance, ledger.balance_as_of(account.id))
+
+
+class EmbeddingBatcherTests(SimpleTestCase):
+    def batcher(self, run_batch):
+        # A long window so everything submitted below lands in one batch.
+        return EmbeddingBatcher(run_batch, max_batch_size=8, max_wait=0.2)
+
+    def test_requests_share_a_batch(self):
+        sizes = []
+
+        def run_batch(face_arrays):
+            sizes.append(len(face_arrays))
+            return [face_array * 2 for face_array in face_arrays]
+
+        results = self.batcher(run_batch).embed_many([np.full(3, n) for n in range(3)], timeout=5)
+        self.assertEqual(sizes, [3])
+        self.assertEqual([int(result[0]) for result in results], [0, 2, 4])
+
+    def test_bad_image_fails_only_its_own_request(self):
+        def run_batch(face_arrays):
+            if any(face_array[0] < 0 for face_array in face_arrays):
+                raise ValueError("bad frame")
+            return [face_array * 2 for face_array in face_arrays]
+
+        batcher = self.batcher(run_batch)
+        futures = [batcher.submit(np.full(3, n)) for n in (1, -1, 3)]
+        self.assertEqual(int(futures[0].result(timeout=5)[0]), 2)
+        with self.assertRaises(ValueError):
+            futures[1].result(timeout=5)
+        self.assertEqual(int(futures[2].result(timeout=5)[0]), 6)
+
+    def test_short_result_does_not_leave_callers_waiting(self):
+        def run_batch(face_arrays):
+            return [face_arrays[0]] if len(face_arrays) > 1 else []
+
+        batcher = self.batcher(run_batch)
+        futures = [batcher.submit(np.zeros(3)) for _ in range(3)]
+        for future in futures:
+            with self.assertRaises(RuntimeError):
+                future.result(timeout=5)
+
+    def test_full_queue_is_refused_and_waits_are_bounded(self):
+        started, release = threading.Event(), threading.Event()
+
+        def run_batch(face_arrays):
+            started.set()
+            release.wait(5)
+            return face_arrays
+
+        batcher = EmbeddingBatcher(run_batch, max_batch_size=1, max_wait=0, max_queued=2, timeout=0.05)
+        self.addCleanup(release.set)
+        batcher.submit(np.zeros(3))
+        started.wait(5)
+        queued = [batcher.submit(np.zeros(3)) for _ in range(2)]
+        with self.assertRaises(PoolBusy):
+            batcher.submit(np.zeros(3))
+        self.assertEqual(batcher.stats()['rejected'], 1)
+        with self.assertRaises(PoolBusy):
+            batcher.embed(np.zeros(3))
+
+        release.set()
+        with self.assertRaises(TimeoutError):
+            EmbeddingBatcher(lambda face_arrays: time.sleep(0.5) or face_arrays, timeout=0.05).embed(np.zeros(3))
+        for future in queued:
+            future.result(timeout=5)
+
+    def test_frames_of_a_refused_request_are_not_run(self):
+        started, release = threading.Event(), threading.Event()
+        seen = []
+
+        def run_batch(face_arrays):
+            started.set()
+            release.wait(5)
+            seen.extend(int(face_array[0]) for face_array in face_arrays)
+            return face_arrays
+
+        batcher = EmbeddingBatcher(run_batch, max_batch_size=1, max_wait=0, max_queued=2)
+        self.addCleanup(release.set)
+        batcher.submit(np.zeros(3))
+        started.wait(5)
+        with self.assertRaises(PoolBusy):
+            batcher.embed_many([np.full(3, n) for n in (1, 2, 3)])
+
+        release.set()
+        # Cancelled frames are dropped as the worker reaches them, without a model run.
+        self.assertEqual(int(batcher.embed_many([np.full(3, 4)], timeout=5, block=True)[0][0]), 4)
+        self.assertEqual(seen, [0, 4])
+
+
+def random_embeddings(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, 512)).astype(np.float32)
+
+
+class IVFIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.embeddings = random_embeddings(500)
+        self.index = IVFIndex.train(self.embeddings, np.arange(500) * 2, nlist=8, nprobe=8)
+
+    def test_search_finds_trained_vectors(self):
+        for row in (0, 123, 499):
+            self.assertEqual(self.index.search(self.embeddings[row], k=1)[0][0], row * 2)
+
+    def test_add_replace_and_remove(self):
+        extra = random_embeddings(200, seed=1)
+        for n, embedding in enumerate(extra):
+            self.index.add(10_000 + n, embedding)
+        self.assertEqual(self.index.search(extra[150], k=1)[0][0], 10_150)
+
+        # Replacing a trained vector hides the old one.
+        self.index.add(0, extra[0])
+        self.assertNotEqual(self.index.search(self.embeddings[0], k=1)[0][0], 0)
+
+        for n in range(0, 200, 2):
+            self.index.remove(10_000 + n)
+        self.assertNotIn(10_150, [id for id, _ in self.index.search(extra[150], k=5)])
+        self.assertEqual(self.index.search(extra[151], k=1)[0][0], 10_151)
+        self.assertEqual(self.index.search(extra[199], k=1)[0][0], 10_199)
+
+    def test_repeated_changes_do_not_grow_the_index(self):
+        for n in range(1000):
+            self.index.add(4, self.embeddings[n % 500])
+            self.index.remove(6)
+        self.assertEqual(self.index._dead.sum(), 2)
+        self.assertEqual(self.index.extra_ids(), [4])
+        self.assertEqual(self.index.search(self.embeddings[1], k=1)[0][0], 2)
+        self.assertEqual(self.index.search(self.embeddings[499], k=1)[0][0], 4)
+
+    def test_save_and_load(self):
+        self.index.meta = {'model': 'HashStub512'}
+        with tempfile.TemporaryDirectory() as path:
+            self.index.save(path)
+            loaded = IVFIndex.load(path)
+            self.assertEqual(loaded.meta, {'model': 'HashStub512'})
+            self.assertEqual(loaded.search(self.embeddings[42], k=1)[0][0], 84)
+
+
+class IVFReloadTests(TestCase):
+    def test_reload_resyncs_changes_since_build(self):
+        embeddings = random_embeddings(40)
+        users = [create_face_user(f'user{n}', embedding) for n, embedding in enumerate(embeddings[:30])]
+        with tempfile.TemporaryDirectory() as path:
+            call_command('build_face_ivf', output=path, nlist=4, stdout=io.StringIO())
+
+            users[0].embedding = embedding_codec.encode(embeddings[30])
+            users[0].save()
+            deleted = face_index.encode_key('user', users[1].id)
+            users[1].delete()
+            create_face_user('late', embeddings[31])
+
+            index = face_index.load_ivf_index(path)
+            self.assertEqual(index.search(embeddings[30], k=1)[0][0], face_index.encode_key('user', users[0].id))
+            self.assertNotEqual(index.search(embeddings[0], k=1)[0][0], face_index.encode_key('user', users[0].id))
+            self.assertNotIn(deleted, [id for id, _ in index.search(embeddings[1], k=5)])
+            self.assertEqual(index.search(embeddings[31], k=1)[0][0],
+                             face_index.encode_key('user', UserModel.objects.get(username='late').id))
+
+    def test_warm_up_loads_the_index(self):
+        embeddings = random_embeddings(20)
+        user = create_face_user('alice', embeddings[0], embedding_model='Facenet512/opencv')
+        for n, embedding in enumerate(embeddings[1:]):
+            create_face_user(f'user{n}', embedding, embedding_model='Facenet512/opencv')
+        self.addCleanup(setattr, face_index, '_ivf_loaded', False)
+        self.addCleanup(setattr, face_index, '_ivf_index', None)
+        with tempfile.TemporaryDirectory() as path, override_settings(FACE_IVF_INDEX_DIR=path):
+            call_command('build_face_ivf', output=path, nlist=2, stdout=io.StringIO())
+            with mock.patch.object(face_index, 'load_ivf_index', wraps=face_index.load_ivf_index) as load:
+                face_index.warm_up()
+                self.assertEqual(load.call_count, 1)
+                self.assertEqual(face_index.identify(embeddings[0], k=1)[0][:2], (face_index.USER, user.id))
+            self.assertEqual(load.call_count, 1)
+
+    @override_settings(FACE_GALLERY_SYNC_SECONDS=3600)
+    def test_loaded_index_syncs_other_workers_changes(self):
+        embeddings = random_embeddings(21)
+        users = [create_face_user(f'user{n}', embedding, embedding_model='Facenet512/opencv')
+                 for n, embedding in enumerate(embeddings[:20])]
+        self.addCleanup(setattr, face_index, '_ivf_loaded', False)
+        self.addCleanup(setattr, face_index, '_ivf_index', None)
+        with tempfile.TemporaryDirectory() as path, override_settings(FACE_IVF_INDEX_DIR=path):
+            call_command('build_face_ivf', output=path, nlist=2, stdout=io.StringIO())
+            face_index.warm_up()
+            late = create_face_user('late', embeddings[20], embedding_model='Facenet512/opencv')
+            deleted = users[0].id
+            users[0].delete()
+
+            self.assertNotEqual(face_index.identify(embeddings[20], k=1)[0][1], late.id)
+            self.assertEqual(face_index.identify(embeddings[20], k=1, fresh=True)[0][1], late.id)
+            self.assertNotIn(deleted, [pk for _, pk, _ in face_index.identify(embeddings[0], k=5)])
+
+    def test_index_for_another_model_is_rejected_once(self):
+        index = IVFIndex.train(random_embeddings(20), np.arange(20) * 2, nlist=2)
+        index.meta = {'model': 'SomeOtherModel'}
+        self.addCleanup(setattr, face_index, '_ivf_loaded', False)
+        with tempfile.TemporaryDirectory() as path, override_settings(FACE_IVF_INDEX_DIR=path):
+            index.save(path)
+            with mock.patch.object(IVFIndex, 'load', wraps=IVFIndex.load) as load, \
+                    self.assertLogs('userapp.face_index', 'WARNING'):
+                self.assertIsNone(face_index.get_ivf_index())
+                self.assertIsNone(face_index.get_ivf_index())
+            self.assertEqual(load.call_count, 1)
+
+
+class EnrollmentImageTests(StubEngineMixin, TestCase):
+    def test_face_photo_is_kept_out_of_media_with_an_opaque_name(self):
+        self.register('alice', face_jpeg(1, name='Alice Passport.jpg'))
+        name = UserModel.objects.get(username='alice').face_image.name
+        self.assertNotIn('Alice', name)
+        self.assertTrue(face_image_storage.exists(name))
+        self.assertTrue(face_image_storage.path(name).startswith(self.face_images.name))
+        self.assertFalse(os.path.exists(os.path.join(django_settings.MEDIA_ROOT, name)))
+
+
+class CalibrateThresholdTests(StubEngineMixin, SimpleTestCase):
+    def calibrate(self, layout, **options):
+        """``layout`` maps identity folders to the image seeds of their photos;
+        the stub engine gives the same photo the same embedding."""
+        dataset = tempfile.TemporaryDirectory()
+        self.addCleanup(dataset.cleanup)
+        for identity, seeds in layout.items():
+            os.makedirs(os.path.join(dataset.name, identity))
+            for n, seed in enumerate(seeds):
+                with open(os.path.join(dataset.name, identity, f'{n}.jpg'), 'wb') as f:
+                    f.write(face_jpeg(seed).read())
+        self.output = os.path.join(dataset.name, 'thresholds.json')
+        call_command('calibrate_face_threshold', dataset.name, output=self.output, metrics='cosine',
+                     stdout=io.StringIO(), **options)
+
+    def test_writes_threshold_meeting_target(self):
+        self.calibrate({'a': [1, 1], 'b': [2, 2]})
+        with open(self.output) as f:
+            self.assertIn('cosine', json.load(f)['HashStub512'])
+
+    def test_unreachable_target_writes_nothing(self):
+        # The same photo under two identities is an impostor pair at distance 0.
+        with self.assertRaisesMessage(CommandError, 'unreachable'):
+            self.calibrate({'a': [1, 1], 'b': [1, 2]}, target_far=0.001)
+        self.assertFalse(os.path.exists(self.output))
+
+
+class DistanceTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(distance, '_calibrated', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cosine_distance_ignores_scale(self):
+        a = np.array([1.0, 0.0, 0.0])
+        self.assertAlmostEqual(float(distance.find_distance(a, 3 * a, 'cosine')), 0.0, places=6)
+        self.assertAlmostEqual(float(distance.find_distance(a, [0.0, 2.0, 0.0], 'cosine')), 1.0, places=6)
+        self.assertAlmostEqual(float(distance.find_distance(a, -a, 'cosine')), 2.0, places=6)
+
+    def test_stacks_are_compared_row_wise(self):
+        probes = random_embeddings(4)
+        stored = random_embeddings(1, seed=1)[0]
+        distances = distance.find_distance(probes, stored, 'euclidean')
+        self.assertEqual(distances.shape, (4,))
+        for probe, expected in zip(probes, distances):
+            self.assertAlmostEqual(float(np.linalg.norm(probe - stored)), float(expected), places=3)
+
+    def test_verify_uses_the_model_threshold(self):
+        a = np.array([1.0, 0.0])
+        b = np.array([np.cos(0.8), np.sin(0.8)])  # cosine distance ~0.30
+        self.assertFalse(distance.verify(a, b, 'cosine', model='Facenet512')[0])
+        self.assertTrue(distance.verify(a, b, 'cosine', model='Facenet')[0])
+
+    def test_threshold_precedence(self):
+        self.assertEqual(distance.get_threshold('cosine', 'UnknownModel'), distance.THRESHOLDS['cosine'])
+        distance._calibrated = {'Facenet512': {'cosine': 0.25}}
+        self.assertEqual(distance.get_threshold('cosine', 'Facenet512'), 0.25)
+        with override_settings(FACE_MODEL_THRESHOLDS={'Facenet512': {'cosine': 0.2}}):
+            self.assertEqual(distance.get_threshold('cosine', 'Facenet512'), 0.2)
+
+    def test_tagged_models_use_their_model_threshold(self):
+        self.assertEqual(distance.get_threshold('cosine', 'Facenet/retinaface'),
+                         distance.MODEL_THRESHOLDS['Facenet']['cosine'])
+        with override_settings(FACE_MODEL_THRESHOLDS={'Facenet/retinaface': {'cosine': 0.2}}):
+            self.assertEqual(distance.get_threshold('cosine', 'Facenet/retinaface'), 0.2)
+            self.assertEqual(distance.get_threshold('cosine', 'Facenet/opencv'), 0.40)
+
+
+class EmbeddingCodecTests(TestCase):
+    def test_round_trip_is_a_read_only_float32_view(self):
+        embedding = random_embeddings(1)[0]
+        blob = embedding_codec.encode(embedding)
+        self.assertEqual(len(blob), 2056)
+        decoded = embedding_codec.decode(blob)
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertFalse(decoded.flags.writeable)
+        np.testing.assert_array_equal(decoded, embedding)
+
+    def test_rejects_malformed_blobs(self):
+        blob = embedding_codec.encode(np.ones(4))
+        for bad in (b'', b'PICKLE..', blob[:-1], blob[:4] + b'\x02\x00' + blob[6:], blob[:6] + b'\x05\x00' + blob[8:]):
+            with self.assertRaises(embedding_codec.EmbeddingFormatError):
+                embedding_codec.decode(bad)
+        self.assertFalse(embedding_codec.is_encoded(pickle.dumps([1.0, 2.0])))
+
+    def test_migration_converts_pickled_rows_both_ways(self):
+        migration = importlib.import_module('userapp.migrations.0007_float32_embeddings')
+        embedding = random_embeddings(1)[0].astype(float).tolist()
+        user = create_face_user('legacy', np.zeros(512))
+        UserModel.objects.filter(id=user.id).update(embedding=pickle.dumps(embedding))
+
+        migration.forwards(django_apps, None)
+        stored = UserModel.objects.get(id=user.id).embedding
+        np.testing.assert_allclose(embedding_codec.decode(stored), embedding, rtol=1e-6)
+
+        migration.forwards(django_apps, None)  # already converted rows are left alone
+        self.assertEqual(bytes(UserModel.objects.get(id=user.id).embedding), bytes(stored))
+
+        migration.backwards(django_apps, None)
+        np.testing.assert_allclose(pickle.loads(UserModel.objects.get(id=user.id).embedding), embedding, rtol=1e-6)
+
+
+@override_settings(FACE_GALLERY_SYNC_SECONDS=3600)
+class FaceGalleryTests(SimpleTestCase):
+    def setUp(self):
+        self.embeddings = random_embeddings(10)
+        self.gallery = face_index.FaceGallery(initial_capacity=4)
+        self.gallery._loaded = True
+        self.gallery._last_sync = time.monotonic()
+        for pk, embedding in enumerate(self.embeddings):
+            self.gallery.upsert(face_index.USER, pk, embedding)
+
+    def test_search_ranks_by_cosine_similarity(self):
+        matches = self.gallery.search(self.embeddings[7] * 5, k=3)
+        self.assertEqual(len(self.gallery), 10)
+        self.assertEqual(matches[0][:2], (face_index.USER, 7))
+        self.assertAlmostEqual(matches[0][2], 1.0, places=5)
+        self.assertEqual([score for *_, score in matches], sorted((score for *_, score in matches), reverse=True))
+
+    def test_upsert_replaces_and_remove_keeps_other_rows(self):
+        self.gallery.upsert(face_index.USER, 3, self.embeddings[0])
+        self.assertEqual(len(self.gallery), 10)
+        self.assertNotEqual(self.gallery.search(self.embeddings[3], k=1)[0][1], 3)
+
+        self.gallery.remove(face_index.USER, 0)
+        self.gallery.remove(face_index.USER, 0)
+        self.assertEqual(len(self.gallery), 9)
+        self.assertEqual(self.gallery.search(self.embeddings[9], k=1)[0][1], 9)
+        self.assertEqual(self.gallery.search(self.embeddings[0], k=1)[0][1], 3)
+
+
+@override_settings(FACE_GALLERY_SYNC_SECONDS=0)
+class FaceGallerySyncTests(StubEngineMixin, TestCase):
+    """Rows saved without running their on_commit hooks stand in for changes
+    made through another worker."""
+
+    def test_search_picks_up_other_workers_changes(self):
+        embeddings = random_embeddings(3)
+        alice = create_face_user('alice', embeddings[0], embedding_model='HashStub512')
+        self.assertEqual(face_index.identify(embeddings[0], k=1)[0][:2], (face_index.USER, alice.id))
+
+        bob = create_face_user('bob', embeddings[1], embedding_model='HashStub512')
+        self.assertEqual(face_index.identify(embeddings[1], k=1)[0][:2], (face_index.USER, bob.id))
+
+        alice.embedding = embedding_codec.encode(embeddings[2])
+        alice.save()
+        self.assertEqual(face_index.identify(embeddings[2], k=1)[0][:2], (face_index.USER, alice.id))
+
+        bob.delete()
+        UserModel.objects.filter(id=alice.id).update(embedding_model='LegacyStub512')
+        self.assertEqual(face_index.identify(embeddings[1], k=5), [])
+
+    @override_settings(FACE_GALLERY_SYNC_SECONDS=3600)
+    def test_sync_waits_for_the_interval(self):
+        embedding = random_embeddings(1)[0]
+        face_index.identify(embedding)
+        create_face_user('alice', embedding, embedding_model='HashStub512')
+        self.assertEqual(face_index.identify(embedding), [])
+        face_index.gallery._last_sync -= 3600
+        self.assertEqual(len(face_index.identify(embedding)), 1)
+
+
+class FaceIdentifyTests(StubEngineMixin, TestCase):
+    def identify(self, image):
+        return self.client.post(reverse('userapp:face_identify'), {'image': image}).json()
+
+    def test_logs_in_the_enrolled_face_without_a_username(self):
+        self.register('alice', face_jpeg(1))
+        self.register('bob', face_jpeg(2))
+
+        response = self.identify(face_jpeg(2))
+        self.assertTrue(response['success'])
+        self.assertEqual(response['username'], 'bob')
+        self.assertEqual(self.client.session['t_name'], 'bob')
+        self.assertFalse(self.identify(face_jpeg(3))['success'])
+
+    def test_deleted_user_is_dropped_from_the_gallery(self):
+        self.register('alice', face_jpeg(1))
+        self.assertTrue(self.identify(face_jpeg(1))['success'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserModel.objects.get(username='alice').delete()
+        self.assertEqual(len(face_index.gallery), 0)
+        self.assertFalse(self.identify(face_jpeg(1))['success'])
+
+
+class EmbeddingCacheTests(StubEngineMixin, TestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = EmbeddingCache(max_entries=2, ttl=60)
+        cache.set('a', np.zeros(2))
+        cache.set('b', np.ones(2))
+        cache.get('a')
+        cache.set('c', np.ones(2))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = EmbeddingCache(ttl=10)
+        with mock.patch('userapp.embedding_cache.time.monotonic', return_value=100.0):
+            cache.set('a', np.zeros(2))
+        with mock.patch('userapp.embedding_cache.time.monotonic', return_value=109.0):
+            self.assertIsNotNone(cache.get('a'))
+        with mock.patch('userapp.embedding_cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_retried_upload_skips_inference(self):
+        self.register('alice', face_jpeg(1))
+        with mock.patch.object(embedding_service, 'embed', wraps=embedding_service.embed) as embed:
+            for _ in range(2):
+                response = self.client.post(reverse('userapp:login'), {'username': 'alice', 'image': face_jpeg(1)})
+                self.assertEqual(response.json()['redirect'], '/userPage/')
+            self.assertEqual(embed.call_count, 0)
+            self.client.post(reverse('userapp:login'), {'username': 'alice', 'image': face_jpeg(2)})
+        self.assertEqual(embed.call_count, 1)
+
+
+def encode_image(size, fmt='JPEG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (120, 90, 60)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class ImageDecodeTests(StubEngineMixin, TestCase):
+    def assertRejected(self, reason, data, **limits):
+        with self.assertRaises(ImageRejected) as caught:
+            decode_face_image(data, **limits)
+        self.assertEqual(caught.exception.reason, reason)
+
+    def test_large_photo_is_downscaled(self):
+        face_array = decode_face_image(encode_image((4000, 3000)), max_side=1024)
+        self.assertEqual(face_array.dtype, np.uint8)
+        self.assertEqual(face_array.shape, (768, 1024, 3))
+
+    def test_bad_uploads_are_rejected_with_a_reason(self):
+        self.assertRejected('not_an_image', b'not an image at all')
+        self.assertRejected('unsupported_format', encode_image((64, 64), 'GIF'))
+        self.assertRejected('image_too_large', encode_image((400, 300)), max_pixels=10_000)
+        self.assertRejected('corrupt_image', encode_image((640, 480))[:2000])
+        with override_settings(FACE_MAX_UPLOAD_BYTES=100):
+            self.assertRejected('file_too_large', encode_image((64, 64)))
+
+    def test_rejection_reason_reaches_the_client(self):
+        upload = SimpleUploadedFile('face.jpg', b'not an image at all', content_type='image/jpeg')
+        response = self.client.post(reverse('userapp:register'), {'username': 'alice', 'image': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['reason'], 'not_an_image')
+        self.assertFalse(UserModel.objects.exists())
+
+
+@override_settings(FACE_DETECT_IN_QUALITY_CHECK=False)
+class FaceQualityTests(StubEngineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.noise = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+
+    def assertRejected(self, reason, rgb):
+        with self.assertRaises(ImageRejected) as caught:
+            face_quality.check_face_quality(rgb)
+        self.assertEqual(caught.exception.reason, reason)
+
+    def test_sharp_well_lit_frame_passes(self):
+        scores = face_quality.check_face_quality(self.noise)
+        self.assertGreater(scores['sharpness'], 30)
+
+    def test_poor_frames_are_rejected(self):
+        self.assertRejected('too_dark', self.noise // 8)
+        self.assertRejected('too_bright', 230 + self.noise // 16)
+        self.assertRejected('low_contrast', np.full((480, 640, 3), 128, dtype=np.uint8))
+        gradient = np.broadcast_to(np.linspace(0, 255, 640, dtype=np.uint8)[None, :, None], (480, 640, 3))
+        self.assertRejected('too_blurry', gradient)
+
+    @override_settings(FACE_DETECT_IN_QUALITY_CHECK=True)
+    def test_frames_need_a_large_enough_face(self):
+        with mock.patch.object(face_quality, 'largest_face', return_value=None):
+            self.assertRejected('no_face', self.noise)
+        # Boxes are found on the frame downsampled to 320x240 and scaled back up.
+        with mock.patch.object(face_quality, 'largest_face', return_value=(10, 10, 30, 30)):
+            self.assertRejected('face_too_small', self.noise)
+        with mock.patch.object(face_quality, 'largest_face', return_value=(10, 10, 100, 100)):
+            self.assertEqual(face_quality.check_face_quality(self.noise)['face_size'], 200)
+
+    @override_settings(FACE_QUALITY_CHECK=True)
+    def test_rejected_frame_never_reaches_the_model(self):
+        buffer = io.BytesIO()
+        Image.fromarray(self.noise // 8).save(buffer, 'PNG')
+        upload = SimpleUploadedFile('face.png', buffer.getvalue(), content_type='image/png')
+        with mock.patch.object(embedding_service, 'embed') as embed:
+            response = self.register('alice', upload)
+        self.assertEqual(response['reason'], 'too_dark')
+        embed.assert_not_called()
+
+
+class MultiFrameTests(StubEngineMixin, TestCase):
+    def login(self, *images):
+        return self.client.post(reverse('userapp:login_multi'), {'username': 'alice', 'images': list(images)})
+
+    def test_decision_uses_the_median_frame(self):
+        stored, other = random_embeddings(2)
+        rejected = ImageRejected('too_blurry', "Image is blurry.")
+
+        scores = views.score_frames(stored, [stored, other, other], 'HashStub512')
+        self.assertFalse(scores['verified'])
+        self.assertAlmostEqual(scores['best_similarity'], 1.0, places=5)
+
+        scores = views.score_frames(stored, [stored, rejected, stored, other], 'HashStub512')
+        self.assertTrue(scores['verified'])
+        self.assertEqual(scores['frames'][1], {'frame': 1, 'reason': 'too_blurry'})
+        self.assertIsNone(views.score_frames(stored, [rejected], 'HashStub512'))
+
+    def test_login_with_several_frames(self):
+        self.register('alice', face_jpeg(1))
+        with mock.patch.object(embedding_service, 'embed_many', wraps=embedding_service.embed_many) as embed_many:
+            response = self.login(face_jpeg(2), face_jpeg(3), face_jpeg(4)).json()
+        self.assertFalse(response['success'])
+        self.assertEqual(embed_many.call_count, 1)
+        self.assertNotIn('user_id', self.client.session)
+
+        response = self.login(face_jpeg(1), face_jpeg(1), face_jpeg(2)).json()
+        self.assertTrue(response['success'])
+        self.assertEqual(len(response['frames']), 3)
+        self.assertEqual(self.client.session['t_name'], 'alice')
+
+    @override_settings(FACE_MULTI_FRAME_MAX=2)
+    def test_too_many_frames_are_refused(self):
+        self.register('alice', face_jpeg(1))
+        self.assertEqual(self.login(face_jpeg(1), face_jpeg(1), face_jpeg(1)).status_code, 400)
+
+
+class InferenceProtocolTests(SimpleTestCase):
+    def test_request_round_trip(self):
+        face_arrays = [np.arange(2 * 3 * 3, dtype=np.uint8).reshape(2, 3, 3), np.full((4, 5), 7, dtype=np.uint8)]
+        decoded = inference_protocol.decode_request(inference_protocol.encode_request(face_arrays))
+        for sent, received in zip(face_arrays, decoded):
+            np.testing.assert_array_equal(sent, received)
+
+        with self.assertRaises(inference_protocol.ProtocolError):
+            inference_protocol.decode_request(inference_protocol.encode_request(face_arrays)[:-1])
+        with self.assertRaises(inference_protocol.ProtocolError):
+            inference_protocol.decode_request(b'XXXX\x00\x00')
+
+    def test_response_round_trip(self):
+        embeddings = random_embeddings(3)
+        status, decoded = inference_protocol.decode_response(inference_protocol.encode_response(embeddings))
+        self.assertEqual(status, inference_protocol.OK)
+        np.testing.assert_array_equal(decoded, embeddings)
+
+        error = inference_protocol.encode_error(inference_protocol.BUSY, "Pool is full.")
+        self.assertEqual(inference_protocol.decode_response(error), (inference_protocol.BUSY, "Pool is full."))
+
+
+class InferenceSidecarTests(StubEngineMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'inference.sock')
+        server = InferenceServer(self.path, InferenceRequestHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.client = InferenceClient(self.path, timeout=5)
+        self.face_arrays = [np.asarray(Image.open(face_jpeg(seed))) for seed in (1, 2)]
+
+    def test_embeddings_match_in_process_inference(self):
+        self.assertTrue(self.client.ping())
+        embeddings = self.client.embed_many(self.face_arrays)
+        np.testing.assert_allclose(embeddings, engines._engine.represent_batch(self.face_arrays), rtol=1e-6)
+        # The connection is kept open for the next request.
+        self.assertEqual(self.client.embed_many(self.face_arrays[:1]).shape, (1, 512))
+
+    def test_busy_sidecar_raises_pool_busy(self):
+        with mock.patch.object(embedding_service, 'get_service') as get_service:
+            get_service.return_value.embed_many.side_effect = PoolBusy("Queue is full.")
+            with self.assertRaises(PoolBusy):
+                self.client.embed_many(self.face_arrays)
+
+    def test_unreachable_sidecar_is_skipped_for_a_while(self):
+        client = InferenceClient(self.path + '.missing', retry_after=60)
+        with self.assertRaises(InferenceUnavailable):
+            client.embed_many(self.face_arrays)
+        with mock.patch.object(client, '_connect') as connect, self.assertRaises(InferenceUnavailable):
+            client.embed_many(self.face_arrays)
+        connect.assert_not_called()
+        self.assertFalse(client.ping())
+
+
+class DuplicateEnrollmentTests(StubEngineMixin, TestCase):
+    def test_duplicate_face_is_enrolled_and_flagged(self):
+        self.register('alice', face_jpeg(1))
+        self.register('bob', face_jpeg(1))
+        match = IdentityMatchModel.objects.get()
+        self.assertEqual((match.username, match.match_username), ('bob', 'alice'))
+        self.assertAlmostEqual(match.similarity, 1.0, places=5)
+        self.assertTrue(UserModel.objects.filter(username='bob').exists())
+
+    def test_re_enrolling_the_same_user_is_not_a_duplicate(self):
+        self.register('alice', face_jpeg(1))
+        self.register('alice', face_jpeg(1))
+        self.register('carol', face_jpeg(2))
+        self.assertFalse(IdentityMatchModel.objects.exists())
+
+    @override_settings(FACE_DUPLICATE_POLICY='reject', FACE_GALLERY_SYNC_SECONDS=3600)
+    def test_face_enrolled_through_another_worker_is_a_duplicate(self):
+        self.register('carol', face_jpeg(2))
+        # Saved without this process's on_commit hooks, as another worker would.
+        embedding = engines._engine.represent_batch([decode_face_image(face_jpeg(1).read())])[0]
+        create_face_user('alice', embedding, embedding_model='HashStub512')
+
+        response = self.client.post(reverse('userapp:register'), {'username': 'bob', 'image': face_jpeg(1)})
+        self.assertEqual(response.status_code, 409)
+
+    @override_settings(FACE_DUPLICATE_POLICY='reject')
+    def test_reject_policy_refuses_the_enrollment(self):
+        self.register('alice', face_jpeg(1))
+        response = self.client.post(reverse('userapp:register'), {'username': 'bob', 'image': face_jpeg(1)})
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn('alice', response.json()['message'])
+        self.assertFalse(UserModel.objects.filter(username='bob').exists())
+
+
+class InferencePoolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pool = InferencePool('userapp.engines.HashStubEngine', size=1, timeout=30)
+        cls.addClassCleanup(cls.pool.shutdown)
+        cls.pool.warm_up()
+
+    def test_workers_embed_like_the_engine(self):
+        face_arrays = [np.asarray(Image.open(face_jpeg(seed))) for seed in (1, 2)]
+        embeddings = self.pool.represent_batch(face_arrays)
+        np.testing.assert_allclose(embeddings, engines.HashStubEngine().represent_batch(face_arrays), rtol=1e-6)
+        stats = self.pool.stats()
+        self.assertTrue(stats['ready'])
+        self.assertEqual(stats['completed'], 1)
+
+    def test_files_are_decoded_in_the_worker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name) for name in ('face.jpg', 'notes.txt')]
+            with open(paths[0], 'wb') as f:
+                f.write(face_jpeg(1).read())
+            with open(paths[1], 'w') as f:
+                f.write("not a photo")
+            embedded, embeddings, errors = self.pool.submit_files(paths).result(timeout=30)
+        self.assertEqual(embedded, [0])
+        self.assertEqual(len(embeddings), 1)
+        self.assertIn(1, errors)
+
+
+class AsyncFaceViewTests(StubEngineMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.register('alice', face_jpeg(1))
+
+    async def login(self, image):
+        response = await self.async_client.post(reverse('userapp:login'), {'username': 'alice', 'image': image})
+        return response.json()
+
+    async def test_concurrent_logins(self):
+        responses = await asyncio.gather(*(self.login(face_jpeg(seed)) for seed in (1, 2, 1)))
+        self.assertEqual([response.get('redirect') for response in responses], ['/userPage/', None, '/userPage/'])
+
+    async def test_transaction_face_check_after_login(self):
+        await self.login(face_jpeg(1))
+        url = reverse('userapp:face_verification')
+        response = await self.async_client.post(url, {'image': face_jpeg(1)})
+        self.assertTrue(response.json()['success'])
+        response = await self.async_client.post(url, {'image': face_jpeg(2)})
+        self.assertFalse(response.json()['success'])
+
+    async def test_rejected_upload(self):
+        upload = SimpleUploadedFile('face.jpg', b'not an image at all', content_type='image/jpeg')
+        response = await self.async_client.post(reverse('userapp:login'), {'username': 'alice', 'image': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['reason'], 'not_an_image')
+
+
+class ModelWarmUpTests(StubEngineMixin, SimpleTestCase):
+    def test_model_is_built_and_warmed_once(self):
+        deepface = mock.MagicMock()
+        model = deepface.DeepFace.build_model.return_value
+        model.input_shape = (160, 160)
+        with mock.patch.dict('sys.modules', {'deepface': deepface}), \
+                mock.patch.object(face_model, '_models', {}), mock.patch.object(face_model, '_ready', threading.Event()):
+            self.assertFalse(face_model.is_ready())
+            threads = [threading.Thread(target=face_model.load_model) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertTrue(face_model.is_ready())
+        deepface.DeepFace.build_model.assert_called_once_with('Facenet512')
+        model.model.assert_called_once()
+        self.assertEqual(model.model.call_args[0][0].shape, (1, 160, 160, 3))
+
+    def test_batch_yields_one_embedding_per_image(self):
+        model = mock.MagicMock(output_shape=512)
+        with mock.patch.object(face_model, 'load_model', return_value=model), \
+                mock.patch.object(face_model, 'preprocess', return_value=np.zeros((1, 160, 160, 3))):
+            model.model.return_value = np.ones((3, 512))
+            self.assertEqual(face_model.represent_batch([None] * 3).shape, (3, 512))
+            # What a forward() that keeps only the first row would hand back.
+            model.model.return_value = np.ones((1, 512))
+            with self.assertRaises(RuntimeError):
+                face_model.represent_batch([None] * 3)
+        self.assertEqual(model.model.call_args[0][0].shape, (3, 160, 160, 3))
+
+    def test_status_endpoint_reports_readiness(self):
+        response = self.client.get(reverse('userapp:face_status'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['model'], 'HashStub512')
+        with mock.patch.object(engines.HashStubEngine, 'is_ready', return_value=False):
+            self.assertEqual(self.client.get(reverse('userapp:face_status')).status_code, 503)
+
+
+class LazyImportTests(SimpleTestCase):
+    def test_startup_does_not_import_the_face_stack(self):
+        script = ("import sys, django; django.setup(); import userapp.views, userapp.urls; "
+                  "from django.core.management import call_command; call_command('check'); "
+                  "print(sorted(m for m in sys.modules if m.split('.')[0] in ('deepface', 'tensorflow', 'cv2')))")
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'project.settings', 'FACE_MODEL_WARMUP': ''}
+        result = subprocess.run([sys.executable, '-c', script], cwd=django_settings.BASE_DIR, env=env,
+                                capture_output=True, text=True, timeout=60)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], '[]')
+
+
+class LegacyStubEngine(engines.HashStubEngine):
+    """Stands in for an older model whose embeddings don't match the current one's."""
+
+    name = 'LegacyStub512'
+
+    def represent_batch(self, face_arrays):
+        return -super().represent_batch(face_arrays)
+
+
+class EmbeddingEngineTests(StubEngineMixin, TestCase):
+    def test_stub_engine_is_deterministic(self):
+        face_arrays = [np.asarray(Image.open(face_jpeg(seed))) for seed in (1, 1, 2)]
+        embeddings = engines.HashStubEngine().represent_batch(face_arrays)
+        self.assertEqual((embeddings.shape, embeddings.dtype), ((3, 512), np.float32))
+        np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+        np.testing.assert_array_equal(embeddings[0], embeddings[1])
+        self.assertLess(abs(float(embeddings[0] @ embeddings[2])), 0.5)
+
+    @override_settings(FACE_EMBEDDING_ENGINE='userapp.engines.HashStubEngine',
+                       FACE_EMBEDDING_ENGINES={'LegacyStub512': 'userapp.tests.LegacyStubEngine'})
+    def test_engines_are_selected_by_setting_and_model_name(self):
+        with mock.patch.object(engines, '_engine', None), mock.patch.object(engines, '_engines', {}):
+            engine = engines.get_engine()
+            self.assertIsInstance(engine, engines.HashStubEngine)
+            self.assertIs(engines.get_engine(), engine)
+            self.assertIs(engines.get_engine('HashStub512'), engine)
+            self.assertIsInstance(engines.get_engine('LegacyStub512'), LegacyStubEngine)
+            self.assertIsInstance(engines.get_engine('Facenet'), engines.DeepFaceEngine)
+            self.assertEqual(engines.get_engine('Facenet').name, 'Facenet/opencv')
+
+    def test_deepface_tag_names_the_detector(self):
+        self.assertEqual(engines.DeepFaceEngine().name, 'Facenet512/opencv')
+        engine = engines.DeepFaceEngine('ArcFace/retinaface')
+        self.assertEqual(engine.name, 'ArcFace/retinaface')
+        with mock.patch.object(face_model, 'represent_batch') as represent_batch:
+            engine.represent_batch(['face'])
+        represent_batch.assert_called_once_with(['face'], 'ArcFace', 'retinaface')
+
+    def test_migration_tags_legacy_rows_with_their_detector(self):
+        migration = importlib.import_module('userapp.migrations.0014_embedding_model_detector')
+        create_face_user('alice', random_embeddings(1)[0], embedding_model='Facenet512')
+        create_face_user('bob', random_embeddings(1)[0], embedding_model='LegacyStub512')
+        migration.add_detector(django_apps, None)
+        tags = dict(UserModel.objects.values_list('username', 'embedding_model'))
+        self.assertEqual(tags, {'alice': 'Facenet512/opencv', 'bob': 'LegacyStub512'})
+        migration.remove_detector(django_apps, None)
+        self.assertEqual(UserModel.objects.get(username='alice').embedding_model, 'Facenet512')
+
+    @override_settings(FACE_EMBEDDING_ENGINES={'LegacyStub512': 'userapp.tests.LegacyStubEngine'})
+    def test_login_uses_the_engine_of_the_stored_embedding(self):
+        self.register('alice', face_jpeg(1))
+        face_array = np.asarray(Image.open(face_jpeg(1)))
+        UserModel.objects.filter(username='alice').update(
+            embedding=embedding_codec.encode(LegacyStubEngine().represent_batch([face_array])[0]),
+            embedding_model='LegacyStub512')
+
+        with mock.patch.object(engines, '_engines', {}):
+            response = self.client.post(reverse('userapp:login'), {'username': 'alice', 'image': face_jpeg(1)})
+        self.assertEqual(response.json()['redirect'], '/userPage/')
+
+
+class DuplicateClusteringTests(StubEngineMixin, TestCase):
+    def test_blocked_pairs_match_brute_force(self):
+        matrix = l2_normalize(random_embeddings(30))
+        matrix[[7, 12, 29]] = matrix[3]
+        threshold = 0.1
+        found = set()
+        for start in range(0, 30, 7):
+            pairs_i, pairs_j, _ = find_duplicate_faces.block_pairs(matrix, start, min(start + 7, 30), 7, threshold)
+            found |= set(zip(pairs_i.tolist(), pairs_j.tolist()))
+
+        similarity = matrix @ matrix.T
+        expected = {(i, j) for i in range(30) for j in range(i + 1, 30) if similarity[i, j] >= threshold}
+        self.assertEqual(found, expected)
+        self.assertIn((3, 7), found)
+
+    def test_clusters_are_connected_components(self):
+        clusters = find_duplicate_faces.connected_clusters(np.array([0, 1, 5]), np.array([1, 2, 6]))
+        self.assertEqual(sorted(sorted(members) for members in clusters.values()), [[0, 1, 2], [5, 6]])
+
+    def test_matrix_takes_the_stored_embedding_size(self):
+        embeddings = np.random.default_rng(0).standard_normal((2, 128)).astype(np.float32)
+        create_face_user('alice', embeddings[0], embedding_model='HashStub512')
+        create_face_user('alias', embeddings[0], embedding_model='HashStub512')
+        create_face_user('bob', embeddings[1], embedding_model='HashStub512')
+        create_face_user('odd', random_embeddings(1)[0], embedding_model='HashStub512')
+
+        with tempfile.TemporaryDirectory() as directory:
+            matrix, ids = find_duplicate_faces.stream_embeddings(directory)
+            self.assertEqual(matrix.shape[1], 128)
+            self.assertEqual(len(ids), 3)
+            del matrix
+        matches = face_index.identify(embeddings[1], k=5)
+        self.assertEqual([pk for _, pk, _ in matches][:1], [UserModel.objects.get(username='bob').id])
+        self.assertEqual(len(matches), 3)
+
+    def test_command_reports_and_records_duplicates(self):
+        embeddings = random_embeddings(4)
+        for n, username in enumerate(('alice', 'bob', 'carol')):
+            create_face_user(username, embeddings[n], embedding_model='HashStub512')
+        create_face_user('alias', embeddings[0], embedding_model='HashStub512')
+
+        with tempfile.TemporaryDirectory() as directory:
+            options = dict(work_dir=os.path.join(directory, 'work'), output=os.path.join(directory, 'pairs.csv'),
+                           clusters=os.path.join(directory, 'clusters.csv'), block_size=2, save=True,
+                           stdout=io.StringIO())
+            call_command('find_duplicate_faces', **options)
+            call_command('find_duplicate_faces', fresh=True, **options)
+            with open(options['output']) as f:
+                pairs = list(csv.DictReader(f))
+
+        self.assertEqual([(pair['username'], pair['match_username']) for pair in pairs], [('alice', 'alias')])
+        match = IdentityMatchModel.objects.get()
+        self.assertEqual((match.username, match.match_username, match.source), ('alice', 'alias', 'Batch'))
+
+
+class ReembedFacesTests(StubEngineMixin, TransactionTestCase):
+    def test_rows_on_another_model_are_re_embedded_once(self):
+        for seed, username in enumerate(('alice', 'bob'), 1):
+            create_face_user(username, np.ones(512), embedding_model='LegacyStub512', face_image=face_jpeg(seed))
+        create_face_user('carol', np.ones(512), embedding_model='LegacyStub512')
+        create_face_user('dave', np.ones(512), embedding_model='HashStub512', face_image=face_jpeg(3))
+
+        output = io.StringIO()
+        call_command('reembed_faces', batch_size=1, stdout=output)
+        self.assertIn('Re-embedded 2 faces', output.getvalue())
+        self.assertIn('1 rows have no enrollment image', output.getvalue())
+
+        for seed, username in enumerate(('alice', 'bob'), 1):
+            user = UserModel.objects.get(username=username)
+            self.assertEqual(user.embedding_model, 'HashStub512')
+            expected = engines._engine.represent_batch([np.asarray(Image.open(face_jpeg(seed)))])[0]
+            np.testing.assert_allclose(embedding_codec.decode(user.embedding), expected, atol=1e-6)
+        self.assertEqual(UserModel.objects.get(username='carol').embedding_model, 'LegacyStub512')
+        np.testing.assert_array_equal(embedding_codec.decode(UserModel.objects.get(username='dave').embedding), 1)
+
+        output = io.StringIO()
+        call_command('reembed_faces', stdout=output)
+        self.assertIn('Re-embedded 0 faces', output.getvalue())
+
+
+@override_settings(FACE_EMBEDDING_ENGINE='userapp.engines.HashStubEngine')
+class ImportCustomersTests(StubEngineMixin, TestCase):
+    COLUMNS = ['username', 'first_name', 'last_name', 'email', 'phone', 'image', 'account_number', 'branch',
+               'balance', 'family_username', 'family_name', 'family_email', 'family_phone', 'relationship',
+               'family_image']
+
+    def test_valid_rows_are_imported_and_bad_rows_reported(self):
+        BranchModel.objects.create(username='branch', bank_name='Bank', branch_name='Main', ifsc_code='IFSC0001',
+                                   address='-', city='-', state='-', country='-', postal_code=0,
+                                   contact_number='0', email='branch@example.com')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        for seed in (1, 2, 3):
+            with open(os.path.join(directory.name, f'{seed}.jpg'), 'wb') as f:
+                f.write(face_jpeg(seed).read())
+        rows = [
+            ['alice', 'Alice', 'A', 'a@example.com', '1', '1.jpg', '5001', 'Main', '100',
+             'kid', 'Kid', 'k@example.com', '2', 'Son', '3.jpg'],
+            ['bob', 'Bob', 'B', 'b@example.com', '1', '2.jpg'] + [''] * 9,
+            ['carol', 'Carol', 'C', 'c@example.com', 'abc', '2.jpg'] + [''] * 9,
+            ['dave', 'Dave', 'D', 'd@example.com', '1', 'missing.jpg'] + [''] * 9,
+            ['alice', 'Alice', 'A', 'a@example.com', '1', '1.jpg'] + [''] * 9,
+        ]
+        csv_path = os.path.join(directory.name, 'customers.csv')
+        with open(csv_path, 'w', newline='') as f:
+            csv.writer(f).writerows([self.COLUMNS] + rows)
+
+        call_command('import_customers', csv_path, workers=1, batch_size=2, chunk_size=2, stdout=io.StringIO())
+
+        self.assertEqual(sorted(UserModel.objects.values_list('username', flat=True)), ['alice', 'bob'])
+        alice = UserModel.objects.get(username='alice')
+        expected = engines._engine.represent_batch([np.asarray(Image.open(face_jpeg(1)))])[0]
+        np.testing.assert_allclose(embedding_codec.decode(alice.embedding), expected, atol=1e-6)
+        self.assertTrue(face_image_storage.exists(alice.face_image.name))
+        self.assertEqual(alice.familymodel_set.get().username, 'kid')
+        account = AccountModel.objects.get(account_number=5001)
+        self.assertEqual(account.balance, 100)
+        self.assertEqual(ledger.balance_as_of(account.id), 100)
+
+        with open(csv_path + '.errors.csv') as f:
+            errors = {row['line']: row['error'] for row in csv.DictReader(f)}
+        self.assertEqual(sorted(errors), ['4', '5', '6'])
+        self.assertEqual(errors['6'], "Username already exists")
+
+        # A rerun resumes after the last committed chunk instead of importing again.
+        output = io.StringIO()
+        call_command('import_customers', csv_path, workers=1, stdout=output)
+        self.assertIn('Resuming after line 6', output.getvalue())
+        self.assertEqual(UserModel.objects.count(), 2)
@@ -0,0 +1,95 @@
+from django.db import transaction
+from django.db.models import F
+
+from .ledger import debit_entry, credit_entry
+from .models import AccountModel, LoanModel, TransactionModel, LedgerEntryModel
+
+
+class TransferError(Exception):
+    pass
+
+
+class InsufficientFunds(TransferError):
+    pass
+
+
+class AccountNotFound(TransferError):
+    pass
+
+
+class AlreadyProcessed(TransferError):
+    pass
+
+
+# Balances only ever change through single-column conditional UPDATEs, so the
+# check and the change happen in the database in one statement: two concurrent
+# transfers can't both spend the same money, and no update is lost.
+
+def debit(account_id, amount):
+    """Takes ``amount`` from an account if it has that much. Returns False otherwise."""
+    return AccountModel.objects.filter(id=account_id, balance__gte=amount).update(
+        balance=F('balance') - amount) == 1
+
+
+def credit(account_id, amount):
+    return AccountModel.objects.filter(id=account_id).update(balance=F('balance') + amount) == 1
+
+
+def transfer(sender_id, receiver_id, amount, transaction_id=None):
+    """Moves ``amount`` between two accounts atomically and records both sides
+    in the ledger. Raises InsufficientFunds or AccountNotFound, in which case
+    nothing changed."""
+    if amount <= 0:
+        raise TransferError("Amount must be positive.")
+    if sender_id == receiver_id:
+        raise TransferError("Cannot transfer to the same account.")
+
+    with transaction.atomic():
+        # Rows are always updated in id order, so two opposite transfers
+        # can't deadlock waiting on each other's row locks.
+        if sender_id < receiver_id:
+            if not debit(sender_id, amount):
+                raise InsufficientFunds("Insufficient balance.")
+            if not credit(receiver_id, amount):
+                raise AccountNotFound("Receiver account not found.")
+        else:
+            if not credit(receiver_id, amount):
+                raise AccountNotFound("Receiver account not found.")
+            if not debit(sender_id, amount):
+                raise InsufficientFunds("Insufficient balance.")
+
+        LedgerEntryModel.objects.bulk_create([
+            debit_entry(sender_id, amount, 'Transfer', transaction_id=transaction_id),
+            credit_entry(receiver_id, amount, 'Transfer', transaction_id=transaction_id),
+        ])
+
+
+def execute_transaction(transaction_id):
+    """Marks an initiated TransactionModel as verified and moves its money, all
+    or nothing. A transaction that was already verified raises AlreadyProcessed,
+    so a repeated OTP submission can't pay twice."""
+    with transaction.atomic():
+        claimed = TransactionModel.objects.filter(id=transaction_id, is_verified=False).update(is_verified=True)
+        if not claimed:
+            raise AlreadyProcessed("Transaction already processed.")
+
+        sender_id, receiver_number, amount = TransactionModel.objects.values_list(
+            'account_number_id', 'receiver_account_number', 'amount').get(id=transaction_id)
+        receiver_id = AccountModel.objects.filter(account_number=receiver_number).values_list('id', flat=True).first()
+        if receiver_id is None:
+            raise AccountNotFound("Receiver account not found.")
+        # Balances are whole units; the fraction was always dropped on withdrawal.
+        transfer(sender_id, receiver_id, int(amount), transaction_id)
+
+
+def disburse_loan(loan_id):
+    """Approves a loan and credits its amount to the account in one step.
+    Raises AlreadyProcessed if it was approved before."""
+    with transaction.atomic():
+        approved = LoanModel.objects.filter(id=loan_id).exclude(status='Approved').update(status='Approved')
+        if not approved:
+            raise AlreadyProcessed("Loan already approved.")
+        account_id, amount = LoanModel.objects.values_list('account_number_id', 'loan_amount').get(id=loan_id)
+        if not credit(account_id, amount):
+            raise AccountNotFound("Loan account not found.")
+        credit_entry(account_id, amount, 'Loan', loan_id=loan_id).save()
@@ -7,6 +7,7 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('register/', views.register, name='register'),
     path('login/', views.login, name='login'),
+    path('login/multi/', views.login_multi_frame, name='login_multi'),
     path('userPage/', views.user_page, name='userPage'),
     path('userLogout', views.user_logout, name='userLogout'),
     path('addAccount', views.add_account, name='addAccount'),
@@ -14,10 +15,13 @@ urlpatterns = [
     path('applyLoan', views.apply_loan, name='applyLoan'),
     path('register_family/', views.register_family_member, name='register_family'),
     path('family_login/', views.family_login, name='family_login'),
+    path('face_identify/', views.face_identify, name='face_identify'),
     path('face_verification/', views.transaction_face_verification, name='face_verification'),
+    path('face_verification/multi/', views.transaction_face_verification_multi_frame, name='face_verification_multi'),
     path('initiate_transaction/', views.initiate_transaction, name='initiate_transaction'),
     path('verify_transaction/', views.verify_transaction, name='verify_transaction'),
     path('user_transaction', views.user_transaction_history, name='user_transaction'),
+    path('user_transaction/export', views.user_transaction_export, name='user_transaction_export'),
     path('user_complaint', views.add_user_complaint, name='user_complaint'),
     path('view_user_complaint_replay', views.view_user_complaint_replay, name='view_user_complaint_replay'),
     path('check_username/', views.check_username, name='check_username'),
@@ -27,4 +31,5 @@ urlpatterns = [
     path('api/mobile_register_family//', views.mobile_register_family_member, name='mobile_register_family'),
     path('check_family_username/', views.check_family_username, name='check_family_username'),
     path('family_details', views.get_family_details, name='family_details'),
+    path('face_status/', views.face_status, name='face_status'),
 ]
@@ -1,32 +1,172 @@
 from django.shortcuts import render, redirect
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from deepface import DeepFace
-from PIL import Image
+from django.conf import settings
 import numpy as np
-import pickle
 from .models import UserModel, AccountModel, LoanModel, FamilyModel, TransactionModel, UserComplaintModel
+from .ledger import credit_entry
+from .history import transaction_history_page, transaction_history_context, InvalidCursor, export_response
+from django.db import transaction as db_transaction
 from branchapp.models import BranchModel
 from django.contrib import messages
 import random
-from adminapp.views import send_email
+from adminapp.views import asend_email
+from . import distance, embedding_codec, embedding_service, transfers
+from .engines import get_engine
+from .face_index import identify, USER, FAMILY
+from .duplicates import find_duplicates, record_duplicates, duplicate_policy, REJECT
+from .inference_pool import PoolBusy
+from .embedding_cache import cache as embedding_cache
+from .image_decode import decode_face_image, max_upload_bytes, ImageRejected
+from .face_quality import check_face_quality
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import json
 
 
-SIMILARITY_THRESHOLD = 0.00001
+# Threads that async views hand face work to. They mostly wait on the
+# batcher, inference pool or sidecar, so this can be larger than the core count.
+face_executor = ThreadPoolExecutor(max_workers=getattr(settings, 'FACE_ASYNC_WORKERS', 32),
+                                   thread_name_prefix='face-async')
 
 
-def get_face_embedding(face_image):
-    """Extracts face embeddings using DeepFace."""
+def get_face_embedding(face_image, model=None):
+    """Extracts face embeddings with the configured embedding engine, or with
+    the engine of ``model`` when comparing against a row stored by another one."""
     try:
-        face_array = np.array(face_image)
-        embedding = DeepFace.represent(face_array, model_name="Facenet512", enforce_detection=False)
-        return embedding[0]["embedding"]
+        face_array = np.asarray(face_image)
+        return embedding_service.embed(face_array, model)
+    except PoolBusy:
+        print("⚠️ Face inference pool is full, rejecting request")
+        return None
     except Exception as e:
         print(f"⚠️ Error extracting face embedding: {e}")
         return None
 
 
+def prepare_upload(image_file, model=None):
+    """Returns (cache_key, cached_embedding, face_array) for an upload. On a
+    cache hit the image is not decoded and face_array is None; otherwise the
+    frame has been decoded and passed the quality gate."""
+    if image_file.size > max_upload_bytes():
+        raise ImageRejected('file_too_large', "Image file is too large.")
+
+    data = image_file.read()
+    key = embedding_cache.make_key(data, model or get_engine().name)
+    face_embedding = embedding_cache.get(key)
+    if face_embedding is not None:
+        return key, face_embedding, None
+
+    face_array = decode_face_image(data)
+    if getattr(settings, 'FACE_QUALITY_CHECK', True):
+        check_face_quality(face_array)
+    return key, None, face_array
+
+
+def embed_upload(image_file, model=None):
+    """Embeds an uploaded face image. Frames that fail the quality gate raise
+    ImageRejected before inference. Identical re-uploads (app retries after a
+    timeout) are answered from the content-hash cache without inference."""
+    key, face_embedding, face_array = prepare_upload(image_file, model)
+    if face_embedding is None:
+        face_embedding = get_face_embedding(face_array, model)
+        if face_embedding is not None:
+            embedding_cache.set(key, face_embedding)
+    return face_embedding
+
+
+def embed_uploads(image_files, model=None):
+    """Embeds several frames of one request with a single batched forward pass.
+    Returns, per frame, either its embedding or the ImageRejected that stopped it."""
+    results = [None] * len(image_files)
+    pending = []
+    for i, image_file in enumerate(image_files):
+        try:
+            key, face_embedding, face_array = prepare_upload(image_file, model)
+        except ImageRejected as e:
+            results[i] = e
+            continue
+        if face_embedding is None:
+            pending.append((i, key, face_array))
+        else:
+            results[i] = face_embedding
+
+    if pending:
+        embeddings = embedding_service.embed_many([face_array for _, _, face_array in pending], model)
+        for (i, key, _), face_embedding in zip(pending, embeddings):
+            embedding_cache.set(key, face_embedding)
+            results[i] = face_embedding
+    return results
+
+
+def score_frames(stored_embedding, results, model=None):
+    """Compares every accepted frame with the stored embedding in one vectorized
+    call. The decision uses the median distance, so one lucky frame can't pass
+    a login on its own."""
+    accepted = [i for i, result in enumerate(results) if not isinstance(result, ImageRejected)]
+    frames = [{'frame': i, 'reason': result.reason}
+              for i, result in enumerate(results) if isinstance(result, ImageRejected)]
+    if not accepted:
+        return None
+
+    distances = np.atleast_1d(distance.find_distance(np.stack([results[i] for i in accepted]), stored_embedding))
+    frames += [{'frame': i, 'similarity': float(1 - d)} for i, d in zip(accepted, distances)]
+    frames.sort(key=lambda frame: frame['frame'])
+
+    median_distance = float(np.median(distances))
+    return {
+        'verified': median_distance <= distance.get_threshold(model=model),
+        'best_similarity': float(1 - distances.min()),
+        'median_similarity': 1 - median_distance,
+        'frames': frames,
+    }
+
+
+def multi_frame_images(request):
+    image_files = request.FILES.getlist('images')
+    if not image_files:
+        return None, JsonResponse({"message": "Invalid data. Provide images.", "success": False}, status=400)
+    max_frames = getattr(settings, 'FACE_MULTI_FRAME_MAX', 5)
+    if len(image_files) > max_frames:
+        return None, JsonResponse({"message": f"Send at most {max_frames} images.", "success": False}, status=400)
+    return image_files, None
+
+
+def multi_frame_response(scores, redirect_to):
+    if scores is None:
+        return JsonResponse({"message": "No usable face in any frame.", "success": False}, status=400)
+
+    if scores['verified']:
+        message = "Face verified successfully!"
+    else:
+        message = f"Face verification failed. Similarity: {scores['median_similarity']:.2f}"
+    response = {"message": message, "success": scores['verified'],
+                "best_similarity": scores['best_similarity'],
+                "median_similarity": scores['median_similarity'],
+                "frames": scores['frames']}
+    if scores['verified']:
+        response['redirect'] = redirect_to
+    return JsonResponse(response)
+
+
+async def aembed_upload(image_file, model=None):
+    """embed_upload for async views: hashing, decoding and the wait for the
+    model run on the face executor so the event loop stays free."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(face_executor, embed_upload, image_file, model)
+
+
+def rejected_response(error):
+    return JsonResponse({"message": error.message, "reason": error.reason, "success": False}, status=400)
+
+
+def duplicate_response():
+    # Deliberately says nothing about which identity matched.
+    return JsonResponse({"message": "This face is already enrolled. Please contact your branch.",
+                         "reason": "duplicate_face", "success": False}, status=409)
+
+
 @csrf_exempt
 def register(request):
     if request.method == 'POST':
@@ -46,13 +186,21 @@ def register(request):
             return JsonResponse({"message": "Invalid data. Provide username and image."})
 
         # Process image
-        image = Image.open(image_file).convert("RGB")
-        face_embedding = get_face_embedding(image)
+        try:
+            face_embedding = embed_upload(image_file)
+        except ImageRejected as e:
+            return rejected_response(e)
         if face_embedding is None:
             return JsonResponse({"message": "Failed to extract face features."})
 
+        # Look for the same face under another identity
+        existing_id = UserModel.objects.filter(username=username).values_list('id', flat=True).first()
+        duplicates = find_duplicates(face_embedding, exclude=(USER, existing_id))
+        if duplicates and duplicate_policy() == REJECT:
+            return duplicate_response()
+
         # Store face embedding
-        embedding_binary = pickle.dumps(face_embedding)
+        embedding_binary = embedding_codec.encode(face_embedding)
 
         # Save user to database
         user_face, created = UserModel.objects.update_or_create(
@@ -67,9 +215,14 @@ def register(request):
                 'city': city,
                 'state': state,
                 'country': country,
-                'embedding': embedding_binary
+                'embedding': embedding_binary,
+                'embedding_model': get_engine().name,
+                'face_image': image_file,
             }
         )
+        if duplicates:
+            print(f"⚠️ Face of '{username}' matches {len(duplicates)} enrolled identities, flagged for review")
+            record_duplicates(USER, user_face, duplicates)
 
         if created:
             return JsonResponse({"message": "User registered successfully!", "redirect": "/login/"})
@@ -80,7 +233,7 @@ def register(request):
 
 
 @csrf_exempt
-def login(request):
+async def login(request):
 
     if request.method == 'POST':
         username = request.POST.get('username')
@@ -89,31 +242,66 @@ def login(request):
         if not username or not image_file:
             return JsonResponse({"message": "Invalid data. Provide username and image."})
 
-        image = Image.open(image_file).convert("RGB")
-        face_embedding = get_face_embedding(image)
-        if face_embedding is None:
-            return JsonResponse({"message": "Failed to extract face features."})
-
         try:
-            user_face = UserModel.objects.get(username=username)
-            stored_embedding = pickle.loads(user_face.embedding)
-            request.session['user_id'] = user_face.id
-            request.session['t_name'] = user_face.username
-            request.session['primary_user'] = True
-
+            user_face = await UserModel.objects.aget(username=username)
         except UserModel.DoesNotExist:
             return JsonResponse({"message": "User not found."})
 
-        result = DeepFace.verify(stored_embedding, face_embedding, model_name="Facenet512")
-        similarity = 1 - result['distance']
+        # The probe has to come from the same model as the stored embedding.
+        try:
+            face_embedding = await aembed_upload(image_file, user_face.embedding_model)
+        except ImageRejected as e:
+            return rejected_response(e)
+        if face_embedding is None:
+            return JsonResponse({"message": "Failed to extract face features."})
+
+        stored_embedding = embedding_codec.decode(user_face.embedding)
+        await request.session.aset('user_id', user_face.id)
+        await request.session.aset('t_name', user_face.username)
+        await request.session.aset('primary_user', True)
+
+        verified, face_distance = distance.verify(stored_embedding, face_embedding, model=user_face.embedding_model)
+        similarity = 1 - face_distance
 
-        if similarity > SIMILARITY_THRESHOLD:
+        if verified:
             return JsonResponse({"message": "Face verified successfully!", "redirect": "/userPage/"})
         else:
             return JsonResponse(
                 {"message": f"Face verification failed. Similarity: {similarity:.2f}", "success": False})
 
-    return render(request, 'user_login.html')
+    return await sync_to_async(render)(request, 'user_login.html')
+
+
+@csrf_exempt
+def login_multi_frame(request):
+    """Login with 3-5 frames in one multipart request (field name ``images``)."""
+    if request.method != 'POST':
+        return JsonResponse({"message": "Only POST allowed.", "success": False}, status=405)
+
+    username = request.POST.get('username')
+    image_files, error = multi_frame_images(request)
+    if error:
+        return error
+    if not username:
+        return JsonResponse({"message": "Invalid data. Provide username and images.", "success": False}, status=400)
+
+    try:
+        user_face = UserModel.objects.get(username=username)
+    except UserModel.DoesNotExist:
+        return JsonResponse({"message": "User not found.", "success": False})
+
+    try:
+        results = embed_uploads(image_files, user_face.embedding_model)
+    except Exception as e:
+        print(f"⚠️ Error extracting face embeddings: {e}")
+        return JsonResponse({"message": "Failed to extract face features.", "success": False})
+
+    scores = score_frames(embedding_codec.decode(user_face.embedding), results, user_face.embedding_model)
+    if scores is not None and scores['verified']:
+        request.session['user_id'] = user_face.id
+        request.session['t_name'] = user_face.username
+        request.session['primary_user'] = True
+    return multi_frame_response(scores, "/userPage/")
 
 
 def home(request):
@@ -179,7 +367,9 @@ def add_account(request):
                                         account_type=account_type,
                                         ifsc_code=ifsc_code,
                                         balance=balance)
-            account_data.save()
+            with db_transaction.atomic():
+                account_data.save()
+                credit_entry(account_data.id, int(balance), 'Opening').save()
             return redirect('userapp:userPage')
 
     return render(request, 'addAccount.html', {'branch': branch, 'user_data': user_data})
@@ -275,13 +465,19 @@ def register_family_member(request):
                 return JsonResponse({"message": "Invalid data. Provide username and image."})
 
             # Process image
-            image = Image.open(image_file).convert("RGB")
-            face_embedding = get_face_embedding(image)
+            try:
+                face_embedding = embed_upload(image_file)
+            except ImageRejected as e:
+                return rejected_response(e)
             if face_embedding is None:
                 return JsonResponse({"message": "Failed to extract face features."})
 
+            duplicates = find_duplicates(face_embedding)
+            if duplicates and duplicate_policy() == REJECT:
+                return duplicate_response()
+
             # Store face embedding
-            embedding_binary = pickle.dumps(face_embedding)
+            embedding_binary = embedding_codec.encode(face_embedding)
 
             try:
                 user = UserModel.objects.get(username=account_username)
@@ -296,8 +492,12 @@ def register_family_member(request):
                 email=email,
                 phone=phone,
                 relationship=relationship,
-                embedding=embedding_binary
+                embedding=embedding_binary,
+                embedding_model=get_engine().name,
+                face_image=image_file,
             )
+            if duplicates:
+                record_duplicates(FAMILY, family_member, duplicates)
 
             return JsonResponse({"message": "Family member registered successfully!", "redirect": "/userPage"})
 
@@ -307,7 +507,7 @@ def register_family_member(request):
 
 
 @csrf_exempt
-def family_login(request):
+async def family_login(request):
     print("[family_login] Function called", request.method)
 
     if request.method == 'POST':
@@ -323,7 +523,7 @@ def family_login(request):
             
         # Check if user exists before checking image
         try:
-            family_member = FamilyModel.objects.get(username=username)
+            family_member = await FamilyModel.objects.aget(username=username)
             print(f"[family_login] Found family member: {family_member.username}")
             
             # If we're just checking if user exists (no image provided)
@@ -332,25 +532,25 @@ def family_login(request):
                 return JsonResponse({"message": "Image is required for login.", "success": False}, status=400)
                 
             # Proceed with face verification if image is provided
-            image = Image.open(image_file).convert("RGB")
-            face_embedding = get_face_embedding(image)
+            face_embedding = await aembed_upload(image_file, family_member.embedding_model)
             
             if face_embedding is None:
                 print("[family_login] Failed to extract face features")
                 return JsonResponse({"message": "Failed to extract face features.", "success": False}, status=400)
                 
-            stored_embedding = pickle.loads(family_member.embedding)
+            stored_embedding = embedding_codec.decode(family_member.embedding)
             # Store session info
-            request.session['user_id'] = family_member.account_username.id
-            request.session['t_name'] = family_member.username
-            request.session['primary_user'] = False
+            await request.session.aset('user_id', family_member.account_username_id)
+            await request.session.aset('t_name', family_member.username)
+            await request.session.aset('primary_user', False)
             
             # Verify face
-            result = DeepFace.verify(stored_embedding, face_embedding, model_name="Facenet512")
-            similarity = 1 - result['distance']
+            verified, face_distance = distance.verify(stored_embedding, face_embedding,
+                                                      model=family_member.embedding_model)
+            similarity = 1 - face_distance
             print(f"[family_login] Face verification result: similarity = {similarity}")
             
-            if similarity > SIMILARITY_THRESHOLD:
+            if verified:
                 print("[family_login] Face verified successfully!")
                 return JsonResponse({"message": "Face verified successfully!", "redirect": "/userPage/", "success": True})
             else:
@@ -360,19 +560,67 @@ def family_login(request):
         except FamilyModel.DoesNotExist:
             print(f"[family_login] Family member not found: {username}")
             return JsonResponse({"message": f"Family member '{username}' not found.", "success": False}, status=404)
+        except ImageRejected as e:
+            print(f"[family_login] Image rejected: {e.reason}")
+            return rejected_response(e)
         except Exception as e:
             print(f"[family_login] Error during login: {str(e)}")
             return JsonResponse({"message": f"Login error: {str(e)}", "success": False}, status=500)
 
-    return render(request, 'family_login.html')
+    return await sync_to_async(render)(request, 'family_login.html')
 
 @csrf_exempt
-def transaction_face_verification(request):
-    u_username = request.session.get('t_name')
+def face_identify(request):
+    """Username-free login: matches the face against every enrolled user and family member."""
+    if request.method != 'POST':
+        return JsonResponse({"message": "Only POST allowed.", "success": False}, status=405)
+
+    image_file = request.FILES.get('image')
+    if not image_file:
+        return JsonResponse({"message": "Invalid data. Provide image.", "success": False}, status=400)
+
+    try:
+        face_embedding = embed_upload(image_file)
+    except ImageRejected as e:
+        return rejected_response(e)
+    if face_embedding is None:
+        return JsonResponse({"message": "Failed to extract face features.", "success": False}, status=400)
+
+    matches = identify(face_embedding, k=1)
+    if not matches:
+        return JsonResponse({"message": "Face not recognised.", "success": False})
+
+    kind, pk, similarity = matches[0]
+    if 1 - similarity > distance.get_threshold('cosine'):
+        return JsonResponse({"message": f"Face not recognised. Similarity: {similarity:.2f}", "success": False})
+
+    # The index of this worker may still hold a row another worker deleted.
+    if kind == USER:
+        user_face = UserModel.objects.filter(id=pk).first()
+        if user_face is None:
+            return JsonResponse({"message": "Face not recognised.", "success": False})
+        request.session['user_id'] = user_face.id
+        request.session['t_name'] = user_face.username
+        request.session['primary_user'] = True
+    else:
+        family_member = FamilyModel.objects.filter(id=pk).first()
+        if family_member is None:
+            return JsonResponse({"message": "Face not recognised.", "success": False})
+        request.session['user_id'] = family_member.account_username_id
+        request.session['t_name'] = family_member.username
+        request.session['primary_user'] = False
+
+    return JsonResponse({"message": "Face verified successfully!", "redirect": "/userPage/", "success": True,
+                         "username": request.session['t_name']})
+
+
+@csrf_exempt
+async def transaction_face_verification(request):
+    u_username = await request.session.aget('t_name')
     try:
-        user_data = UserModel.objects.get(username=u_username)
+        user_data = await UserModel.objects.aget(username=u_username)
     except:
-        user_data = FamilyModel.objects.get(username=u_username)
+        user_data = await FamilyModel.objects.aget(username=u_username)
 
     if request.method == 'POST':
         image_file = request.FILES.get('image')
@@ -381,34 +629,62 @@ def transaction_face_verification(request):
             return JsonResponse({"message": "Invalid data. Provide image."})
 
         # Process image
-        image = Image.open(image_file).convert("RGB")
-        face_embedding = get_face_embedding(image)
+        try:
+            face_embedding = await aembed_upload(image_file, user_data.embedding_model)
+        except ImageRejected as e:
+            return rejected_response(e)
         if face_embedding is None:
             return JsonResponse({"message": "Failed to extract face features."})
 
         try:
 
-            stored_embedding = pickle.loads(user_data.embedding)
+            stored_embedding = embedding_codec.decode(user_data.embedding)
 
         except (UserModel.DoesNotExist, FamilyModel.DoesNotExist):
             return JsonResponse({"message": "Face not exists."})
 
         # Verify face match
-        result = DeepFace.verify(stored_embedding, face_embedding, model_name="Facenet512")
-        similarity = 1 - result['distance']
+        verified, face_distance = distance.verify(stored_embedding, face_embedding, model=user_data.embedding_model)
+        similarity = 1 - face_distance
 
-        if similarity > SIMILARITY_THRESHOLD:
+        if verified:
             return JsonResponse({"message": "Face verified successfully!", "success": True, "redirect": "/verify_transaction/"})
         else:
             return JsonResponse({"message": f"Face verification failed. Similarity: {similarity:.2f}", "success": False})
 
-    return render(request, 'transaction_face_verification.html')
+    return await sync_to_async(render)(request, 'transaction_face_verification.html')
 
 
 @csrf_exempt
-def initiate_transaction(request):
-    u_id = request.session.get('user_id')
-    user_data = UserModel.objects.get(id=u_id)
+def transaction_face_verification_multi_frame(request):
+    """Transaction face check with several frames in one multipart request (field name ``images``)."""
+    if request.method != 'POST':
+        return JsonResponse({"message": "Only POST allowed.", "success": False}, status=405)
+
+    u_username = request.session.get('t_name')
+    user_data = (UserModel.objects.filter(username=u_username).first()
+                 or FamilyModel.objects.filter(username=u_username).first())
+    if user_data is None:
+        return JsonResponse({"message": "Face not exists.", "success": False})
+
+    image_files, error = multi_frame_images(request)
+    if error:
+        return error
+
+    try:
+        results = embed_uploads(image_files, user_data.embedding_model)
+    except Exception as e:
+        print(f"⚠️ Error extracting face embeddings: {e}")
+        return JsonResponse({"message": "Failed to extract face features.", "success": False})
+
+    scores = score_frames(embedding_codec.decode(user_data.embedding), results, user_data.embedding_model)
+    return multi_frame_response(scores, "/verify_transaction/")
+
+
+@csrf_exempt
+async def initiate_transaction(request):
+    u_id = await request.session.aget('user_id')
+    user_data = await UserModel.objects.aget(id=u_id)
     user_account = AccountModel.objects.all().filter(username=user_data.id)
     family = FamilyModel.objects.all().filter(username=user_data.id)
 
@@ -416,9 +692,9 @@ def initiate_transaction(request):
         receiver_account_number = request.POST['receiver_account_number']
         receiver_name = request.POST['receiver_name']
         account_number_ = request.POST['account_number']
-        account_number = AccountModel.objects.get(id=account_number_)
+        account_number = await AccountModel.objects.aget(id=account_number_)
         branch_name_ = request.POST['branch_name']
-        branch_name = BranchModel.objects.get(id=branch_name_)
+        branch_name = await BranchModel.objects.aget(id=branch_name_)
         amount = request.POST['amount']
         # family_name_ = request.POST['family_name']
 
@@ -433,7 +709,7 @@ def initiate_transaction(request):
 
         otp = random.randint(100000, 999999)
 
-        transaction = TransactionModel.objects.create(
+        transaction = await TransactionModel.objects.acreate(
             receiver_account_number=receiver_account_number,
             receiver_name=receiver_name,
             account_number=account_number,
@@ -447,12 +723,13 @@ def initiate_transaction(request):
         s = "OTP Verification code"
         m = f'otp : {otp}'
         e = user_data.email
-        send_email(s, m, e)
+        await asend_email(s, m, e)
 
-        request.session['transaction_id'] = transaction.id
+        await request.session.aset('transaction_id', transaction.id)
         return redirect('userapp:face_verification')
 
-    return render(request, 'initiate_transaction.html', {'user_account': user_account, 'family': family})
+    # The template iterates the querysets, so render off the event loop.
+    return await sync_to_async(render)(request, 'initiate_transaction.html', {'user_account': user_account, 'family': family})
 
 @csrf_exempt
 def verify_transaction(request):
@@ -470,14 +747,14 @@ def verify_transaction(request):
     if request.method == 'POST':
         entered_otp = int(request.POST['otp'])
         if entered_otp == transaction.otp:
-            transaction.is_verified = True
-            transaction.save()
-
-            sender_account = transaction.account_number
-            sender_account.withdraw(int(transaction.amount))
-
-            receiver_account = AccountModel.objects.get(account_number=transaction.receiver_account_number)
-            receiver_account.deposit(transaction.amount)
+            try:
+                transfers.execute_transaction(transaction.id)
+            except transfers.TransferError as e:
+                del request.session['transaction_id']
+                if request.headers.get('accept') == 'application/json':
+                    return JsonResponse({"success": False, "message": str(e)})
+                messages.error(request, str(e))
+                return redirect('userapp:initiate_transaction')
 
             success = True
             del request.session['transaction_id']
@@ -497,29 +774,27 @@ def verify_transaction(request):
 @csrf_exempt
 def user_transaction_history(request):
     u_id = request.session.get('user_id')
-    user_data = UserModel.objects.get(id=u_id)
-    transaction_history = TransactionModel.objects.all().filter(username=user_data)
+    transactions = TransactionModel.objects.filter(username_id=u_id)
 
-    # Return JSON if requested by mobile app
+    # Return JSON if requested by mobile app, one page at a time (?cursor=&page_size=)
     if request.headers.get('accept') == 'application/json':
-        return JsonResponse({
-            'transaction_history': [
-                {
-                    'id': t.id,
-                    'sender_account': t.account_number.account_number,
-                    'username': t.username.username,
-                    'receiver_account_number': t.receiver_account_number,
-                    'receiver_name': t.receiver_name,
-                    'branch_name': t.branch_name.branch_name,
-                    'amount': float(t.amount),
-                    'is_verified': t.is_verified,
-                    'date': t.date.strftime('%Y-%m-%d %H:%M:%S'),
-                }
-                for t in transaction_history
-            ]
-        })
+        try:
+            return JsonResponse(transaction_history_page(request, transactions))
+        except InvalidCursor as e:
+            return JsonResponse({"message": str(e), "success": False}, status=400)
+
+    return render(request, 'view_transaction.html', {**transaction_history_context(request, transactions),
+                                                     'branch': False})
 
-    return render(request, 'view_transaction.html', {'transaction_history': transaction_history, 'branch': False})
+
+def user_transaction_export(request):
+    u_id = request.session.get('user_id')
+    if not u_id:
+        return redirect('userapp:login')
+    try:
+        return export_response(request, TransactionModel.objects.filter(username_id=u_id), 'statement')
+    except ValueError as e:
+        return JsonResponse({"message": str(e), "success": False}, status=400)
 
 @csrf_exempt
 def add_user_complaint(request):
@@ -597,10 +872,20 @@ def get_branches(request):
     return JsonResponse({'error': 'Invalid request method'}, status=405)
 
 
+def face_status(request):
+    """Readiness check for load balancers: reports whether the face model is warmed up,
+    along with the micro-batching, inference pool and embedding cache counters."""
+    ready = embedding_service.is_ready()
+    return JsonResponse({
+        'model': get_engine().name,
+        'ready': ready,
+        **embedding_service.stats(),
+        'embedding_cache': embedding_cache.stats(),
+    }, status=200 if ready else 503)
+
+
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
-from PIL import Image
-import pickle
 
 @csrf_exempt
 def mobile_register_family_member(request):
@@ -659,22 +944,29 @@ def mobile_register_family_member(request):
 
     # Process image and embedding
     try:
-        print("Opening and processing image...")
-        image = Image.open(image_file).convert("RGB")
-        print("Extracting face embedding...")
-        face_embedding = get_face_embedding(image)
+        print("Decoding image and extracting face embedding...")
+        face_embedding = embed_upload(image_file)
         if face_embedding is None:
             print("Error: Failed to extract face features")
             return JsonResponse({"message": "Failed to extract face features."}, status=400)
         print("Creating binary embedding...")
-        embedding_binary = pickle.dumps(face_embedding)
+        embedding_binary = embedding_codec.encode(face_embedding)
         print("Embedding successfully created")
+    except ImageRejected as e:
+        print(f"Image rejected: {e.reason}")
+        return rejected_response(e)
     except Exception as e:
         print(f"Error processing image: {e}")
         import traceback
         traceback.print_exc()
         return JsonResponse({"message": f"Image processing error: {e}"}, status=400)
 
+    # Look for the same face under another identity
+    duplicates = find_duplicates(face_embedding)
+    print(f"Possible duplicate identities: {len(duplicates)}")
+    if duplicates and duplicate_policy() == REJECT:
+        return duplicate_response()
+
     # Save family member
     print("Saving family member to database...")
     try:
@@ -685,9 +977,13 @@ def mobile_register_family_member(request):
             email=email,
             phone=phone,
             relationship=relationship,
-            embedding=embedding_binary
+            embedding=embedding_binary,
+            embedding_model=get_engine().name,
+            face_image=image_file,
         )
         print(f"Family member created with ID: {family_member.id}")
+        if duplicates:
+            record_duplicates(FAMILY, family_member, duplicates)
     except Exception as e:
         print(f"Error creating family member: {e}")
         import traceback